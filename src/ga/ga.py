@@ -4,7 +4,9 @@ from copy import deepcopy
 
 import numpy as np
 
+from model.population import PopulationBatch
 from model.problem import Problem
+from model.route_cache import RouteCache
 from model.solution import Solution
 from solution_checker import SolutionChecker
 
@@ -17,17 +19,34 @@ class GA:
     Genetic Algorithm for solving the problem of optimizing courier and vehicle assignments.
     This class implements the genetic algorithm with crossover and mutation operations to find
     optimal solutions for the given problem.
+    In penalty mode, only the structural constraints are enforced and the fitness of an
+    individual adds its weighted constraint violations to its cost. The weight of a
+    constraint grows when the best individual has violated it for penalty_window
+    generations in a row and shrinks when it has satisfied it for as long, staying within
+    a factor penalty_range of its initial value, so that the search moves through
+    slightly infeasible solutions instead of discarding them.
     Attributes:
         problem (Problem): The problem instance containing couriers, vehicles, and packages.
         checker (SolutionChecker): An instance to check the feasibility of solutions.
         C (float): A constant used in cost calculation.
         alpha (float): A parameter used in delay cost calculation.
         initial_population (list[Solution]): The initial population of solutions to start the algorithm.
+        route_cache (RouteCache | None): Route evaluations shared by all the solutions of the run, bounded to route_cache_size bytes. Off unless route_cache_size is given.
+        neighbours (np.ndarray | None): Nearest neighbours of every node the mutations keep their moves to, when n_neighbours is given.
+        penalty (bool): Whether infeasible individuals are penalized rather than discarded.
+        penalty_weight (float | None): Initial weight of every constraint violation, None for the mean cost of the initial population.
+        penalty_weights (np.ndarray | None): Current weight of every constraint of SolutionChecker.violation_names, in penalty mode.
     Methods:
         get_cost(solution: Solution) -> float:
             Calculate the cost of a given solution.
+        get_costs(batch: PopulationBatch) -> np.ndarray:
+            Calculate the costs of a whole population in one vectorized pass.
+        get_violations(batch: PopulationBatch) -> np.ndarray:
+            Measure the constraint violations of a whole population, in penalty mode.
         crossover(s1: Solution, s2: Solution) -> tuple[Solution, Solution]:
             Perform crossover between two solutions to create new solutions.
+        crossover_many(parents: list[tuple[Solution, Solution]]) -> list[tuple[Solution, Solution]]:
+            Perform crossover between many pairs of solutions, screening the offspring in batches.
         mutation(solution: Solution) -> Solution:
             Apply mutation to a solution to create a new solution.
         run(max_iter=1000) -> tuple[Solution, Solution]:
@@ -37,12 +56,21 @@ class GA:
     crossok = 0
     crossnok = 0
 
+    penalty_window = 3
+    penalty_increase = 2.0
+    penalty_decrease = 1.5
+    penalty_range = 1e3
+
     def __init__(
         self,
         problem: Problem,
         initial_population: list[Solution],
         C,
         alpha,
+        route_cache_size: int | None = 0,
+        n_neighbours: int | None = None,
+        penalty: bool = False,
+        penalty_weight: float | None = None,
     ):
         self.initial_population = initial_population
         self.mutations: list[type[Mutation]] = [
@@ -59,6 +87,21 @@ class GA:
         self.C = C
         self.alpha = alpha
 
+        self.route_cache = None
+        if route_cache_size:
+            self.route_cache = RouteCache(route_cache_size)
+
+        self.neighbours = None
+        if n_neighbours:
+            self.neighbours = problem.get_neighbours(n_neighbours)
+
+        self.penalty = penalty
+        self.penalty_weight = penalty_weight
+        self.penalty_weights = None
+        self._initial_weight = None
+        self._violated: list[np.ndarray] = []
+        self._best_feasible: tuple[float, Solution] | None = None
+
         self._cost_function_runs = 0
 
     @functools.cache
@@ -73,10 +116,10 @@ class GA:
         :param solution: Solution to calculate the cost for
         :return: Total cost of the solution
         """
-        c_i = np.array([c.hourly_rate / 60 for c in self.problem.couriers])
-        p_j = np.array([v.fuel_consumption for v in self.problem.vehicles])
+        c_i = self.problem.c_i / 60
+        p_j = self.problem.p_j
 
-        a_k = np.array([p.start_time for p in self.problem.packages])
+        a_k = self.problem.a_k
 
         rates = solution.get_t_i() @ c_i
         fuel_cost = self.C * (p_j @ solution.get_d_j())
@@ -86,6 +129,94 @@ class GA:
 
         return rates + fuel_cost + delay
 
+    def get_costs(self, batch: PopulationBatch):
+        """
+        Calculate the cost of every individual of a population, as in get_cost.
+
+        :param batch: Population to calculate the costs for
+        :return: Fitness vector with the total cost of every individual
+        """
+        c_i = self.problem.c_i / 60
+        p_j = self.problem.p_j
+
+        a_k = self.problem.a_k
+
+        # row-wise dot products add up in the same order as get_cost
+        rates = np.vecdot(batch.get_t_pi(), c_i)
+        fuel_cost = self.C * np.vecdot(batch.get_d_pj(), p_j)
+        delay = (
+            self.alpha
+            / self.problem.n_packages
+            * np.sum(batch.get_v_pk() - a_k, axis=1)
+        )
+
+        self._cost_function_runs += len(batch)
+
+        return rates + fuel_cost + delay
+
+    def get_violations(self, batch: PopulationBatch):
+        """
+        Measure the constraint violations of every individual of a population.
+
+        :param batch: Population to measure
+        :return: Matrix with the violation of every constraint of SolutionChecker.violation_names
+                 by every individual, without columns outside of penalty mode
+        """
+        if not self.penalty:
+            return np.zeros((len(batch), 0))
+
+        violations = self.checker.violations_batch(batch.x_pjv, batch.y_pk, batch.z_pj)
+        return np.column_stack(
+            [violations[name] for name in self.checker.violation_names]
+        )
+
+    def _sort(
+        self, solutions: list[Solution], costs: np.ndarray, violations: np.ndarray
+    ):
+        """Sorts a population by the fitness vector of its individuals, their costs plus
+        their weighted violations in penalty mode.
+        """
+        fitness = costs + violations @ self.penalty_weights if self.penalty else costs
+        order = np.argsort(fitness, kind="stable")
+        return [solutions[o] for o in order], costs[order], violations[order]
+
+    def _adapt_penalties(self, violations: np.ndarray):
+        """Updates the penalty weights from the violations of the best individual."""
+        self._violated = [*self._violated, violations > 0][-self.penalty_window :]
+        if len(self._violated) < self.penalty_window:
+            return
+
+        recent = np.array(self._violated)
+        weights = self.penalty_weights
+        weights[recent.all(axis=0)] *= self.penalty_increase
+        weights[~recent.any(axis=0)] /= self.penalty_decrease
+        np.clip(
+            weights,
+            self._initial_weight / self.penalty_range,
+            self._initial_weight * self.penalty_range,
+            out=weights,
+        )
+
+    def _best(
+        self, solutions: list[Solution], costs: np.ndarray, violations: np.ndarray
+    ):
+        """Returns the best solution of a sorted population, in penalty mode the best
+        feasible solution found so far, or the best individual until one is found.
+        """
+        if not self.penalty:
+            return solutions[0]
+
+        # feasible individuals are sorted by cost, the first one is the cheapest
+        feasible = np.flatnonzero(~violations.any(axis=1))
+        if feasible.size and (
+            self._best_feasible is None or costs[feasible[0]] < self._best_feasible[0]
+        ):
+            self._best_feasible = (costs[feasible[0]], solutions[feasible[0]])
+
+        if self._best_feasible is None:
+            return solutions[0]
+        return self._best_feasible[1]
+
     def crossover(self, s1: Solution, s2: Solution):
         """Perform crossover between two solutions.
         This method attempts to create two new solutions by combining the couriers and vehicles
@@ -99,14 +230,64 @@ class GA:
             tuple: A tuple containing two new solutions (a, b). If crossover fails after 10 attempts,
                    returns (None, None).
         """
+        return self.crossover_many([(s1, s2)])[0]
+
+    def crossover_many(self, parents: list[tuple[Solution, Solution]]):
+        """Perform crossover between many pairs of solutions.
+        The offspring of every pair are generated first and then checked all at once with
+        one batched feasibility check, the pairs that produced no feasible solution being
+        retried together, up to 10 times.
+
+        Args:
+            parents (list[tuple[Solution, Solution]]): The pairs of parent solutions.
+
+        Returns:
+            list: A tuple of two new solutions (a, b) for every pair, (None, None) for the
+                  pairs whose crossover failed after 10 attempts.
+        """
+        offspring = [(None, None)] * len(parents)
+        pending = list(range(len(parents)))
+
         for _ in range(10):
-            a, b = self._crossover(s1, s2)
-            if a is None and b is None:
-                self.crossnok += 1
-            else:
-                self.crossok += 1
-                return a, b
-        return None, None
+            if not pending:
+                break
+
+            candidates = [self._crossover(*parents[q]) for q in pending]
+            screened = self._screen([s for pair in candidates for s in pair])
+
+            retry = []
+            for n, q in enumerate(pending):
+                a, b = screened[2 * n], screened[2 * n + 1]
+                if a is None and b is None:
+                    self.crossnok += 1
+                    retry.append(q)
+                else:
+                    self.crossok += 1
+                    offspring[q] = (a, b)
+            pending = retry
+
+        return offspring
+
+    def _screen(self, candidates: list[Solution | None]):
+        """Replaces the infeasible candidates by None, checking them all in one batch.
+        In penalty mode, only the structural constraints are checked.
+        """
+        indices = [n for n, s in enumerate(candidates) if s is not None]
+        if not indices:
+            return candidates
+
+        batch = PopulationBatch.from_solutions(
+            self.problem, [candidates[n] for n in indices]
+        )
+        feasible = self.checker.is_feasible_batch(
+            batch.x_pjv, batch.y_pk, batch.z_pj, relaxed=self.penalty
+        )
+
+        screened = list(candidates)
+        for n, ok in zip(indices, feasible):
+            if not ok:
+                screened[n] = None
+        return screened
 
     def _crossover(self, s1: Solution, s2: Solution):
         """Internal method to perform crossover between two solutions.
@@ -118,8 +299,8 @@ class GA:
             s2 (Solution): The second solution.
 
         Returns:
-            tuple: A tuple containing two new solutions (a, b). If either solution is infeasible,
-                   returns (None, None).
+            tuple: A tuple containing two new solutions (a, b), None for a solution leaving
+                   some package without a courier. Their feasibility is not checked.
         """
         problem = self.problem
 
@@ -169,11 +350,10 @@ class GA:
             vehicle_travel_time = s1.get_l_vj()[problem.graph.warehouse, j]
             for _ in range(2 * len(s2_used_set)):
                 i = np.random.choice(list(s2_used_set))
-                c = problem.couriers[i]
                 if (
-                    (i, j) in problem.permissions
+                    problem.r_ij[i, j]
                     and i not in a_set
-                    and vehicle_travel_time <= c.work_limit * 60
+                    and vehicle_travel_time <= problem.b_i[i] * 60
                 ):
                     a_set.add(i)
                     s2_used_set.remove(i)
@@ -183,11 +363,10 @@ class GA:
                 # If no used couriers are available, try unused couriers
                 for _ in range(2 * len(s2_unused_set)):
                     i = np.random.choice(list(s2_unused_set))
-                    c = problem.couriers[i]
                     if (
-                        (i, j) in problem.permissions
+                        problem.r_ij[i, j]
                         and i not in a_set
-                        and vehicle_travel_time <= c.work_limit * 60
+                        and vehicle_travel_time <= problem.b_i[i] * 60
                     ):
                         a_set.add(i)
                         s2_unused_set.remove(i)
@@ -201,11 +380,10 @@ class GA:
             vehicle_travel_time = s2.get_l_vj()[problem.graph.warehouse, j]
             for _ in range(2 * len(s1_used_set)):
                 i = np.random.choice(list(s1_used_set))
-                c = problem.couriers[i]
                 if (
-                    (i, j) in problem.permissions
+                    problem.r_ij[i, j]
                     and i not in b_set
-                    and vehicle_travel_time <= c.work_limit * 60
+                    and vehicle_travel_time <= problem.b_i[i] * 60
                 ):
                     b_set.add(i)
                     s1_used_set.remove(i)
@@ -215,11 +393,10 @@ class GA:
                 # If no used couriers are available, try unused couriers
                 for _ in range(2 * len(s1_unused_set)):
                     i = np.random.choice(list(s1_unused_set))
-                    c = problem.couriers[i]
                     if (
-                        (i, j) in problem.permissions
+                        problem.r_ij[i, j]
                         and i not in b_set
-                        and vehicle_travel_time <= c.work_limit * 60
+                        and vehicle_travel_time <= problem.b_i[i] * 60
                     ):
                         b_set.add(i)
                         s1_unused_set.remove(i)
@@ -228,40 +405,39 @@ class GA:
                 else:
                     break
 
-        a = Solution(problem, a_x_jv, a_y_k, a_z_j) if -1 not in a_z_j[a_y_k] else None
-        b = Solution(problem, b_x_jv, b_y_k, b_z_j) if -1 not in b_z_j[b_y_k] else None
-
-        if a is not None and not self.checker.is_feasible(a):
-            a = None
+        a = type(s1)(problem, a_x_jv, a_y_k, a_z_j) if -1 not in a_z_j[a_y_k] else None
+        b = type(s2)(problem, b_x_jv, b_y_k, b_z_j) if -1 not in b_z_j[b_y_k] else None
 
-        if b is not None and not self.checker.is_feasible(b):
-            b = None
+        for s in (a, b):
+            if s is not None:
+                s.route_cache = self.route_cache
 
         return a, b
 
-    def mutation(self, solution: Solution):
+    def mutation(self, solution: Solution, relaxed=False):
         """Perform mutations on a solution.
         This method applies various mutation strategies to the given solution.
         Args:
-            solution (Solution): The solution to mutate.
+            solution (Solution): The solution to mutate, which must be feasible, or only
+                satisfy the structural constraints when relaxed.
+            relaxed (bool): If True, the mutated solution only has to satisfy the
+                structural constraints.
         Returns:
             Solution: The mutated solution if a feasible mutation is found, otherwise the original solution.
         """
-        x_jv = solution.x_jv
         y_k = solution.y_k
-        z_j = solution.z_j
 
-        solution = Solution(solution.problem, x_jv.copy(), y_k.copy(), z_j.copy())
-        original = Solution(solution.problem, x_jv.copy(), y_k.copy(), z_j.copy())
+        solution = solution.copy()
+        fingerprint = solution.fingerprint
 
         available_mutations = []
 
         for mutation_class in self.mutations:
             if mutation_class is not RouteMutation:
-                available_mutations += [mutation_class(solution)]
+                available_mutations += [mutation_class(solution, self.neighbours)]
             else:
                 available_mutations += [
-                    mutation_class(solution, j)
+                    mutation_class(solution, j, self.neighbours)
                     for j in np.random.permutation(np.unique(y_k))
                 ]
 
@@ -274,13 +450,18 @@ class GA:
                 continue
 
             mutation.mutate_solution()
-            assert solution != original
-
-            if self.checker.is_feasible(solution):
+            assert solution.fingerprint != fingerprint
+
+            # the solution was feasible before the mutation, so only the constraints
+            # depending on what the mutation changed have to be checked again
+            if self.checker.is_feasible(
+                solution, scope=mutation.scope(), relaxed=relaxed
+            ):
+                solution.commit()
                 return solution
             else:
                 mutation.reverse()
-                assert solution == original
+                assert solution.fingerprint == fingerprint
 
         return solution
 
@@ -300,8 +481,18 @@ class GA:
         solutions = self.initial_population
         l = len(solutions)  # noqa: E741
 
-        solutions.sort(key=lambda s: self.get_cost(s))
-        initial_best = deepcopy(solutions[0])
+        for solution in solutions:
+            solution.route_cache = self.route_cache
+
+        batch = PopulationBatch.from_solutions(self.problem, solutions)
+        costs = self.get_costs(batch)
+        violations = self.get_violations(batch)
+        if self.penalty:
+            self._initial_weight = float(self.penalty_weight or costs.mean())
+            self.penalty_weights = np.full(violations.shape[1], self._initial_weight)
+
+        solutions, costs, violations = self._sort(solutions, costs, violations)
+        initial_best = deepcopy(self._best(solutions, costs, violations))
         yield GAState(initial_best, self.crossok, self.crossok + self.crossnok, 0)
 
         pairs = [(i, j) for i in range(l // 2) for j in range(i + 1, l // 2)]
@@ -314,19 +505,32 @@ class GA:
 
         for i in range(1, max_iter + 1):
             start_time = time.process_time()
-            solutions.sort(key=lambda s: self.get_cost(s))
+            solutions, costs, violations = self._sort(solutions, costs, violations)
+            if self.penalty:
+                self._adapt_penalties(violations[0])
             time_sum += time.process_time() - start_time
             yield GAState(
-                deepcopy(solutions[0]),
+                deepcopy(self._best(solutions, costs, violations)),
                 self.crossok,
                 self.crossok + self.crossnok,
                 time_sum,
             )
             start_time = time.process_time()
-            new = [self.crossover(solutions[i], solutions[j]) for i, j in get_pairs()]
+            new = self.crossover_many(
+                [(solutions[i], solutions[j]) for i, j in get_pairs()]
+            )
             new = [t[0] for t in new] + [t[1] for t in new]
             new = [n for n in new if n]
-            new = [self.mutation(n) for n in new]
+            # in penalty mode, feasible offspring are kept feasible by their mutations
+            # while the others may move through infeasible solutions
+            relaxed = [self.penalty] * len(new)
+            if self.penalty and new:
+                batch = PopulationBatch.from_solutions(self.problem, new)
+                relaxed = self.get_violations(batch).any(axis=1).tolist()
+            new = [self.mutation(n, r) for n, r in zip(new, relaxed)]
+            batch = PopulationBatch.from_solutions(self.problem, new)
+            new_costs = self.get_costs(batch)
+            new_violations = self.get_violations(batch)
 
             o = 0
             while len(new) + l // 2 < l:
@@ -334,4 +538,14 @@ class GA:
                 o += 1
 
             solutions = solutions[: l // 2] + new
+            costs = np.concatenate(
+                (costs[: l // 2], new_costs, costs[l // 2 : l // 2 + o])
+            )
+            violations = np.concatenate(
+                (
+                    violations[: l // 2],
+                    new_violations,
+                    violations[l // 2 : l // 2 + o],
+                )
+            )
             time_sum += time.process_time() - start_time
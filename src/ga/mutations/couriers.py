@@ -36,19 +36,11 @@ class CouriersMutation(Mutation):
         j2 = np.where(z_j == self.i2)[0]
         self.j2 = j2[0] if j2.size else None
 
-        z_j[self.j1] = self.i2
-        if j2 is not None:
-            z_j[j2] = self.i1
+        self.solution.set_z_j(self.j1, self.i2)
+        self.solution.set_z_j(j2, self.i1)
 
-    def _reverse(self):
-        """
-        Reverse the mutation by swapping the couriers back to their original drivers.
-        This method restores the original assignments of couriers to drivers
-        after the mutation has been applied.
-        """
-        self.solution.z_j[self.j1] = self.i1
-        if self.j2 is not None:
-            self.solution.z_j[self.j2] = self.i2
+    def touched_vehicles(self):
+        return [self.j1] if self.j2 is None else [self.j1, self.j2]
 
 
 class NewCourierMutation(Mutation):
@@ -63,19 +55,19 @@ class NewCourierMutation(Mutation):
         )
 
         self.used_vehicles = np.unique(self.solution.y_k)
-        self.unused_vehicles = np.setdiff1d(
-            np.arange(self.problem.n_vehicles), self.used_vehicles
-        )
+        unused = np.ones(problem.n_vehicles, dtype=bool)
+        unused[self.used_vehicles[self.used_vehicles >= 0]] = False
         for _ in range(2 * self.unused_couriers.size):
             self.i = np.random.choice(self.unused_couriers)
 
-            courier_vehicles = np.unique(
-                [
-                    p[1]
-                    for p in self.problem.permissions
-                    if p[0] == self.i and p[1] in self.unused_vehicles
-                ]
-            )
+            # unused vehicles among those the courier may drive
+            courier_vehicles = problem.courier_vehicles[
+                problem.courier_ptr[self.i] : problem.courier_ptr[self.i + 1]
+            ]
+            courier_vehicles = courier_vehicles[
+                problem.compatible_ij[self.i, courier_vehicles]
+                & unused[courier_vehicles]
+            ]
 
             if courier_vehicles.size:
                 self.j = np.random.choice(courier_vehicles)
@@ -88,79 +80,63 @@ class NewCourierMutation(Mutation):
         new_j = self.j
         y_k = self.solution.y_k
 
-        self.old_z_j = self.solution.z_j.copy()
-        self.old_x_jv = self.solution.x_jv.copy()
-        self.old_y_k = self.solution.y_k.copy()
-
+        problem = self.problem
         moved_packages = []
         moved_capacity = 0
-        wh = self.problem.graph.warehouse
+        wh = problem.graph.warehouse
 
         def calc_time(new_address):
             route = (
                 [wh]
-                + np.unique([p.address for p, _ in moved_packages]).tolist()
+                + np.unique(problem.h_k[moved_packages]).tolist()
                 + [new_address, wh]
             )
-            return sum([self.problem.s_uv[u, v] for u, v in zip(route, route[1:])])
+            return sum([problem.s_uv[u, v] for u, v in zip(route, route[1:])])
 
-        for k in np.random.permutation(np.arange(self.problem.n_packages)):
+        for k in np.random.permutation(np.arange(problem.n_packages)):
             j = y_k[k]
             proba = np.sum(y_k == j) / y_k.size
-            p = self.problem.packages[k]
 
             if (
                 np.random.rand() < proba
-                and calc_time(p.address) <= self.problem.couriers[new_i].work_limit
-                and moved_capacity + p.weight <= self.problem.vehicles[new_j].capacity
+                and problem.compatible_kj[k, new_j]
+                and (
+                    problem.compatible_kl is None
+                    or problem.compatible_kl[k, moved_packages].all()
+                )
+                and calc_time(problem.h_k[k]) <= problem.b_i[new_i]
+                and moved_capacity + problem.w_k[k] <= problem.q_j[new_j]
             ):
-                moved_packages.append((p, k))
-                moved_capacity += p.weight
+                moved_packages.append(k)
+                moved_capacity += problem.w_k[k]
 
         self.moved_packages = moved_packages
         self.__move_packages()
 
     def __move_packages(self):
-        x_jv = self.solution.x_jv
         y_k = self.solution.y_k
         new_i = self.i
         new_j = self.j
-        wh = self.problem.graph.warehouse
-        self.solution.z_j[new_j] = new_i
 
-        affected_vehicles = np.unique([y_k[k] for _, k in self.moved_packages])
+        moved_ks = np.array(self.moved_packages, dtype=int)
 
-        x_jv[new_j] = np.full_like(x_jv[new_j], wh)
+        affected_vehicles = np.unique(y_k[moved_ks])
+        self.affected_vehicles = affected_vehicles
 
-        for _, k in self.moved_packages:
-            y_k[k] = new_j
+        self.solution.set_z_j(new_j, new_i)
+        self.solution.set_y_k(moved_ks, new_j)
 
-        for b, v in enumerate(
-            np.unique([p.address for p, _ in self.moved_packages]), start=1
-        ):
-            x_jv[new_j, b] = v
+        self.solution.set_route(new_j, np.unique(self.problem.h_k[moved_ks]))
 
         for old_j in affected_vehicles:
             old_j_packages = np.where(y_k == old_j)[0]
-            old_j_addresses = [self.problem.packages[k].address for k in old_j_packages]
-
-            if not len(old_j_addresses):
-                self.solution.z_j[old_j] = -1
+            old_j_addresses = self.problem.h_k[old_j_packages]
 
-            for address in self.solution.get_route(old_j):
-                if address not in old_j_addresses:
-                    o = np.where(x_jv[old_j] == address)[0][0]
+            if not old_j_addresses.size:
+                self.solution.set_z_j(old_j, -1)
 
-                    while x_jv[old_j][o] != self.problem.graph.warehouse:
-                        x_jv[old_j][o] = x_jv[old_j][o + 1]
-                        o += 1
+            route = self.solution.get_route(old_j)
+            self.solution.set_route(old_j, route[np.isin(route, old_j_addresses)])
 
-    def _reverse(self):
-        """
-        Reverse the mutation by swapping the couriers back to their original drivers.
-        This method restores the original assignments of couriers to drivers
-        after the mutation has been applied.
-        """
-        self.solution.z_j = self.old_z_j
-        self.solution.x_jv = self.old_x_jv
-        self.solution.y_k = self.old_y_k
+    def touched_vehicles(self):
+        return [self.j, *self.affected_vehicles]
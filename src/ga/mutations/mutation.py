@@ -8,9 +8,14 @@ class Mutation:
     This class defines the interface for mutations that can be applied to a solution.
     It includes methods to check if a mutation is possible, mutate the solution,
     reverse the mutation, and track the number of feasible solutions created.
+    Mutations write to the solution through its setters inside a transaction, so
+    reversing a mutation only rolls back the cells it wrote.
 
     Attributes:
         proba (float): Probability of applying the mutation.
+        neighbours (np.ndarray | None): Nearest neighbours of every node, see
+            Problem.get_neighbours. When given, mutations keep their moves within
+            these granular neighbourhoods whenever they can.
         times_feasible_created (int): Counter for the number of feasible solutions created.
         times_run (int): Counter for the number of times the mutation has been run.
         solution (Solution): The solution to be mutated.
@@ -22,9 +27,13 @@ class Mutation:
         mutate_solution():
             Applies the mutation to the solution.
         reverse():
-            Reverses the mutation applied to the solution.
-        _reverse():
-            Abstract method to be implemented by subclasses for reversing the mutation.
+            Reverses the mutation applied to the solution by rolling back its transaction.
+        touched_vehicles() -> list[int] | None:
+            Returns the vehicles changed by the mutation, so that only their part of
+            the solution is re-evaluated.
+        scope() -> ChangeScope:
+            Returns the vehicles, packages and couriers changed by the applied mutation,
+            so that only the constraints depending on them are checked again.
         _mutate_solution():
             Abstract method to be implemented by subclasses for applying the mutation.
         _is_possible():
@@ -35,9 +44,10 @@ class Mutation:
     times_feasible_created = 0
     times_run = 0
 
-    def __init__(self, solution: Solution):
+    def __init__(self, solution: Solution, neighbours: np.ndarray | None = None):
         self.solution = solution
         self.problem = solution.problem
+        self.neighbours = neighbours
 
     def is_possible(self) -> bool:
         p = np.random.rand() < self.proba
@@ -46,18 +56,28 @@ class Mutation:
         return p
 
     def mutate_solution(self):
+        self.solution.begin()
         self._mutate_solution()
         self.__class__.times_feasible_created += 1
         self.__class__.times_run += 1
-        self.solution.recalculate()
+        self.solution.recalculate(self.touched_vehicles())
 
     def reverse(self):
-        self._reverse()
+        self.solution.rollback()
         self.__class__.times_feasible_created -= 1
-        self.solution.recalculate()
 
-    def _reverse(self):
-        raise NotImplementedError("Subclasses should implement this method.")
+    def touched_vehicles(self):
+        """Vehicles whose route, packages or courier were changed by the mutation.
+        Subclasses should override it, None makes the whole solution re-evaluated.
+        """
+        return None
+
+    def scope(self):
+        """Vehicles, packages and couriers changed by the mutation, read from the open
+        transaction, so it must be called between mutate_solution() and reverse() or
+        the commit of the solution.
+        """
+        return self.solution.changes()
 
     def _mutate_solution(self):
         raise NotImplementedError("Subclasses should implement this method.")
@@ -5,68 +5,79 @@ from .mutation import Mutation
 
 class PackagesMutation(Mutation):
     def _is_possible(self):
-        y_k = self.solution.y_k
         if self.problem.n_packages < 2:
             return False
 
         for k in np.random.permutation(np.arange(self.problem.n_packages)):
-            js = np.unique(y_k)
-            js = js[js != y_k[k]]
-
-            if js.size:
+            if self.__compatible_vehicles(k).size:
                 return True
 
         return False
 
     def _mutate_solution(self):
-        x_jv = self.solution.x_jv
         y_k = self.solution.y_k
 
         for k in np.random.permutation(np.arange(self.problem.n_packages)):
-            js = np.unique(y_k)
-            js = js[js != y_k[k]]
+            js = self.__compatible_vehicles(k)
 
             if not js.size:
                 continue
 
+            address = self.problem.h_k[k]
+            near = None
+            if self.neighbours is not None:
+                near = self.neighbours[address]
+                js = self.__near_vehicles(js, near)
+
             j = np.random.choice(js)
             self.old_j = y_k[k]
-            self.old_x = (x_jv[self.old_j].copy(), x_jv[j].copy())
-            self.k = k
             self.j = j
-            y_k[k] = j
-            p = self.problem.packages[k]
-            if p.address not in x_jv[j]:
-                max_index = np.max(np.where(x_jv[j] != 0)[0]) + 1
-                o = np.random.randint(1, max_index)
-
-                for l in range(x_jv[j].size - 1, o, -1):  # noqa: E741
-                    x_jv[j][l] = x_jv[j][l - 1]
-
-                x_jv[j, o] = p.address
+            self.solution.set_y_k(k, j)
+            route = self.solution.get_route(j)
+            if address not in route:
+                o = self.__insertion(route, near)
+                self.solution.set_route(j, np.insert(route, o - 1, address))
 
             old_j_packages = np.where(y_k == self.old_j)[0]
-            old_j_addresses = [self.problem.packages[k].address for k in old_j_packages]
-
-            self.old_z = None
+            old_j_addresses = self.problem.h_k[old_j_packages]
 
-            if not len(old_j_addresses):
-                self.old_z = self.solution.z_j[self.old_j]
-                self.solution.z_j[self.old_j] = -1
+            if not old_j_addresses.size:
+                self.solution.set_z_j(self.old_j, -1)
 
-            if p.address not in old_j_addresses:
-                o = np.where(x_jv[self.old_j] == p.address)[0][0]
-
-                while x_jv[self.old_j][o] != self.problem.graph.warehouse:
-                    x_jv[self.old_j][o] = x_jv[self.old_j][o + 1]
-                    o += 1
+            if address not in old_j_addresses:
+                route = self.solution.get_route(self.old_j)
+                self.solution.set_route(self.old_j, route[route != address])
 
             return
 
-    def _reverse(self):
-        self.solution.y_k[self.k] = self.old_j
-        self.solution.x_jv[self.old_j] = self.old_x[0]
-        self.solution.x_jv[self.j] = self.old_x[1]
+    def __compatible_vehicles(self, k):
+        """Used vehicles, other than its own, that package k can be moved to: those able
+        to carry it whose packages may all share a route with it.
+        """
+        problem = self.problem
+        y_k = self.solution.y_k
 
-        if self.old_z is not None:
-            self.solution.z_j[self.old_j] = self.old_z
+        js = np.unique(y_k)
+        js = js[(js != y_k[k]) & problem.compatible_kj[k, js]]
+        if problem.compatible_kl is not None:
+            js = js[~np.isin(js, y_k[~problem.compatible_kl[k]])]
+        return js
+
+    def __near_vehicles(self, js, near):
+        """Vehicles of js whose route visits one of the near nodes, all of them if none."""
+        visiting = [np.isin(self.solution.get_route(j), near).any() for j in js]
+        return js[visiting] if any(visiting) else js
+
+    def __insertion(self, route, near):
+        """Draws the (1-based) slot the address is inserted at: next to one of the near
+        nodes visited by the route if there is one, anywhere otherwise.
+        """
+        if near is not None:
+            visited = np.flatnonzero(np.isin(route, near))
+            if visited.size:
+                return np.random.choice(visited) + np.random.randint(2) + 1
+
+        return np.random.randint(1, route.size + 1)
+
+    def touched_vehicles(self):
+        return [self.old_j, self.j]
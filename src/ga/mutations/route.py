@@ -6,8 +6,8 @@ from .mutation import Mutation
 
 
 class RouteMutation(Mutation):
-    def __init__(self, solution: Solution, j):
-        super().__init__(solution)
+    def __init__(self, solution: Solution, j, neighbours=None):
+        super().__init__(solution, neighbours)
         self.j = j
         self.route = solution.get_route(j)
 
@@ -23,24 +23,31 @@ class RouteMutation(Mutation):
     def _mutate_solution(self):
         """Swap two addresses in the route of a specific vehicle.
         This mutation randomly selects two different addresses in the route of a vehicle
-        and swaps their positions.
+        and swaps their positions. With neighbour lists, one of the nearest neighbours
+        of the first address visited by the route, if any, is instead moved to follow it
+        directly, so that the vehicle drives the short arc between them.
         """
         route = self.route
-        x_jv = self.solution.x_jv
-        j = self.j
 
-        self.a = np.random.randint(route.size) + 1
-        self.b = np.random.randint(route.size) + 1
-        while self.a == self.b:
-            self.b = np.random.randint(route.size) + 1
-
-        x_jv[j, self.a], x_jv[j, self.b] = x_jv[j, self.b], x_jv[j, self.a]
-
-    def _reverse(self):
-        """Reverse the swap of two addresses in the route of a specific vehicle.
-        This method restores the original positions of the two addresses that were swapped
-        during the mutation.
-        """
-        x_jv = self.solution.x_jv
-        j = self.j
-        x_jv[j, self.a], x_jv[j, self.b] = x_jv[j, self.b], x_jv[j, self.a]
+        self.a = np.random.randint(route.size)
+        near = np.empty(0, dtype=int)
+        if self.neighbours is not None:
+            near = np.flatnonzero(np.isin(route, self.neighbours[route[self.a]]))
+            near = near[near != self.a + 1]
+
+        route = self.solution.get_route(self.j)
+        if near.size:
+            self.b = np.random.choice(near)
+            stop = route[self.b]
+            route = np.delete(route, self.b)
+            route = np.insert(route, self.a + (self.b > self.a), stop)
+        else:
+            self.b = np.random.randint(route.size)
+            while self.a == self.b:
+                self.b = np.random.randint(route.size)
+            route[self.a], route[self.b] = route[self.b], route[self.a]
+
+        self.solution.set_route(self.j, route)
+
+    def touched_vehicles(self):
+        return [self.j]
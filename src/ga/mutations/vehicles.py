@@ -4,15 +4,14 @@ from .mutation import Mutation
 
 
 class UsedVehiclesMutation(Mutation):
-    def __init__(self, solution):
-        super().__init__(solution)
+    def __init__(self, solution, neighbours=None):
+        super().__init__(solution, neighbours)
         self.used_vehicles = np.unique(self.solution.y_k)
 
     def _is_possible(self):
         return self.used_vehicles.size >= 2
 
     def _mutate_solution(self):
-        x_jv = self.solution.x_jv
         y_k = self.solution.y_k
         used_vehicles = self.used_vehicles
 
@@ -21,62 +20,76 @@ class UsedVehiclesMutation(Mutation):
         while self.a == self.b:
             self.b = np.random.choice(used_vehicles)
 
-        self.old_y_k = y_k.copy()
-        self.old_x = (x_jv[self.a].copy(), x_jv[self.b].copy())
+        a_ks, b_ks = np.where(y_k == self.a)[0], np.where(y_k == self.b)[0]
+        a_route, b_route = (
+            self.solution.get_route(self.a),
+            self.solution.get_route(self.b),
+        )
 
-        xd = x_jv[self.b].copy()
-        x_jv[self.b] = x_jv[self.a]
-        x_jv[self.a] = xd
+        self.solution.set_route(self.b, a_route)
+        self.solution.set_route(self.a, b_route)
 
-        y_k[self.old_y_k == self.a] = self.b
-        y_k[self.old_y_k == self.b] = self.a
+        self.solution.set_y_k(a_ks, self.b)
+        self.solution.set_y_k(b_ks, self.a)
 
-    def _reverse(self):
-        self.solution.y_k = self.old_y_k
-        self.solution.x_jv[self.a] = self.old_x[0]
-        self.solution.x_jv[self.b] = self.old_x[1]
+    def touched_vehicles(self):
+        return [self.a, self.b]
 
 
 class UnusedVehiclesMutation(Mutation):
-    def __init__(self, solution):
-        super().__init__(solution)
+    def __init__(self, solution, neighbours=None):
+        super().__init__(solution, neighbours)
         self.used_vehicles = np.unique(self.solution.y_k)
 
     def _is_possible(self):
-        return self.used_vehicles.size != self.problem.n_vehicles
+        """Check if the mutation is possible.
+        This mutation is possible if an unused vehicle is compatible with the packages
+        and the courier of a used one.
 
-    def _mutate_solution(self):
+        Returns:
+            bool: True if the mutation can be applied, False otherwise.
+        """
         used_vehicles = self.used_vehicles
-        x_jv = self.solution.x_jv
-        y_k = self.solution.y_k
-        z_j = self.solution.z_j
+        if used_vehicles.size == self.problem.n_vehicles:
+            return False
 
         unused_vehicles = np.setdiff1d(
             np.arange(self.problem.n_vehicles), used_vehicles
         )
 
-        self.a = np.random.choice(used_vehicles)
-        self.b = np.random.choice(unused_vehicles)
+        # unused vehicles able to take over the packages and courier of each used one
+        self.takeover = [
+            self.__compatible_vehicles(a, unused_vehicles) for a in used_vehicles
+        ]
+        return any(bs.size for bs in self.takeover)
 
-        self.old_z = z_j[self.b]
-        z_j[self.b] = z_j[self.a]
-        z_j[self.a] = -1
+    def _mutate_solution(self):
+        y_k = self.solution.y_k
+        z_j = self.solution.z_j
+        takeover = self.takeover
 
-        self.old_y = y_k.copy()
-        y_k[y_k == self.a] = self.b
+        a = np.random.choice(np.flatnonzero([bs.size for bs in takeover]))
+        self.a = self.used_vehicles[a]
+        self.b = np.random.choice(takeover[a])
 
-        self.old_x = x_jv[self.a].copy()
-        x_jv[self.b] = x_jv[self.a].copy()
-        x_jv[self.a] = np.full_like(x_jv[self.a], self.solution.problem.graph.warehouse)
+        self.solution.set_z_j(self.b, z_j[self.a])
+        self.solution.set_z_j(self.a, -1)
 
-    def _reverse(self):
-        x_jv = self.solution.x_jv
-        z_j = self.solution.z_j
+        self.solution.set_y_k(np.where(y_k == self.a)[0], self.b)
+
+        self.solution.set_route(self.b, self.solution.get_route(self.a))
+        self.solution.set_route(self.a, [])
 
-        x_jv[self.b] = np.full_like(x_jv[self.a], self.solution.problem.graph.warehouse)
-        x_jv[self.a] = self.old_x
+    def __compatible_vehicles(self, a, bs):
+        """Vehicles of bs compatible with the packages and the courier of vehicle a."""
+        problem = self.problem
+        ks = np.flatnonzero(self.solution.y_k == a)
+        i = self.solution.z_j[a]
 
-        self.solution.y_k = self.old_y
+        compatible = problem.compatible_kj[np.ix_(ks, bs)].all(axis=0)
+        if i != -1:
+            compatible &= problem.compatible_ij[i, bs]
+        return bs[compatible]
 
-        z_j[self.a] = z_j[self.b]
-        z_j[self.b] = self.old_z
+    def touched_vehicles(self):
+        return [self.a, self.b]
@@ -3,10 +3,13 @@ from typing import Optional
 
 import numpy as np
 
+from model.artifact_cache import ArtifactCache
+from model.population import PopulationBatch
 from model.problem import Problem
+from model.routes import Routes
 from model.solution import Solution
 from solution_checker import SolutionChecker
-from utils import calculate_vehicle_route
+from utils import calculate_vehicle_stops
 
 
 class Generator:
@@ -14,45 +17,114 @@ class Generator:
     Args
     ----
         problem (Problem): The problem to generate solutions for.
+        solution_class (type[Solution]): Solution class to generate, e.g. CompactSolution
+            for large populations. Defaults to Solution.
+        csr_routes (bool): Whether to encode the routes of the generated solutions as
+            Routes instead of the dense *x*<sub>j,v</sub> matrix. Defaults to False.
+        n_neighbours (int | None): Number of nearest neighbours each stop of a route is
+            preferably followed by, None for routes in a uniformly random order.
+            Defaults to None.
+        cache (ArtifactCache | None): On-disk cache of the neighbour lists and of the
+            populations found by generate_many_feasible() with an explicit seed, so that
+            later runs with the same problem, settings and seed start from the same
+            population without searching for it. Defaults to None.
+        batch_size (int): Maximum number of candidates generate_many_feasible() screens
+            with one batched feasibility check. Defaults to 256.
     """
 
-    def __init__(self, problem: Problem):
+    def __init__(
+        self,
+        problem: Problem,
+        solution_class: type[Solution] = Solution,
+        csr_routes: bool = False,
+        n_neighbours: int | None = None,
+        cache: ArtifactCache | None = None,
+        batch_size: int = 256,
+    ):
         self.problem = problem
+        self.solution_class = solution_class
+        self.csr_routes = csr_routes
+        self.n_neighbours = n_neighbours
+        self.cache = cache
+        self.batch_size = batch_size
+        self.neighbours = (
+            problem.get_neighbours(n_neighbours, cache) if n_neighbours else None
+        )
         self.checker = SolutionChecker(problem)
 
-    def generate_solution(self) -> Optional[Solution]:
+    def generate_solution(self, relaxed=False) -> Optional[Solution]:
+        """Generates a random candidate, drawing every package's vehicle and every
+        vehicle's courier among the compatible ones. Returns None when a package has no
+        compatible vehicle left, since the candidate could not be feasible, unless
+        relaxed, in which case the package is put on any vehicle.
+        """
         problem = self.problem
         warehouse = self.problem.graph.warehouse
-        self.x_jv = np.full(
-            (problem.n_vehicles, problem.n_nodes + 1), warehouse, dtype=int
-        )
+        self.routes = [np.empty(0, dtype=int)] * problem.n_vehicles
         self.y_k = np.full(problem.n_packages, -1, dtype=int)
         self.z_j = np.full(problem.n_vehicles, -1, dtype=int)
 
-        x_jv, y_k, z_j = self.x_jv, self.y_k, self.z_j
+        y_k, z_j = self.y_k, self.z_j
 
         matched_vehicles = set()
+        self.free_couriers = free_couriers = np.ones(problem.n_couriers, dtype=bool)
+
+        compatible_kj, compatible_ij = problem.compatible_kj, problem.compatible_ij
+        compatible_kl = problem.compatible_kl
+
+        # vehicles already driven, or that a free courier may still drive
+        usable = compatible_ij.any(axis=0)
+        # packages each vehicle can still take along with those assigned to it
+        fits_jk = np.ones((problem.n_vehicles, problem.n_packages), dtype=bool)
+        delivered_j = np.zeros(problem.n_vehicles)
+        picked_up_j = np.zeros(problem.n_vehicles)
 
         for k in range(problem.n_packages):
+            load_j = picked_up_j if problem.is_pickup[k] else delivered_j
+            js = np.flatnonzero(
+                usable
+                & compatible_kj[k]
+                & fits_jk[:, k]
+                & (load_j + problem.w_k[k] <= problem.q_j)
+            )
+
+            if js.size:
+                y_k[k] = js[np.random.randint(js.size)]
+            elif not relaxed:
+                return None
             # if all couriers are already assigned to vehicles
-            if np.unique(z_j[z_j != -1]).size == problem.n_couriers:
+            elif not free_couriers.any():
                 y_k[k] = np.random.choice(list(matched_vehicles))
             else:
                 y_k[k] = np.random.randint(problem.n_vehicles)
 
-            if y_k[k] not in matched_vehicles:
-                self._add_courier_to_vehicle(y_k[k])
-                matched_vehicles.add(y_k[k])
+            j = y_k[k]
+            load_j[j] += problem.w_k[k]
+            if compatible_kl is not None:
+                fits_jk[j] &= compatible_kl[k]
+
+            if j not in matched_vehicles:
+                self._add_courier_to_vehicle(j)
+                matched_vehicles.add(j)
+                free_couriers[z_j[j]] = False
+                usable = compatible_ij[free_couriers].any(axis=0)
+                usable[list(matched_vehicles)] = True
 
         for j in np.unique(y_k):
             self._add_route_to_vehicle(j)
 
-        return Solution(problem, x_jv, y_k, z_j)
+        x_jv = Routes.from_routes(self.routes, warehouse)
+        if not self.csr_routes:
+            x_jv = x_jv.to_dense(problem.n_nodes + 1)
+
+        return self.solution_class(problem, x_jv, y_k, z_j)
 
     def _add_courier_to_vehicle(self, j):
         """
         Assign a courier to a vehicle. The courier is chosen randomly from the
-        list of couriers that are allowed to be assigned to the vehicle.
+        free couriers compatible with the vehicle, see Problem.compatible_ij, or
+        from the free couriers allowed to drive it if there is none, which only
+        happens to the vehicles of relaxed candidates.
 
         Args
         ----
@@ -60,31 +132,115 @@ class Generator:
 
         """
         problem = self.problem
-        i = np.random.randint(problem.n_couriers)
-        tries = 0
-        max_tries = 2 * problem.n_couriers
-        while (i, j) not in problem.permissions or i in self.z_j:
+        couriers = np.flatnonzero(problem.compatible_ij[:, j] & self.free_couriers)
+        if not couriers.size:
+            couriers = problem.vehicle_couriers[
+                problem.vehicle_ptr[j] : problem.vehicle_ptr[j + 1]
+            ]
+            couriers = couriers[self.free_couriers[couriers]]
+
+        if couriers.size:
+            i = couriers[np.random.randint(couriers.size)]
+        else:
             i = np.random.randint(problem.n_couriers)
-            tries += 1
-            if tries == max_tries:
-                break
 
         self.z_j[j] = i
 
     def _add_route_to_vehicle(self, j):
-        self.x_jv[j] = calculate_vehicle_route(self.problem, self.y_k, j)
+        self.routes[j] = calculate_vehicle_stops(
+            self.problem, self.y_k, j, self.neighbours
+        )
 
     def generate_many_feasible(
         self,
         num_to_find=int(1e6),
         max_attempts=int(1e6),
         verbose=True,
+        relaxed=False,
+        seed=None,
     ) -> list[Solution]:
+        """Generates up to num_to_find distinct feasible solutions in at most max_attempts
+        attempts. Relaxed, the solutions only have to satisfy the structural constraints,
+        e.g. to seed a GA in penalty mode when feasible solutions are too rare to find.
+        Given a seed, numpy's random generator is seeded with it before the search, and
+        only then is the population looked up in and saved to the cache, since an
+        unseeded search is not meant to be repeatable.
+        """
+        if seed is not None:
+            np.random.seed(seed)
+
+        cached = self.cache is not None and seed is not None
+        if cached:
+            name = "population-{}.bin".format(
+                self.cache.digest(
+                    self.solution_class.__name__,
+                    self.csr_routes,
+                    self.n_neighbours,
+                    num_to_find,
+                    max_attempts,
+                    relaxed,
+                    seed,
+                )
+            )
+            buffer = self.cache.load_bytes(self.problem.fingerprint, name)
+            if buffer is not None:
+                return self._decode_population(buffer)
+
+        feasible_solutions = self._search_feasible(
+            num_to_find, max_attempts, verbose, relaxed
+        )
+
+        if cached and feasible_solutions:
+            batch = PopulationBatch.from_solutions(self.problem, feasible_solutions)
+            self.cache.save_bytes(self.problem.fingerprint, name, batch.encode())
+
+        return feasible_solutions
+
+    def _decode_population(self, buffer) -> list[Solution]:
+        """Rebuilds the solutions of a population cached by generate_many_feasible()."""
+        batch = PopulationBatch.decode(buffer, self.problem)
+        if not self.csr_routes:
+            return batch.to_solutions(self.solution_class)
+
+        warehouse = self.problem.graph.warehouse
+        return [
+            self.solution_class(
+                self.problem,
+                Routes.from_dense(x_jv.astype(int), warehouse),
+                y_k.astype(int),
+                z_j.astype(int),
+            )
+            for x_jv, y_k, z_j in zip(batch.x_pjv, batch.y_pk, batch.z_pj)
+        ]
+
+    def _search_feasible(
+        self, num_to_find, max_attempts, verbose, relaxed=False
+    ) -> list[Solution]:
+        """Generates candidates chunk by chunk, sizing each chunk by the acceptance rate
+        observed so far, and screens every chunk with one batched feasibility check.
+        """
         feasible_solutions = set()
         attempts = 0
 
         while len(feasible_solutions) < num_to_find and attempts < max_attempts:
-            attempts += 1
+            remaining = num_to_find - len(feasible_solutions)
+            rate = (len(feasible_solutions) + 1) / (attempts + 1)
+            chunk = min(
+                self.batch_size, max_attempts - attempts, int(np.ceil(remaining / rate))
+            )
+            attempts += chunk
+
+            candidates = [self.generate_solution(relaxed) for _ in range(chunk)]
+            candidates = [candidate for candidate in candidates if candidate]
+            if candidates:
+                batch = PopulationBatch.from_solutions(self.problem, candidates)
+                feasible = self.checker.is_feasible_batch(
+                    batch.x_pjv, batch.y_pk, batch.z_pj, relaxed
+                )
+                for p in np.flatnonzero(feasible):
+                    feasible_solutions.add(candidates[p])
+                    if len(feasible_solutions) == num_to_find:
+                        break
 
             if verbose:
                 sys.stdout.write(
@@ -92,16 +248,7 @@ class Generator:
                 )
                 sys.stdout.flush()
 
-            candidate = self.generate_solution()
-            if candidate and self.checker.is_feasible(candidate):
-                if candidate not in feasible_solutions:
-                    feasible_solutions.add(candidate)
-
         if verbose:
-            sys.stdout.write(
-                f"\rAttempts: {attempts}/{max_attempts} | Solutions found: {len(feasible_solutions)}"
-            )
-            sys.stdout.flush()
             print()
 
         return list(feasible_solutions)
@@ -1,3 +1,8 @@
+from .artifact_cache import ArtifactCache as ArtifactCache
 from .input import *
+from .population import PopulationBatch as PopulationBatch
 from .problem import *
+from .route_cache import RouteCache as RouteCache
+from .routes import Routes as Routes
+from .routes import route_edges as route_edges
 from .solution import *
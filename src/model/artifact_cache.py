@@ -0,0 +1,180 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+class ArtifactCache:
+    """On-disk cache of the artifacts derived from a problem, such as travel matrices,
+    neighbour lists and seed populations, so that repeated runs on the same instance
+    skip rebuilding them. Artifacts are keyed by a content hash, usually the
+    fingerprint of the problem, and can be shared by every process using the same
+    directory.
+
+    Each artifact is one file, <directory>/<key>/<name>, written to a temporary file
+    first and then renamed, so that no process ever reads a partial artifact. When
+    the files add up to more than max_bytes, the least recently used are evicted
+    first, a hit refreshing the modification time of its file.
+
+    Args
+    ----
+        directory (str | None): Directory of the cache, None for $VRP_CACHE_DIR or ~/.cache/vrp. Defaults to None.
+        max_bytes (int): Maximum total size of the cached files. Defaults to 2 GiB.
+
+    Attributes
+    ----------
+        hits (int): Number of lookups answered by the cache.
+        misses (int): Number of lookups of missing artifacts.
+
+    Methods
+    -------
+        digest(*parts) -> str: Returns a stable hash of some settings and arrays.
+        file_digest(path) -> str: Returns the hash of the contents of a file.
+        get(key, name) -> str | None: Returns the path of a cached artifact, None if missing.
+        put(key, name, write) -> str: Caches the artifact written by write(file) and returns its path.
+        load_array(key, name) -> np.ndarray | None: Returns a cached array, None if missing.
+        save_array(key, name, array): Caches an array.
+        load_bytes(key, name) -> bytes | None: Returns a cached buffer, None if missing.
+        save_bytes(key, name, data): Caches a buffer.
+        size() -> int: Returns the total size of the cached files.
+        evict(): Removes the least recently used artifacts until the cache fits in max_bytes.
+        stats() -> dict: Returns the hit-rate statistics of the cache.
+        clear(): Removes every artifact and resets the statistics.
+    """
+
+    def __init__(self, directory: str | None = None, max_bytes=2 << 30):
+        if directory is None:
+            directory = os.environ.get("VRP_CACHE_DIR") or os.path.join(
+                os.path.expanduser("~"), ".cache", "vrp"
+            )
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def digest(*parts):
+        """Returns a stable hash of some settings, arrays being hashed by content."""
+        h = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                part = np.ascontiguousarray(part, part.dtype.newbyteorder("<"))
+                h.update(f"{part.dtype.str}{part.shape}".encode())
+                h.update(part)
+            else:
+                h.update(repr(part).encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def file_digest(path: str):
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _path(self, key: str, name: str):
+        return os.path.join(self.directory, key, name)
+
+    def get(self, key: str, name: str):
+        path = self._path(key, name)
+        try:
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def put(self, key: str, name: str, write):
+        """Caches an artifact, write(file) writing it to a binary file, then evicts the
+        least recently used artifacts if the cache has grown too large.
+        """
+        path = self._path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp, "wb") as f:
+                write(f)
+            os.replace(temp, path)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+        self.evict()
+        return path
+
+    def load_array(self, key: str, name: str):
+        path = self.get(key, name)
+        return None if path is None else np.load(path)
+
+    def save_array(self, key: str, name: str, array: np.ndarray):
+        self.put(key, name, lambda f: np.save(f, array))
+
+    def load_bytes(self, key: str, name: str):
+        path = self.get(key, name)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def save_bytes(self, key: str, name: str, data: bytes):
+        self.put(key, name, lambda f: f.write(data))
+
+    def _files(self):
+        """Returns the (modification time, size, path) of every cached file."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def evict(self):
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # still mapped by a process on a platform that forbids removing it
+                continue
+            total -= size
+
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": self.size(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        max_bytes, self.max_bytes = self.max_bytes, -1
+        self.evict()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
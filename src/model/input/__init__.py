@@ -1,4 +1,7 @@
 from .courier import *
 from .graph import *
+from .mapped_graph import MappedGraph as MappedGraph
+from .mapped_graph import MappedMatrix as MappedMatrix
 from .package import *
+from .road_graph import RoadGraph as RoadGraph
 from .vehicle import *
@@ -1,4 +1,5 @@
-from copy import deepcopy
+from collections import OrderedDict
+from functools import cached_property
 
 import numpy as np
 import pandas as pd
@@ -10,25 +11,49 @@ class Graph:
 
     Args
     ----
-        routes (list[tuple[int, int, float, float]]): List of routes represented as tuples (start_node, end_node, distance, time).
+        routes (list[tuple[int, int, float, float]] | np.ndarray): List of routes represented as tuples (start_node, end_node, distance, time), or an equivalent (R, 4) array.
         points (np.ndarray): Array of coordinates for the nodes in the graph.
         warehouse (int): Identifier for the warehouse node. Defaults to 0.
-        symmetric_data (bool): Set to True if the routes are already symmetric
+
+    Attributes
+    ----------
+        dist_matrix (np.ndarray): Dense (*n*, *n*) matrix of the distance from node u to node v.
+        time_matrix (np.ndarray): Dense (*n*, *n*) matrix of the time taken to travel from node u to node v.
+        dtype (np.dtype): Precision in which the travel times and distances are stored.
+        shortest_paths (bool): Whether the travel matrices already hold the lengths of the shortest paths, i.e. no detour is ever faster.
+        routes (list[tuple[int, int, float, float]]): Symmetric routes, built on first access.
+        dist (dict[tuple[int, int], float]): Distance from node u to node v, built on first access.
+        time (dict[tuple[int, int], float]): Time taken to travel from node u to node v, built on first access.
+
+    Methods
+    -------
+        path(u, v) -> np.ndarray: Returns the coordinates of the points driven through from node u to node v.
+        metric_arrays() -> tuple[np.ndarray, ...]: Returns the arrays that determine the travel times and distances.
+        to_arrays() -> dict[str, np.ndarray]: Returns the arrays the graph is stored as in binary instance files.
+        from_arrays(arrays) -> Graph: Rebuilds a graph stored by to_arrays().
     """
 
+    # precision of the travel times and distances
+    dtype = np.dtype(float)
+    # whether the travel times satisfy the triangle inequality
+    shortest_paths = False
+
     def __init__(
         self,
-        routes: list[tuple[int, int, float, float]],
+        routes: list[tuple[int, int, float, float]] | np.ndarray,
         points: np.ndarray,
         warehouse=0,
     ):
-        self.routes = self.__sym(routes)
+        routes = np.asarray(routes, dtype=float).reshape(-1, 4)
+        self._uv = routes[:, :2].astype(int)
+        self._dt = routes[:, 2:]
         self.warehouse = warehouse
 
-        self.n_nodes = len(set([t[0] for t in self.routes]))
+        self._nodes = np.unique(self._uv)
+        self.n_nodes = self._nodes.size
 
-        self.dist = {(u, v): d for (u, v, d, _) in self.routes}
-        self.time = {(u, v): t for (u, v, _, t) in self.routes}
+        self.dist_matrix = self.__sym(self._dt[:, 0])
+        self.time_matrix = self.__sym(self._dt[:, 1])
 
         self.points = points
 
@@ -40,35 +65,74 @@ class Graph:
 
         return f"dist\n{dist}\n\ntime\n{time}"
 
-    def __sym(self, routes: list[tuple[int, int, float, float]]):
+    def __sym(self, values: np.ndarray):
         """
-        Augment the routes to include symmetric routes.
+        Build the dense matrix of symmetric routes: the original routes, then the
+        reverse routes and finally zeros on the diagonal, later ones taking precedence.
 
         Args
         ----
-            routes (list[tuple[int, int, float, float]]): List of routes represented as tuples (start_node, end_node, distance, time).
+            values (np.ndarray): Value of each original route.
 
         Returns
         -------
-            list[tuple[int, int, float, float]]: Symmetric routes including original and reverse routes.
+            np.ndarray: Matrix of the values from node u to node v, 0 for missing routes.
         """
+        u, v = self._uv[:, 0], self._uv[:, 1]
+        matrix = np.zeros((self.n_nodes, self.n_nodes))
+        matrix[u, v] = values
+        matrix[v, u] = values
+        matrix[self._nodes, self._nodes] = 0
+
+        return matrix
+
+    @cached_property
+    def routes(self):
+        """Symmetric routes including original and reverse routes."""
+        uv, dt = self._uv.tolist(), self._dt.tolist()
+
+        original = [(a, b, d, t) for (a, b), (d, t) in zip(uv, dt)]
+        symmetrical = [(b, a, d, t) for a, b, d, t in original]
 
-        original = deepcopy(routes)
-        symmetrical = [(b, a, dist, time) for a, b, dist, time in original]
+        return original + symmetrical + [(a, a, 0, 0) for a in self._nodes.tolist()]
 
-        nodes = {t[0] for t in original} | {t[1] for t in original}
+    @cached_property
+    def dist(self):
+        return {(u, v): d for (u, v, d, _) in self.routes}
 
-        return original + symmetrical + [(a, a, 0, 0) for a in nodes]
+    @cached_property
+    def time(self):
+        return {(u, v): t for (u, v, _, t) in self.routes}
+
+    def path(self, u, v):
+        """Returns the coordinates of the points the vehicles drive through from node u
+        to node v, the straight line between them unless the graph knows the streets.
+        """
+        return np.asarray(self.points)[[u, v]]
+
+    def metric_arrays(self):
+        """Returns the arrays that determine the travel times and distances, used to
+        fingerprint the graph.
+        """
+        return self.time_matrix, self.dist_matrix
 
     def __asym(self):
-        routes = []
+        routes, seen = [], set()
         for a, b, d, t in self.routes:
-            if (a, b, d, t) not in routes and (b, a, d, t) not in routes:
+            if (a, b, d, t) not in seen and (b, a, d, t) not in seen:
                 routes.append((a, b, d, t))
+                seen.add((a, b, d, t))
         return routes
 
     @classmethod
     def from_dict(cls, dictionary):
+        if dictionary.get("metric") == "euclidean":
+            return EuclideanGraph.from_dict(dictionary)
+        if dictionary.get("metric") == "road":
+            from .road_graph import RoadGraph
+
+            return RoadGraph.from_dict(dictionary)
+
         points = []
         for point in dictionary["points"]:
             points.append((point["x"], point["y"]))
@@ -101,3 +165,265 @@ class Graph:
             for start_node, end_node, distance, time in self.__asym()
         ]
         return {"points": points, "routes": routes, "warehouse": self.warehouse}
+
+    def to_arrays(self):
+        return {
+            "metric": np.array("matrix"),
+            "points": np.asarray(self.points, dtype=float),
+            "warehouse": np.array(self.warehouse),
+            "dist_matrix": np.asarray(self.dist_matrix, dtype=float),
+            "time_matrix": np.asarray(self.time_matrix, dtype=float),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        metric = str(arrays["metric"])
+        if metric == "euclidean":
+            return EuclideanGraph.from_arrays(arrays)
+        if metric == "road":
+            from .road_graph import RoadGraph
+
+            return RoadGraph.from_arrays(arrays)
+
+        return MatrixGraph(
+            arrays["dist_matrix"],
+            arrays["time_matrix"],
+            arrays["points"],
+            int(arrays["warehouse"]),
+        )
+
+
+class TravelMatrix:
+    """
+    Read-only (*n*, *n*) matrix of the Euclidean distances, or travel times, between
+    points, computed on demand rather than stored. It supports the indexing used on the
+    dense matrices: single entries and rows, served from a cache of rows, as well as
+    broadcast arrays of start and end nodes, computed in one vectorized pass.
+
+    Args
+    ----
+        points (np.ndarray): (*n*, 2) coordinates of the nodes.
+        factor (float | np.ndarray | None): Time taken per unit of distance, either one factor or one per node, an edge using the mean factor of its end nodes. None for distances.
+        decimals (int | None): Decimals the distances, and then the times, are rounded to. None to keep them exact. Defaults to 2.
+        maxrows (int): Maximum number of rows kept in the cache, the least recently used are evicted first.
+
+    Methods
+    -------
+        row(u) -> np.ndarray: Returns the read-only row of node *u*.
+    """
+
+    ndim = 2
+    dtype = np.dtype(float)
+
+    def __init__(self, points: np.ndarray, factor=None, decimals=2, maxrows=1024):
+        self.points = points
+        self.factor = factor
+        self.decimals = decimals
+        self.maxrows = maxrows
+        self.shape = (len(points), len(points))
+        self._rows: OrderedDict[int, np.ndarray] = OrderedDict()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_rows"] = OrderedDict()
+        return state
+
+    def __array__(self, dtype=None, copy=None):
+        nodes = np.arange(len(self))
+        return self._values(nodes[:, None], nodes[None, :]).astype(dtype, copy=False)
+
+    def _values(self, u, v):
+        x, y = self.points[u, 0], self.points[u, 1]
+        a, b = self.points[v, 0], self.points[v, 1]
+
+        values = np.sqrt((a - x) ** 2 + (b - y) ** 2)
+        if self.decimals is not None:
+            values = np.round(values, self.decimals)
+        if self.factor is None:
+            return values
+
+        if np.ndim(self.factor):
+            values = values * ((self.factor[u] + self.factor[v]) / 2)
+        else:
+            values = values * self.factor
+        if self.decimals is not None:
+            values = np.round(values, self.decimals)
+        return values
+
+    def row(self, u):
+        u = int(u)
+        row = self._rows.get(u)
+        if row is not None:
+            self._rows.move_to_end(u)
+            return row
+
+        row = self._values(u, np.arange(len(self)))
+        row.flags.writeable = False
+        self._rows[u] = row
+        if len(self._rows) > self.maxrows:
+            self._rows.popitem(last=False)
+        return row
+
+    def __getitem__(self, key):
+        u, v = key if isinstance(key, tuple) else (key, slice(None))
+        if not isinstance(u, slice) and np.ndim(u) == 0:
+            return self.row(u)[v]
+
+        return self._values(*_matrix_index(key, len(self)))
+
+
+def _matrix_index(key, n):
+    """Converts the key of an (*n*, *n*) matrix lookup into two broadcastable arrays of
+    start and end nodes, slices selecting whole axes as on a dense matrix.
+    """
+    u, v = key if isinstance(key, tuple) else (key, slice(None))
+
+    nodes = np.arange(n)
+    if isinstance(u, slice):
+        v = nodes[v] if isinstance(v, slice) else np.asarray(v)
+        u = nodes[u].reshape((-1,) + (1,) * v.ndim)
+    elif isinstance(v, slice):
+        u = np.asarray(u)[..., None]
+        v = nodes[v]
+    return np.asarray(u), np.asarray(v)
+
+
+class MatrixGraph(Graph):
+    """
+    Complete graph defined by its travel matrices rather than by a list of routes, and
+    base class of the graphs computing them. The routes between every two nodes, and
+    the dicts built from them, are read from the matrices on first access and left out
+    of pickles.
+
+    Args
+    ----
+        dist_matrix (np.ndarray): (*n*, *n*) matrix of the distance from node u to node v.
+        time_matrix (np.ndarray): (*n*, *n*) matrix of the time taken to travel from node u to node v.
+        points (np.ndarray): Array of coordinates for the nodes in the graph.
+        warehouse (int): Identifier for the warehouse node. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        dist_matrix: np.ndarray,
+        time_matrix: np.ndarray,
+        points: np.ndarray,
+        warehouse=0,
+    ):
+        self.dist_matrix = dist_matrix
+        self.time_matrix = time_matrix
+        self.points = points
+        self.warehouse = warehouse
+
+        self.n_nodes = len(dist_matrix)
+        self._nodes = np.arange(self.n_nodes)
+
+    def __getstate__(self):
+        derived = ("_uv", "_dt", "routes", "dist", "time")
+        return {k: v for k, v in self.__dict__.items() if k not in derived}
+
+    @cached_property
+    def _uv(self):
+        return np.column_stack(np.triu_indices(self.n_nodes, k=1))
+
+    @cached_property
+    def _dt(self):
+        u, v = self._uv[:, 0], self._uv[:, 1]
+        return np.column_stack((self.dist_matrix[u, v], self.time_matrix[u, v]))
+
+
+class EuclideanGraph(MatrixGraph):
+    """
+    Complete graph in which the distance between two nodes is the Euclidean distance
+    between their points and the travel time follows a time factor model. Only the
+    points and the factors are stored, the travel matrices are computed on demand.
+
+    Args
+    ----
+        points (np.ndarray): Array of coordinates for the nodes in the graph.
+        time_factor (float | np.ndarray): Time taken per unit of distance, either one factor or one per node, an edge using the mean factor of its end nodes. Defaults to 1.
+        warehouse (int): Identifier for the warehouse node. Defaults to 0.
+        decimals (int | None): Decimals the distances and times are rounded to. None to keep them exact. Defaults to 2.
+
+    Attributes
+    ----------
+        dist_matrix (TravelMatrix): Implicit (*n*, *n*) matrix of the distance from node u to node v.
+        time_matrix (TravelMatrix): Implicit (*n*, *n*) matrix of the time taken to travel from node u to node v.
+        routes (list[tuple[int, int, float, float]]): Symmetric routes, built on first access.
+        dist (dict[tuple[int, int], float]): Distance from node u to node v, built on first access.
+        time (dict[tuple[int, int], float]): Time taken to travel from node u to node v, built on first access.
+    """
+
+    def __init__(
+        self,
+        points: np.ndarray,
+        time_factor: float | np.ndarray = 1.0,
+        warehouse=0,
+        decimals: int | None = 2,
+    ):
+        self.points = np.asarray(points, dtype=float)
+        self.time_factor = (
+            float(time_factor)
+            if np.ndim(time_factor) == 0
+            else np.asarray(time_factor, dtype=float)
+        )
+        self.warehouse = warehouse
+        self.decimals = decimals
+
+        self.n_nodes = len(self.points)
+        self._nodes = np.arange(self.n_nodes)
+
+        self.dist_matrix = TravelMatrix(self.points, None, decimals)
+        self.time_matrix = TravelMatrix(self.points, self.time_factor, decimals)
+
+    def metric_arrays(self):
+        decimals = -1 if self.decimals is None else self.decimals
+        return np.atleast_1d(self.time_factor), np.array([decimals])
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        points = np.array([(point["x"], point["y"]) for point in dictionary["points"]])
+
+        return cls(
+            points,
+            np.asarray(dictionary["time_factor"], dtype=float),
+            dictionary["warehouse"],
+            dictionary.get("decimals", 2),
+        )
+
+    def to_dict(self):
+        points = [{"x": float(x), "y": float(y)} for x, y in self.points]
+        time_factor = (
+            self.time_factor.tolist()
+            if isinstance(self.time_factor, np.ndarray)
+            else self.time_factor
+        )
+        return {
+            "metric": "euclidean",
+            "points": points,
+            "time_factor": time_factor,
+            "decimals": self.decimals,
+            "warehouse": self.warehouse,
+        }
+
+    def to_arrays(self):
+        return {
+            "metric": np.array("euclidean"),
+            "points": self.points,
+            "time_factor": np.asarray(self.time_factor),
+            "decimals": np.array(-1 if self.decimals is None else self.decimals),
+            "warehouse": np.array(self.warehouse),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        decimals = int(arrays["decimals"])
+        return cls(
+            arrays["points"],
+            arrays["time_factor"],
+            int(arrays["warehouse"]),
+            None if decimals < 0 else decimals,
+        )
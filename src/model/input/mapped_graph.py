@@ -0,0 +1,158 @@
+import json
+import os
+
+import numpy as np
+
+from .graph import Graph, MatrixGraph, _matrix_index
+
+
+class MappedMatrix:
+    """
+    Read-only (*n*, *n*) travel matrix stored in a memory-mapped file, either in full or,
+    for symmetric matrices, as its packed upper triangle. Processes mapping the same file
+    share one copy of it in the page cache, and pickles only carry the path of the file.
+    Entries are stored in a reduced precision and read as float64.
+
+    Args
+    ----
+        path (str): Path of the file holding the matrix.
+        n (int): Number of nodes.
+        dtype (np.dtype): Precision of the stored entries. Defaults to float32.
+        packed (bool): Whether the file holds the packed upper triangle, row after row, rather than the full matrix. Defaults to False.
+
+    Methods
+    -------
+        write(path, matrix, dtype, packed) -> MappedMatrix: Writes a matrix, row block after row block, and maps it.
+    """
+
+    ndim = 2
+    dtype = np.dtype(float)
+
+    def __init__(self, path: str, n: int, dtype=np.float32, packed=False):
+        self.path = path
+        self.packed = packed
+        self.shape = (n, n)
+
+        size = n * (n + 1) // 2 if packed else n * n
+        self.data = np.memmap(path, dtype=dtype, mode="r", shape=(size,))
+        if not packed:
+            self.data = self.data.reshape(self.shape)
+
+    def __reduce__(self):
+        return (MappedMatrix, (self.path, len(self), self.data.dtype.str, self.packed))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:, :], dtype=dtype)
+
+    @staticmethod
+    def _offset(u, v, n):
+        """Offset of entry (*u*, *v*) in the packed upper triangle."""
+        u, v = np.minimum(u, v).astype(np.int64), np.maximum(u, v).astype(np.int64)
+        return u * (2 * n - u + 1) // 2 + (v - u)
+
+    def __getitem__(self, key):
+        if self.packed:
+            u, v = _matrix_index(key, len(self))
+            values = self.data[self._offset(u, v, len(self))]
+        else:
+            values = self.data[key]
+
+        values = np.asarray(values, dtype=float)
+        return values[()] if values.ndim == 0 else values
+
+    @classmethod
+    def write(cls, path: str, matrix, dtype=np.float32, packed=False, block=1024):
+        n = len(matrix)
+        size = n * (n + 1) // 2 if packed else n * n
+        data = np.memmap(path, dtype=dtype, mode="w+", shape=(size,))
+
+        if packed:
+            for u in range(n):
+                start = cls._offset(u, u, n)
+                data[start : start + n - u] = matrix[u, u:]
+        else:
+            rows = data.reshape(n, n)
+            for start in range(0, n, block):
+                rows[start : start + block] = matrix[start : start + block]
+
+        data.flush()
+        return cls(path, n, dtype, packed)
+
+
+class MappedGraph(MatrixGraph):
+    """
+    Graph whose travel matrices are memory-mapped files in a reduced precision, for
+    instances too large to keep two dense float64 matrices in memory. The files are
+    written once with from_graph() and can then be opened by several worker processes,
+    which share them through the page cache.
+
+    Args
+    ----
+        directory (str): Directory holding the graph files written by from_graph().
+
+    Attributes
+    ----------
+        dist_matrix (MappedMatrix): Mapped (*n*, *n*) matrix of the distance from node u to node v.
+        time_matrix (MappedMatrix): Mapped (*n*, *n*) matrix of the time taken to travel from node u to node v.
+        dtype (np.dtype): Precision in which the travel times and distances are stored.
+
+    Methods
+    -------
+        from_graph(graph, directory, dtype, packed) -> MappedGraph: Writes the travel matrices of a graph and maps them.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "graph.json"), "r") as f:
+            meta = json.load(f)
+
+        self.directory = directory
+        self.warehouse = meta["warehouse"]
+        self.n_nodes = meta["n_nodes"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.packed = meta["packed"]
+
+        self.points = np.load(os.path.join(directory, "points.npy"))
+        self._nodes = np.arange(self.n_nodes)
+
+        self.dist_matrix, self.time_matrix = (
+            MappedMatrix(
+                os.path.join(directory, f"{name}.bin"),
+                self.n_nodes,
+                self.dtype,
+                self.packed,
+            )
+            for name in ("dist", "time")
+        )
+
+    def __reduce__(self):
+        return (MappedGraph, (self.directory,))
+
+    def metric_arrays(self):
+        return self.time_matrix.data, self.dist_matrix.data
+
+    @classmethod
+    def from_graph(cls, graph: Graph, directory: str, dtype=np.float32, packed=False):
+        """Writes the travel matrices of a graph to memory-mapped files in a directory and
+        returns the graph mapping them. Packing keeps only the upper triangle, which
+        halves the files of symmetric graphs.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        for name, matrix in (("dist", graph.dist_matrix), ("time", graph.time_matrix)):
+            path = os.path.join(directory, f"{name}.bin")
+            MappedMatrix.write(path, matrix, dtype, packed)
+        np.save(os.path.join(directory, "points.npy"), np.asarray(graph.points, float))
+
+        meta = {
+            "n_nodes": graph.n_nodes,
+            "warehouse": graph.warehouse,
+            "dtype": np.dtype(dtype).str,
+            "packed": packed,
+        }
+        with open(os.path.join(directory, "graph.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        return cls(directory)
@@ -0,0 +1,248 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_array
+from scipy.sparse.csgraph import dijkstra
+
+from ..artifact_cache import ArtifactCache
+from .graph import MatrixGraph
+
+
+def _shortest_paths(csgraph, directed, sources, targets, predecessors):
+    """Runs Dijkstra from a chunk of sources, returning the lengths of the shortest paths
+    to the targets and, if asked, the predecessors on the paths to every street node.
+    """
+    result = dijkstra(
+        csgraph, directed, indices=sources, return_predecessors=predecessors
+    )
+    if not predecessors:
+        return result[:, targets], None
+
+    lengths, pred = result
+    return lengths[:, targets], pred.astype(np.int32)
+
+
+class RoadGraph(MatrixGraph):
+    """
+    Graph of a sparse road network. The nodes of the problem, the warehouse and the
+    package addresses, are street nodes of the network and travelling between two of
+    them follows the shortest path along the streets. The travel matrices between
+    the problem nodes are computed once, with Dijkstra runs from chunks of sources
+    spread over worker processes.
+
+    Args
+    ----
+        edges (list[tuple[int, int, float, float]] | np.ndarray): (*E*, 4) street segments (start, end, distance, time) between street nodes.
+        street_points (np.ndarray): (*N*, 2) coordinates of the street nodes.
+        nodes (np.ndarray): Street node of every node of the problem, node *v* being street node nodes[v].
+        warehouse (int): Identifier for the warehouse node. Defaults to 0.
+        directed (bool): Whether the segments are one-way. Defaults to False.
+        n_jobs (int | None): Number of worker processes, None for one per CPU. Defaults to None.
+        chunk_size (int): Number of sources per Dijkstra run. Defaults to 256.
+        cache (ArtifactCache | None): On-disk cache of the travel matrices, keyed by the streets and nodes, so that they are only computed once. Defaults to None.
+
+    Attributes
+    ----------
+        dist_matrix (np.ndarray): Dense (*n*, *n*) matrix of the shortest distance from node u to node v.
+        time_matrix (np.ndarray): Dense (*n*, *n*) matrix of the shortest time taken to travel from node u to node v.
+        predecessors (np.ndarray): (*n*, *N*) street node preceding each street node on the shortest (by distance) path from node u, negative if unreachable.
+        points (np.ndarray): Coordinates of the nodes of the problem.
+
+    Methods
+    -------
+        path(u, v) -> np.ndarray: Returns the coordinates of the street nodes along the shortest path from node u to node v.
+
+    Raises
+    ------
+        ValueError: If some node of the problem cannot be reached from another.
+    """
+
+    shortest_paths = True
+
+    def __init__(
+        self,
+        edges: list[tuple[int, int, float, float]] | np.ndarray,
+        street_points: np.ndarray,
+        nodes: np.ndarray,
+        warehouse=0,
+        directed=False,
+        n_jobs: int | None = None,
+        chunk_size=256,
+        cache: ArtifactCache | None = None,
+    ):
+        self.edges = np.asarray(edges, dtype=float).reshape(-1, 4)
+        self.street_points = np.asarray(street_points, dtype=float)
+        self.nodes = np.asarray(nodes, dtype=int)
+        self.warehouse = warehouse
+        self.directed = directed
+
+        self.n_nodes = self.nodes.size
+        self._nodes = np.arange(self.n_nodes)
+        self.points = self.street_points[self.nodes]
+
+        key = None
+        if cache:
+            key = cache.digest(self.edges, self.street_points, self.nodes, directed)
+            arrays = [
+                cache.load_array(key, f"{name}.npy")
+                for name in ("dist", "time", "predecessors")
+            ]
+            if all(array is not None for array in arrays):
+                self.dist_matrix, self.time_matrix, self.predecessors = arrays
+                return
+
+        dist, time = self.__csgraphs()
+        self.dist_matrix, self.predecessors = self.__all_pairs(
+            dist, True, n_jobs, chunk_size
+        )
+        self.time_matrix, _ = self.__all_pairs(time, False, n_jobs, chunk_size)
+
+        unreachable = ~np.isfinite(self.dist_matrix) | ~np.isfinite(self.time_matrix)
+        if unreachable.any():
+            u, v = np.argwhere(unreachable)[0]
+            raise ValueError(
+                f"{unreachable.sum()} pairs of nodes are not connected by the streets, "
+                f"e.g. node {u} (street node {self.nodes[u]}) to node {v} "
+                f"(street node {self.nodes[v]})"
+            )
+
+        if key:
+            cache.save_array(key, "dist.npy", self.dist_matrix)
+            cache.save_array(key, "time.npy", self.time_matrix)
+            cache.save_array(key, "predecessors.npy", self.predecessors)
+
+    def __csgraphs(self):
+        """Builds the sparse distance and time graphs of the streets, parallel segments
+        keeping their shortest distance and time.
+        """
+        n = len(self.street_points)
+        u, v = self.edges[:, 0].astype(int), self.edges[:, 1].astype(int)
+
+        key = u * n + v
+        order = np.argsort(key, kind="stable")
+        key = key[order]
+        start = np.concatenate(([0], np.flatnonzero(np.diff(key)) + 1))[: key.size]
+
+        u, v = key[start] // n, key[start] % n
+        return (
+            csr_array(
+                (np.minimum.reduceat(self.edges[order, column], start), (u, v)),
+                shape=(n, n),
+            )
+            for column in (2, 3)
+        )
+
+    def __all_pairs(self, csgraph, predecessors, n_jobs, chunk_size):
+        """Computes the shortest paths between the nodes of the problem, one chunk of
+        sources per task.
+        """
+        chunks = [
+            self.nodes[start : start + chunk_size]
+            for start in range(0, self.n_nodes, chunk_size)
+        ]
+        n_jobs = min(n_jobs or os.cpu_count() or 1, len(chunks))
+        args = (csgraph, self.directed)
+
+        if n_jobs <= 1:
+            results = [
+                _shortest_paths(*args, c, self.nodes, predecessors) for c in chunks
+            ]
+        else:
+            with ProcessPoolExecutor(n_jobs) as executor:
+                futures = [
+                    executor.submit(_shortest_paths, *args, c, self.nodes, predecessors)
+                    for c in chunks
+                ]
+                results = [future.result() for future in futures]
+
+        lengths = np.concatenate([lengths for lengths, _ in results])
+        if not predecessors:
+            return lengths, None
+        return lengths, np.concatenate([pred for _, pred in results])
+
+    def path(self, u, v):
+        source = self.nodes[u]
+
+        stops = [self.nodes[v]]
+        while stops[-1] != source:
+            stops.append(self.predecessors[u, stops[-1]])
+        if len(stops) == 1:
+            stops.append(source)
+
+        return self.street_points[stops[::-1]]
+
+    def to_arrays(self):
+        return {
+            "metric": np.array("road"),
+            "edges": self.edges,
+            "street_points": self.street_points,
+            "nodes": self.nodes,
+            "directed": np.array(self.directed),
+            "warehouse": np.array(self.warehouse),
+            "dist_matrix": self.dist_matrix,
+            "time_matrix": self.time_matrix,
+            "predecessors": self.predecessors,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuilds a road graph stored by to_arrays(), without running Dijkstra again."""
+        graph = cls.__new__(cls)
+        graph.edges = arrays["edges"]
+        graph.street_points = arrays["street_points"]
+        graph.nodes = arrays["nodes"]
+        graph.warehouse = int(arrays["warehouse"])
+        graph.directed = bool(arrays["directed"])
+
+        graph.n_nodes = graph.nodes.size
+        graph._nodes = np.arange(graph.n_nodes)
+        graph.points = graph.street_points[graph.nodes]
+
+        graph.dist_matrix = arrays["dist_matrix"]
+        graph.time_matrix = arrays["time_matrix"]
+        graph.predecessors = arrays["predecessors"]
+        return graph
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        edges = [
+            (
+                edge["start_node"],
+                edge["end_node"],
+                edge["distance"],
+                edge["time"],
+            )
+            for edge in dictionary["edges"]
+        ]
+        street_points = np.array(
+            [(point["x"], point["y"]) for point in dictionary["street_points"]]
+        )
+
+        return cls(
+            edges,
+            street_points,
+            dictionary["nodes"],
+            dictionary["warehouse"],
+            dictionary.get("directed", False),
+        )
+
+    def to_dict(self):
+        edges = [
+            {
+                "start_node": int(start_node),
+                "end_node": int(end_node),
+                "distance": float(distance),
+                "time": float(time),
+            }
+            for start_node, end_node, distance, time in self.edges
+        ]
+        street_points = [{"x": float(x), "y": float(y)} for x, y in self.street_points]
+        return {
+            "metric": "road",
+            "street_points": street_points,
+            "edges": edges,
+            "nodes": self.nodes.tolist(),
+            "directed": self.directed,
+            "warehouse": self.warehouse,
+        }
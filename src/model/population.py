@@ -0,0 +1,256 @@
+import numpy as np
+
+from .problem import Problem
+from .routes import route_edges
+from .solution import Solution
+
+
+class PopulationBatch:
+    """Struct-of-arrays view of a population of solutions, with every individual stacked
+    along the first axis so that they are all evaluated in one vectorized pass.
+
+    Args
+    ----
+        problem (Problem): Problem instance.
+        x_pjv (np.ndarray): (*P*, *m*, *L*) routes of every individual, rows starting at the warehouse and padded with it.
+        y_pk (np.ndarray): (*P*, *K*) vehicle assigned to package *k* in every individual.
+        z_pj (np.ndarray): (*P*, *m*) courier assigned to vehicle *j* in every individual.
+
+    Methods
+    -------
+        from_solutions(problem, solutions) -> PopulationBatch: Stacks a list of solutions.
+        to_solutions(solution_class=Solution) -> list[Solution]: Unstacks the individuals.
+        take(indices) -> PopulationBatch: Returns the batch of the selected individuals.
+        encode() -> bytes: Encodes the population as one contiguous buffer, without the problem.
+        decode(buffer, problem=None) -> PopulationBatch: Decodes a buffer made by encode().
+        get_l_pj(): Returns the time at which vehicle *j* is back at the warehouse in every individual.
+        get_t_pi(): Returns the *t*<sub>i</sub> matrix of every individual.
+        get_v_pk(): Returns the *v*<sub>k</sub> matrix of every individual.
+        get_d_pj(): Returns the *d*<sub>j</sub> matrix of every individual.
+        get_m_pjo(): Returns the load of vehicle *j* leaving each node of its route in every individual.
+    """
+
+    MAGIC = b"PBATCH01"
+
+    def __init__(
+        self,
+        problem: Problem,
+        x_pjv: np.ndarray,
+        y_pk: np.ndarray,
+        z_pj: np.ndarray,
+    ):
+        self.problem = problem
+        self.x_pjv = x_pjv
+        self.y_pk = y_pk
+        self.z_pj = z_pj
+
+    @classmethod
+    def from_solutions(cls, problem: Problem, solutions: list[Solution]):
+        dtype = problem.index_dtype
+        shape = (len(solutions), problem.n_vehicles, problem.n_nodes + 1)
+
+        x_pjv = np.empty(shape, dtype=dtype)
+        y_pk = np.empty((len(solutions), problem.n_packages), dtype=dtype)
+        z_pj = np.empty((len(solutions), problem.n_vehicles), dtype=dtype)
+        for p, solution in enumerate(solutions):
+            x_pjv[p] = solution.get_x_jv()
+            y_pk[p] = solution.y_k
+            z_pj[p] = solution.z_j
+
+        # drop the columns in which every vehicle is back at the warehouse
+        visited = np.any(x_pjv != problem.graph.warehouse, axis=(0, 1))
+        width = (np.nonzero(visited)[0].max() if visited.any() else 0) + 2
+
+        return cls(problem, np.ascontiguousarray(x_pjv[..., :width]), y_pk, z_pj)
+
+    def encode(self):
+        """Encodes the population as one contiguous buffer: a header with the problem
+        fingerprint and the array shapes, followed by the raw routes, package and
+        courier assignments.
+        """
+        dtype = np.result_type(self.x_pjv, self.y_pk, self.z_pj)
+        shape = np.array(
+            [*self.x_pjv.shape, self.y_pk.shape[1], dtype.itemsize], dtype="<i8"
+        )
+
+        return b"".join(
+            (
+                self.MAGIC,
+                self.problem.fingerprint.encode("ascii"),
+                shape.tobytes(),
+                np.ascontiguousarray(self.x_pjv, dtype.newbyteorder("<")).tobytes(),
+                np.ascontiguousarray(self.y_pk, dtype.newbyteorder("<")).tobytes(),
+                np.ascontiguousarray(self.z_pj, dtype.newbyteorder("<")).tobytes(),
+            )
+        )
+
+    @classmethod
+    def decode(cls, buffer, problem: Problem | None = None):
+        """Decodes a buffer made by encode(). The arrays are read-only views of the
+        buffer, the problem is looked up by fingerprint unless given.
+        """
+        buffer = memoryview(buffer).cast("B")
+        if bytes(buffer[:8]) != cls.MAGIC:
+            raise ValueError("Not an encoded population")
+
+        fingerprint = bytes(buffer[8:40]).decode("ascii")
+        n, n_vehicles, width, n_packages, itemsize = np.frombuffer(
+            buffer, dtype="<i8", count=5, offset=40
+        ).tolist()
+        if problem is None:
+            problem = Problem.registered(fingerprint)
+
+        dtype = np.dtype(f"<i{itemsize}")
+        offset = 80
+        arrays = []
+        for shape in ((n, n_vehicles, width), (n, n_packages), (n, n_vehicles)):
+            count = int(np.prod(shape))
+            array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            arrays.append(array.reshape(shape))
+            offset += count * itemsize
+
+        return cls(problem, *arrays)
+
+    def __reduce__(self):
+        return (PopulationBatch.decode, (self.encode(),))
+
+    def __len__(self):
+        return self.x_pjv.shape[0]
+
+    def to_solutions(self, solution_class: type[Solution] = Solution):
+        warehouse = self.problem.graph.warehouse
+        n_nodes = self.problem.n_nodes
+
+        solutions = []
+        for x_jv, y_k, z_j in zip(self.x_pjv, self.y_pk, self.z_pj):
+            dense = np.full((x_jv.shape[0], n_nodes + 1), warehouse, dtype=int)
+            dense[:, : x_jv.shape[1]] = x_jv
+            solutions.append(
+                solution_class(self.problem, dense, y_k.astype(int), z_j.astype(int))
+            )
+
+        return solutions
+
+    def take(self, indices):
+        return PopulationBatch(
+            self.problem,
+            self.x_pjv[indices],
+            self.y_pk[indices],
+            self.z_pj[indices],
+        )
+
+    def _arrival_times(self):
+        """Returns the edges of every route along with the running travel time at the
+        end of each of them.
+        """
+        u, v, mask = route_edges(self.x_pjv, self.problem.graph.warehouse)
+        l_v = np.cumsum(np.where(mask, self.problem.s_uv[u, v], 0), axis=-1)
+        return v, mask, l_v
+
+    def get_l_pj(self):
+        """Calculates the time at which vehicle *j* is back at the warehouse, the
+        *l*<sup>j</sup><sub>0</sub> entries, for every individual.
+        """
+        _, _, l_v = self._arrival_times()
+        return l_v[..., -1].copy()
+
+    def get_t_pi(self):
+        """Calculates the *t*<sub>i</sub> matrix for every individual.
+        *t*<sub>i</sub> maps the total working time of courier *i*.
+        """
+        n_couriers = self.problem.n_couriers
+        l_pj = self.get_l_pj()
+
+        # the first vehicle assigned to each courier determines its working time
+        p, j = np.nonzero(self.z_pj >= 0)
+        key = p * n_couriers + self.z_pj[p, j]
+        key, first = np.unique(key, return_index=True)
+
+        t_pi = np.zeros((len(self), n_couriers))
+        t_pi.flat[key] = l_pj[p[first], j[first]]
+        return t_pi
+
+    def get_v_pk(self):
+        """Calculates the *v*<sub>k</sub> matrix for every individual.
+        *v*<sub>k</sub> maps the time taken to deliver/pick-up package *k*.
+        """
+        problem = self.problem
+        n_vehicles = problem.n_vehicles
+        n_nodes = problem.n_nodes
+        v, mask, l_v = self._arrival_times()
+
+        # stops of every route, encoded as (individual * m + vehicle) * n + node
+        p, j, o = np.nonzero(mask)
+        stops = (p * n_vehicles + j) * n_nodes + v[p, j, o]
+        order = np.argsort(stops, kind="stable")
+        stops = stops[order]
+
+        # last time the vehicle carrying each package reaches its address
+        p_k, k = np.nonzero((self.y_pk >= 0) & (self.y_pk < n_vehicles))
+        keys = (p_k * n_vehicles + self.y_pk[p_k, k]) * n_nodes + problem.h_k[k]
+        last = np.searchsorted(stops, keys, side="right") - 1
+        found = last >= 0
+        found[found] = stops[last[found]] == keys[found]
+
+        v_pk = np.zeros((len(self), problem.n_packages))
+        v_pk[p_k[found], k[found]] = l_v[p, j, o][order[last[found]]]
+        return v_pk
+
+    def get_d_pj(self):
+        """Calculates the *d*<sub>j</sub> matrix for every individual.
+        *d*<sub>j</sub> maps the total distance covered by vehicle *j*.
+        """
+        u, v, mask = route_edges(self.x_pjv, self.problem.graph.warehouse)
+
+        # accumulate (rather than sum) to add the distances up in route order
+        g = np.where(mask, self.problem.g_uv[u, v], 0)
+        return np.cumsum(g, axis=-1)[..., -1].copy()
+
+    def get_m_pjo(self):
+        """Calculates the load of vehicle *j* as it leaves the *o*-th node of its route,
+        aligned with the columns of x_pjv, for every individual. The first column is the
+        load leaving the warehouse and the columns past the end of the route hold the
+        load brought back to it. The weights are added up in the same order as in
+        Solution.get_m_jv(), so that both give the same loads.
+        """
+        problem = self.problem
+        warehouse = problem.graph.warehouse
+        n_individuals, n_vehicles, width = self.x_pjv.shape
+        n_nodes = problem.n_nodes
+
+        _, v, mask = route_edges(self.x_pjv, warehouse)
+
+        # stops of every route, encoded as (individual * m + vehicle) * n + node
+        p, j, o = np.nonzero(mask & (v != warehouse))
+        stops = (p * n_vehicles + j) * n_nodes + v[p, j, o]
+        order = np.argsort(stops, kind="stable")
+        stops = stops[order]
+
+        # every stop of the vehicle carrying each package at its address
+        p_k, k = np.nonzero((self.y_pk >= 0) & (self.y_pk < n_vehicles))
+        vehicle = p_k * n_vehicles + self.y_pk[p_k, k]
+        keys = vehicle * n_nodes + problem.h_k[k]
+        start = np.searchsorted(stops, keys, side="left")
+        counts = np.searchsorted(stops, keys, side="right") - start
+        package = np.repeat(np.arange(k.size), counts)
+        stop = order[
+            np.repeat(start - (np.cumsum(counts) - counts), counts)
+            + np.arange(counts.sum())
+        ]
+
+        delivered = np.where(problem.is_pickup, 0.0, problem.w_k)[k]
+        picked_up = np.where(problem.is_pickup, problem.w_k, 0.0)[k]
+        delivery = np.bincount(stop, weights=delivered[package], minlength=p.size)
+        pickup = np.bincount(stop, weights=picked_up[package], minlength=p.size)
+
+        # Load the vehicles with the weight of the packages assigned to them
+        load = np.bincount(
+            vehicle, weights=delivered, minlength=n_individuals * n_vehicles
+        )
+
+        # Interleave the deliveries and pickups of every stop, as Solution.get_m_jv()
+        change = np.zeros((n_individuals, n_vehicles, 2 * width - 1))
+        change[..., 0] = load.reshape(n_individuals, n_vehicles)
+        change[p, j, 2 * o + 1] = -delivery
+        change[p, j, 2 * o + 2] = pickup
+        return np.cumsum(change, axis=-1)[..., ::2]
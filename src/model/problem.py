@@ -1,11 +1,23 @@
+import hashlib
+import weakref
+
 import numpy as np
+from scipy.sparse.csgraph import csgraph_from_dense, shortest_path
+from scipy.spatial import cKDTree
 
+from model.artifact_cache import ArtifactCache
 from model.input import Courier, Package, Vehicle
-from model.input.graph import Graph
+from model.input.graph import EuclideanGraph, Graph
+from model.input.mapped_graph import MappedGraph
+
+# Problems alive in this process, looked up by fingerprint when unpickling solutions
+_registry: "weakref.WeakSet[Problem]" = weakref.WeakSet()
 
 
 class Problem:
     """Problem class for the vehicle routing problem with time windows.
+    The couriers, vehicles and packages are also stored as read-only columns, one array
+    per field, built once from the dataclasses and read by the hot paths.
 
     Args
     ----
@@ -26,10 +38,47 @@ class Problem:
         n_vehicles (int): Number of vehicles.
         n_packages (int): Number of packages.
         n_nodes (int): Number of nodes in the graph.
-        s_uv (np.ndarray): Matrix mapping the time taken to travel from node u to node v.
-        g_uv (np.ndarray): Matrix mapping the distance taken to travel from node u to node v.
+        s_uv (np.ndarray | TravelMatrix): Matrix mapping the time taken to travel from node u to node v.
+        g_uv (np.ndarray | TravelMatrix): Matrix mapping the distance taken to travel from node u to node v.
+        index_dtype (type): Narrowest signed integer dtype able to hold any node, vehicle, courier or package index.
+        h_k (np.ndarray): Destination address of each package.
+        w_k (np.ndarray): Weight of each package.
+        a_k (np.ndarray): Earliest time each package can be handled.
+        b_k (np.ndarray): Latest time each package must be handled by.
+        is_pickup (np.ndarray): Mask of the packages that are picked up rather than delivered.
+        c_i (np.ndarray): Hourly rate of each courier.
+        b_i (np.ndarray): Work limit of each courier.
+        q_j (np.ndarray): Capacity of each vehicle.
+        p_j (np.ndarray): Fuel consumption of each vehicle.
+        node_ptr (np.ndarray): CSR offsets of the packages addressed to each node, the packages of node *v* are node_packages[node_ptr[v]:node_ptr[v + 1]].
+        node_packages (np.ndarray): Package ids grouped by address, in package order within each node.
+        node_delivery (np.ndarray): Weight delivered by each entry of node_packages (0 for pickups).
+        node_pickup (np.ndarray): Weight picked up by each entry of node_packages (0 for deliveries).
+        r_ij (np.ndarray): Boolean (*n*, *m*) matrix of the permissions, whether courier *i* may drive vehicle *j*.
+        courier_ptr (np.ndarray): CSR offsets of the vehicles each courier may drive, those of courier *i* are courier_vehicles[courier_ptr[i]:courier_ptr[i + 1]].
+        courier_vehicles (np.ndarray): Vehicles grouped by the courier allowed to drive them, in increasing order for each courier.
+        vehicle_ptr (np.ndarray): CSR offsets of the couriers allowed to drive each vehicle, those of vehicle *j* are vehicle_couriers[vehicle_ptr[j]:vehicle_ptr[j + 1]].
+        vehicle_couriers (np.ndarray): Couriers grouped by the vehicle they may drive, in increasing order for each vehicle.
+        e_v (np.ndarray): Shortest time taken to reach node *v* from the warehouse, built on first access.
+        f_v (np.ndarray): Shortest time taken to get back to the warehouse from node *v*, built on first access.
+        compatible_kj (np.ndarray): Boolean (*f*, *m*) matrix, whether package *k* can be carried by vehicle *j* at all, given its weight, its time window and the work limits of the couriers allowed to drive the vehicle. Built on first access.
+        compatible_ij (np.ndarray): Boolean (*n*, *m*) matrix, whether courier *i* may drive vehicle *j* and has the time to deliver at least one package it can carry. Built on first access.
+        compatible_kl (np.ndarray | None): Boolean (*f*, *f*) matrix, whether packages *k* and *l* can share a route, given their time windows, the travel time between their addresses and the capacity of the largest vehicle. Built on first access, None with more than max_pairwise_packages packages.
+        fingerprint (str): Hash of the content of the problem, equal for identical problems in any process or platform.
+
+    Methods
+    -------
+        registered(fingerprint) -> Problem: Returns the problem of this process with the given fingerprint.
+        to_memmap(directory, dtype, packed) -> Problem: Returns the problem with its travel matrices memory-mapped.
+        get_neighbours(k, cache) -> np.ndarray: Returns the *k* nearest neighbours of every node.
     """
 
+    # largest graph whose shortest paths are all computed, travel times between
+    # addresses being only bounded by 0 beyond it
+    max_closure_nodes = 1024
+    # largest number of packages with a package x package compatibility matrix
+    max_pairwise_packages = 4096
+
     def __init__(
         self,
         couriers: list[Courier],
@@ -50,7 +99,176 @@ class Problem:
         self.n_packages = len(packages)
         self.n_nodes = graph.n_nodes
 
+        n_max = max(self.n_nodes, self.n_vehicles, self.n_couriers, self.n_packages)
+        self.index_dtype = next(
+            dtype
+            for dtype in (np.int16, np.int32, np.int64)
+            if n_max < np.iinfo(dtype).max
+        )
+
+        self._calc_columns()
         self._calc_s_uv_g_uv()
+        self._calc_node_index()
+        self._calc_permission_index()
+        self._compatibility: tuple[np.ndarray, ...] | None = None
+        self._freeze_columns()
+
+        self._neighbours: dict[int, np.ndarray] = {}
+        self._fingerprint: str | None = None
+        _registry.add(self)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._freeze_columns()
+        _registry.add(self)
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = self._calc_fingerprint()
+        return self._fingerprint
+
+    def _calc_fingerprint(self):
+        arrays = (
+            np.column_stack((self.c_i, self.b_i)),
+            np.column_stack((self.q_j, self.p_j)),
+            np.column_stack((self.h_k, self.w_k, self.a_k, self.b_k, self.is_pickup)),
+            np.array(sorted(self.permissions), np.int64),
+            np.array([self.graph.warehouse], np.int64),
+            np.asarray(self.graph.points, float),
+            *self.graph.metric_arrays(),
+        )
+
+        h = hashlib.blake2b(digest_size=16)
+        for array in arrays:
+            # hash little-endian bytes so that the fingerprint is the same everywhere
+            array = np.ascontiguousarray(array, array.dtype.newbyteorder("<"))
+            h.update(f"{array.dtype.str}{array.shape}".encode())
+            h.update(array)
+        return h.hexdigest()
+
+    @staticmethod
+    def registered(fingerprint: str):
+        """Returns a problem of this process with the given fingerprint. Problems are
+        registered when they are created or unpickled.
+
+        Raises
+        ------
+            KeyError: If no such problem has been loaded in this process.
+        """
+        for problem in list(_registry):
+            if problem.fingerprint == fingerprint:
+                return problem
+
+        raise KeyError(
+            f"No problem with fingerprint {fingerprint} in this process, "
+            "load it before unpickling its solutions"
+        )
+
+    def to_memmap(self, directory: str, dtype=np.float32, packed=False):
+        """Returns the same problem with its travel matrices stored in memory-mapped files
+        of the given precision, for instances too large to keep them in memory. Pickling
+        the returned problem only carries the directory, so worker processes opening it
+        share one copy of the matrices.
+
+        Args
+        ----
+            directory (str): Directory the graph files are written to.
+            dtype (np.dtype): Precision of the stored matrices. Defaults to float32.
+            packed (bool): Whether to store only the upper triangle of the symmetric matrices. Defaults to False.
+
+        Returns
+        -------
+            Problem: Problem sharing the couriers, vehicles, packages and permissions of this one.
+        """
+        graph = MappedGraph.from_graph(self.graph, directory, dtype, packed)
+        return Problem(
+            self.couriers, self.vehicles, self.packages, self.permissions, graph
+        )
+
+    @property
+    def e_v(self):
+        return self._get_compatibility()[0]
+
+    @property
+    def f_v(self):
+        return self._get_compatibility()[1]
+
+    @property
+    def compatible_kj(self):
+        return self._get_compatibility()[2]
+
+    @property
+    def compatible_ij(self):
+        return self._get_compatibility()[3]
+
+    @property
+    def compatible_kl(self):
+        return self._get_compatibility()[4]
+
+    def _get_compatibility(self):
+        if self._compatibility is None:
+            self._compatibility = self._calc_compatibility()
+            self._freeze_columns()
+        return self._compatibility
+
+    def get_neighbours(self, k: int, cache: ArtifactCache | None = None):
+        """Returns the candidate lists of the granular neighbourhoods: the *k* nearest
+        neighbours of every node, closest first. Euclidean graphs query a KD-tree of their
+        points, other graphs rank the travel times of *s*<sub>uv</sub> a block of rows
+        at a time. The lists are cached for every *k*, in memory and, if given, on disk.
+
+        Args
+        ----
+            k (int): Number of neighbours of every node, at most *n* - 1.
+            cache (ArtifactCache | None): On-disk cache the lists are looked up in and saved to. Defaults to None.
+
+        Returns
+        -------
+            np.ndarray: (*n*, *k*) matrix of the nearest neighbours of every node.
+        """
+        k = min(k, self.n_nodes - 1)
+        if k < 1:
+            return np.empty((self.n_nodes, 0), dtype=int)
+        if k in self._neighbours:
+            return self._neighbours[k]
+
+        name = f"neighbours-{k}.npy"
+        neighbours = cache.load_array(self.fingerprint, name) if cache else None
+        if neighbours is None:
+            neighbours = self._calc_neighbours(k)
+            if cache:
+                cache.save_array(self.fingerprint, name, neighbours)
+
+        neighbours.flags.writeable = False
+        self._neighbours[k] = neighbours
+        return neighbours
+
+    def _calc_neighbours(self, k: int):
+        nodes = np.arange(self.n_nodes)
+        if isinstance(self.graph, EuclideanGraph):
+            _, nearest = cKDTree(self.graph.points).query(self.graph.points, k + 1)
+            nearest = nearest.reshape(self.n_nodes, k + 1)
+
+            # drop every node from its own list, or its farthest neighbour when
+            # another point at the same place came first
+            keep = nearest != nodes[:, None]
+            keep[keep.all(axis=1), -1] = False
+            neighbours = nearest[keep].reshape(self.n_nodes, k)
+        else:
+            neighbours = np.empty((self.n_nodes, k), dtype=int)
+            for start in range(0, self.n_nodes, 1024):
+                rows = np.array(self.s_uv[start : start + 1024], dtype=float)
+                block = nodes[start : start + rows.shape[0]]
+                rows[block - start, block] = np.inf
+
+                nearest = np.argpartition(rows, k - 1, axis=1)[:, :k]
+                order = np.argsort(
+                    np.take_along_axis(rows, nearest, 1), axis=1, kind="stable"
+                )
+                neighbours[block] = np.take_along_axis(nearest, order, 1)
+
+        return neighbours
 
     def info(self):
         return f"Problem(couriers={self.n_couriers}, vehicles={self.n_vehicles}, packages={self.n_packages}, graph_nodes={self.n_nodes})"
@@ -72,19 +290,177 @@ class Problem:
         )
         return "\n".join(rows)
 
+    def _calc_columns(self):
+        """Calculates the columns of the couriers, vehicles and packages."""
+        packages, couriers, vehicles = self.packages, self.couriers, self.vehicles
+
+        self.h_k = np.array([p.address for p in packages], dtype=int)
+        self.w_k = np.array([p.weight for p in packages], dtype=float)
+        self.a_k = np.array([p.start_time for p in packages], dtype=float)
+        self.b_k = np.array([p.end_time for p in packages], dtype=float)
+        self.is_pickup = np.array([p.type == "pickup" for p in packages], dtype=bool)
+
+        self.c_i = np.array([c.hourly_rate for c in couriers], dtype=float)
+        self.b_i = np.array([c.work_limit for c in couriers], dtype=float)
+
+        self.q_j = np.array([v.capacity for v in vehicles], dtype=float)
+        self.p_j = np.array([v.fuel_consumption for v in vehicles], dtype=float)
+
+    def _freeze_columns(self):
+        """Makes the columns and the indexes derived from them read-only, so that they
+        cannot drift away from the dataclasses they were built from.
+        """
+        columns = (
+            *(self.h_k, self.w_k, self.a_k, self.b_k, self.is_pickup),
+            *(self.c_i, self.b_i, self.q_j, self.p_j),
+            *(self.node_ptr, self.node_packages, self.node_delivery, self.node_pickup),
+            *(self.r_ij, self.courier_ptr, self.courier_vehicles),
+            *(self.vehicle_ptr, self.vehicle_couriers),
+            *(self._compatibility or ()),
+        )
+        for column in columns:
+            if column is not None:
+                column.flags.writeable = False
+
     def _calc_s_uv_g_uv(self):
         """Calculates the *s*<sub>uv</sub> and *g*<sub>uv</sub>  matrices for the problem:
         - *s*<sub>uv</sub> maps the time taken to travel from node *u* to node *v*,
         - *g*<sub>uv</sub> maps the distance taken to travel from node *u* to node *v*.
         """
-        n_nodes = self.graph.n_nodes
+        self.s_uv = self.graph.time_matrix
+        self.g_uv = self.graph.dist_matrix
+
+    def _calc_node_index(self):
+        """Calculates the CSR index from every node to the packages addressed to it,
+        together with the weights delivered and picked up by each indexed package.
+        """
+        self.node_packages = np.argsort(self.h_k, kind="stable")
+
+        per_node = np.bincount(self.h_k, minlength=self.n_nodes)
+        self.node_ptr = np.zeros(per_node.size + 1, dtype=int)
+        np.cumsum(per_node, out=self.node_ptr[1:])
+
+        weights = self.w_k[self.node_packages]
+        pickup = self.is_pickup[self.node_packages]
+        self.node_delivery = np.where(pickup, 0.0, weights)
+        self.node_pickup = np.where(pickup, weights, 0.0)
+
+    def _calc_permission_index(self):
+        """Calculates the *r*<sub>i,j</sub> permission matrix together with the CSR lists
+        of the vehicles each courier may drive and of the couriers allowed to drive each
+        vehicle.
+        """
+        self.r_ij = np.zeros((self.n_couriers, self.n_vehicles), dtype=bool)
+        if self.permissions:
+            i, j = np.array(self.permissions, dtype=int).T
+            self.r_ij[i, j] = True
+
+        # permitted pairs, ordered by courier and then by vehicle
+        i, j = np.nonzero(self.r_ij)
+
+        self.courier_vehicles = j
+        per_courier = np.bincount(i, minlength=self.n_couriers)
+        self.courier_ptr = np.zeros(per_courier.size + 1, dtype=int)
+        np.cumsum(per_courier, out=self.courier_ptr[1:])
+
+        self.vehicle_couriers = i[np.argsort(j, kind="stable")]
+        per_vehicle = np.bincount(j, minlength=self.n_vehicles)
+        self.vehicle_ptr = np.zeros(per_vehicle.size + 1, dtype=int)
+        np.cumsum(per_vehicle, out=self.vehicle_ptr[1:])
+
+    def _calc_shortest_paths(self):
+        """Calculates the shortest time taken to travel between every two nodes, through
+        any sequence of stops, unless the graph is too large, and the shortest times from
+        and back to the warehouse. Routes may be faster than the direct trips when the
+        travel times do not satisfy the triangle inequality.
+        """
+        warehouse = self.graph.warehouse
+        if self.graph.shortest_paths:
+            s_uv = np.asarray(self.s_uv, dtype=float)
+        elif self.n_nodes <= self.max_closure_nodes:
+            graph = csgraph_from_dense(np.asarray(self.s_uv, float), null_value=np.inf)
+            s_uv = shortest_path(graph, method="FW")
+        else:
+            return None, self.__dijkstra(False), self.__dijkstra(True)
+
+        return s_uv, s_uv[warehouse].copy(), s_uv[:, warehouse].copy()
+
+    def __dijkstra(self, backwards: bool):
+        """Runs Dijkstra from (or, backwards, to) the warehouse over the dense
+        *s*<sub>uv</sub> matrix, reading one row (or column) per settled node.
+        """
+        times = np.full(self.n_nodes, np.inf)
+        times[self.graph.warehouse] = 0.0
+        settled = np.zeros(self.n_nodes, dtype=bool)
+
+        for _ in range(self.n_nodes):
+            u = np.argmin(np.where(settled, np.inf, times))
+            if settled[u] or not np.isfinite(times[u]):
+                break
+            settled[u] = True
+            row = self.s_uv[:, u] if backwards else self.s_uv[u]
+            np.minimum(times, times[u] + np.asarray(row, dtype=float), out=times)
+
+        return times
+
+    def _calc_compatibility(self):
+        """Calculates the static compatibility matrices, which rule out the choices that
+        no feasible solution makes whatever the rest of it:
+        - a package heavier than a vehicle, or that nobody allowed to drive it has the
+          time to deliver, cannot be carried by that vehicle,
+        - a package whose time window closes before its address can be reached cannot
+          be carried at all,
+        - a courier cannot drive a vehicle that it has no time to deliver any package with,
+        - two packages cannot share a route when neither can be handled before the
+          other in their time windows, or when they overload the largest vehicle.
+        """
+        s_uv, e_v, f_v = self._calc_shortest_paths()
+        h_k, w_k = self.h_k, self.w_k
+
+        # earliest time each package can be handled, vehicles never wait
+        handled = e_v[h_k] <= self.b_k
+        start_k = np.maximum(self.a_k, e_v[h_k])
+        work_k = start_k + f_v[h_k]
+
+        # largest work limit of the couriers allowed to drive each vehicle
+        b_j = np.where(self.r_ij, self.b_i[:, None], -np.inf).max(
+            axis=0, initial=-np.inf
+        )
+        compatible_kj = (
+            handled[:, None]
+            & (w_k[:, None] <= self.q_j[None, :])
+            & (work_k[:, None] <= b_j[None, :])
+        )
+
+        work_j = np.where(compatible_kj, work_k[:, None], np.inf).min(
+            axis=0, initial=np.inf
+        )
+        compatible_ij = self.r_ij & (self.b_i[:, None] >= work_j[None, :])
+
+        compatible_kl = None
+        if self.n_packages <= self.max_pairwise_packages:
+            t_kl = 0.0 if s_uv is None else s_uv[np.ix_(h_k, h_k)]
+
+            # handling k, then travelling to the address of l in time
+            before = start_k[:, None] + t_kl <= self.b_k[None, :]
+            compatible_kl = before | before.T
+
+            # packages of one address are handled at the same time
+            same = h_k[:, None] == h_k[None, :]
+            overlap = np.maximum.outer(start_k, start_k) <= np.minimum.outer(
+                self.b_k, self.b_k
+            )
+            compatible_kl[same] = overlap[same]
+
+            # deliveries are all loaded at the warehouse and pickups are all unloaded there
+            same_kind = self.is_pickup[:, None] == self.is_pickup[None, :]
+            overload = np.add.outer(w_k, w_k) > self.q_j.max(initial=0.0)
+            compatible_kl &= ~(same_kind & overload)
 
-        self.s_uv = np.zeros((n_nodes, n_nodes))
-        self.g_uv = np.zeros((n_nodes, n_nodes))
+            compatible_kl &= handled[:, None] & handled[None, :]
+            np.fill_diagonal(compatible_kl, handled)
 
-        for u, v, dist, time in self.graph.routes:
-            self.s_uv[u, v] = time
-            self.g_uv[u, v] = dist
+        return e_v, f_v, compatible_kj, compatible_ij, compatible_kl
 
     def asdict(self):
         return {
@@ -0,0 +1,101 @@
+import sys
+from collections import OrderedDict
+
+
+class RouteCache:
+    """Bounded LRU cache of route evaluations, shared by the solutions of a population
+    of the same problem.
+    Individuals often share identical vehicle routes, so the arrival times, distance and
+    load profile of a route are only computed once.
+
+    Entries are keyed by (vehicle, route stop sequence, assigned package set), see
+    Solution._route_keys, and hold the fields:
+        l_v (np.ndarray): Time taken by the vehicle to reach every stop of its route.
+        d (float): Total distance covered by the vehicle.
+        m_v (np.ndarray): Load of the vehicle leaving the warehouse, then leaving every stop.
+    so that the size of an entry grows with the length of the route, not with the
+    number of nodes of the problem.
+
+    Args
+    ----
+        max_bytes (int): Maximum memory taken by the entries, the least recently used are evicted first. Defaults to 64 MiB.
+
+    Attributes
+    ----------
+        hits (int): Number of lookups answered by the cache.
+        misses (int): Number of lookups that had to be computed.
+        hit_rate (float): Share of the lookups answered by the cache.
+        nbytes (int): Measured memory taken by the entries, keys included.
+    Methods
+    -------
+        get(key, field): Returns a cached field of a route, None if missing.
+        put(key, field, value): Caches a field of a route.
+        stats() -> dict: Returns the hit-rate statistics of the cache.
+        clear(): Empties the cache and resets its statistics.
+    """
+
+    FIELDS = ("l_v", "d", "m_v")
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, dict] = OrderedDict()
+
+    @staticmethod
+    def _sizeof(key, entry):
+        return (
+            sys.getsizeof(key)
+            + sum(sys.getsizeof(part) for part in key)
+            + sys.getsizeof(entry)
+            + sum(sys.getsizeof(value) for value in entry.values() if value is not None)
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key, field):
+        entry = self._entries.get(key)
+        if entry is None or entry[field] is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[field]
+
+    def put(self, key, field, value):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = dict.fromkeys(self.FIELDS)
+        else:
+            self._entries.move_to_end(key)
+            self.nbytes -= self._sizeof(key, entry)
+
+        entry[field] = value
+        self.nbytes += self._sizeof(key, entry)
+
+        while self.nbytes > self.max_bytes and self._entries:
+            self.nbytes -= self._sizeof(*self._entries.popitem(last=False))
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "size": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,190 @@
+import numpy as np
+
+
+def route_edges(x_jv: np.ndarray, warehouse=0):
+    """Returns the edges travelled along routes given as rows starting at the warehouse
+    and padded with it, as two matrices of start and end nodes, along with a mask of
+    the edges driven before the vehicle first returns to the warehouse.
+    """
+    u, v = x_jv[..., :-1], x_jv[..., 1:]
+
+    # an edge is driven if no earlier edge has already ended at the warehouse
+    returned = np.logical_or.accumulate(v == warehouse, axis=-1)
+    mask = np.ones_like(returned)
+    mask[..., 1:] = ~returned[..., :-1]
+
+    return u, v, mask
+
+
+class Routes:
+    """Variable-length (CSR) encoding of the vehicle routes, an alternative to the dense
+    (*m*, *n* + 1) *x*<sub>j,v</sub> matrix whose memory scales with the number of stops.
+
+    The routes are kept in a buffer with room to spare, so that replacing a route only
+    writes that route: in place if it fits in the slot of the vehicle, at the free end
+    of the buffer otherwise. The buffer is compacted once that free end runs out.
+
+    Args
+    ----
+        stops (np.ndarray): Nodes visited by the vehicles, route after route, without the warehouse.
+        offsets (np.ndarray): Offsets of the routes in stops, the route of vehicle *j* is stops[offsets[j]:offsets[j + 1]].
+        warehouse (int): Identifier for the warehouse node.
+
+    Attributes
+    ----------
+        stops (np.ndarray): Nodes visited by the vehicles, route after route, a view of the buffer if it is compact and a copy otherwise.
+        offsets (np.ndarray): Offsets of the routes in stops.
+        lengths (np.ndarray): Number of stops of every route.
+
+    Methods
+    -------
+        from_dense(x_jv, warehouse) -> Routes: Encodes a dense *x*<sub>j,v</sub> matrix.
+        from_routes(routes, warehouse) -> Routes: Encodes a list of routes.
+        to_dense(width) -> np.ndarray: Decodes the routes into a dense *x*<sub>j,v</sub> matrix.
+        route(j) -> np.ndarray: Returns the route of vehicle *j*.
+        set_route(j, route): Replaces the route of vehicle *j*.
+        padded(js) -> np.ndarray: Returns the routes of vehicles *js* as dense rows just wide enough for them.
+    """
+
+    __slots__ = ("_buffer", "_start", "_end", "_limit", "_used", "warehouse")
+
+    def __init__(self, stops: np.ndarray, offsets: np.ndarray, warehouse=0):
+        # the route of vehicle j is _buffer[_start[j]:_end[j]] and may grow in place
+        # up to _limit[j], the buffer past _used being free
+        self._buffer = stops
+        self._start = np.array(offsets[:-1], dtype=int)
+        self._end = np.array(offsets[1:], dtype=int)
+        self._limit = self._end.copy()
+        self._used = int(offsets[-1])
+        self.warehouse = warehouse
+
+    @classmethod
+    def from_dense(cls, x_jv: np.ndarray, warehouse=0):
+        visited = x_jv != warehouse
+
+        offsets = np.zeros(x_jv.shape[0] + 1, dtype=int)
+        np.cumsum(visited.sum(axis=1), out=offsets[1:])
+
+        return cls(x_jv[visited], offsets, warehouse)
+
+    @classmethod
+    def from_routes(cls, routes: list[np.ndarray], warehouse=0, dtype=int):
+        offsets = np.zeros(len(routes) + 1, dtype=int)
+        np.cumsum([len(route) for route in routes], out=offsets[1:])
+
+        stops = np.concatenate([np.asarray(r, dtype=dtype) for r in routes] or [[]])
+        return cls(stops.astype(dtype, copy=False), offsets, warehouse)
+
+    def __reduce__(self):
+        # pickle the routes compacted, without the room to spare
+        return Routes, (np.array(self.stops), self.offsets, self.warehouse)
+
+    def __repr__(self):
+        return f"Routes({[self.route(j).tolist() for j in range(self.n_vehicles)]})"
+
+    @property
+    def n_vehicles(self):
+        return self._start.size
+
+    @property
+    def lengths(self):
+        return self._end - self._start
+
+    @property
+    def offsets(self):
+        offsets = np.zeros(self.n_vehicles + 1, dtype=int)
+        np.cumsum(self.lengths, out=offsets[1:])
+        return offsets
+
+    @property
+    def stops(self):
+        lengths = self.lengths
+        if np.array_equal(self._start, np.cumsum(lengths) - lengths):
+            return self._buffer[: lengths.sum()]
+        return self._gather(self._start, lengths)
+
+    @property
+    def dtype(self):
+        return self._buffer.dtype
+
+    @property
+    def nbytes(self):
+        return (
+            self._buffer.nbytes
+            + self._start.nbytes
+            + self._end.nbytes
+            + self._limit.nbytes
+        )
+
+    def copy(self):
+        return Routes(np.array(self.stops), self.offsets, self.warehouse)
+
+    def astype(self, dtype, copy=True):
+        return Routes(self.stops.astype(dtype, copy=copy), self.offsets, self.warehouse)
+
+    def route(self, j):
+        return self._buffer[self._start[j] : self._end[j]]
+
+    def set_route(self, j, route):
+        route = np.asarray(route, dtype=self._buffer.dtype)
+
+        start = self._start[j]
+        if route.size > self._limit[j] - start:
+            # move the route to the free end of the buffer, with room to grow
+            size = route.size + route.size // 2 + 1
+            if self._used + size > self._buffer.size:
+                self._compact(size)
+            start = self._start[j] = self._used
+            self._limit[j] = self._used = start + size
+
+        self._buffer[start : start + route.size] = route
+        self._end[j] = start + route.size
+
+    def _compact(self, size):
+        """Packs the routes at the start of a new buffer leaving at least size free
+        entries at its end, twice as large as needed so that compactions are rare.
+        """
+        lengths = self.lengths
+        used = int(lengths.sum())
+
+        buffer = np.empty(2 * (used + size), dtype=self._buffer.dtype)
+        buffer[:used] = self._gather(self._start, lengths)
+
+        self._buffer = buffer
+        self._end = np.cumsum(lengths)
+        self._start = self._end - lengths
+        self._limit = self._end.copy()
+        self._used = used
+
+    def _gather(self, start, lengths):
+        """Returns the stops of the routes starting at start, one after the other."""
+        index = np.arange(lengths.sum()) + np.repeat(
+            start - (np.cumsum(lengths) - lengths), lengths
+        )
+        return self._buffer[index]
+
+    def padded(self, js):
+        """Returns the routes of vehicles *js* as rows starting at the warehouse and
+        padded with it, with at least one trailing warehouse on every row.
+        """
+        js = np.asarray(js)
+        start, lengths = self._start[js], self._end[js] - self._start[js]
+        width = (lengths.max() if js.size else 0) + 2
+
+        rows = np.repeat(np.arange(js.size), lengths)
+        cols = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
+        )
+
+        x = np.full((js.size, width), self.warehouse, dtype=self._buffer.dtype)
+        x[rows, cols + 1] = self._buffer[np.repeat(start, lengths) + cols]
+        return x
+
+    def to_dense(self, width):
+        """Decodes the routes into a dense *x*<sub>j,v</sub> matrix with *width* columns."""
+        x_jv = self.padded(np.arange(self.n_vehicles))
+        if x_jv.shape[1] >= width:
+            return x_jv[:, :width]
+
+        padding = np.full((x_jv.shape[0], width - x_jv.shape[1]), self.warehouse)
+        return np.hstack((x_jv, padding.astype(x_jv.dtype)))
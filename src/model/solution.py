@@ -1,21 +1,71 @@
+import sys
+from dataclasses import dataclass
 from itertools import accumulate, dropwhile
 
 import numpy as np
 
 from .problem import Problem
+from .route_cache import RouteCache
+from .routes import Routes, route_edges
 
 
 def trim_trailing(lst, val):
     return list(reversed(list(dropwhile(lambda x: x == val, reversed(lst)))))
 
 
+# Zobrist key domains of the (vehicle, position, node), package -> vehicle and
+# vehicle -> courier entries of a solution
+_ROUTE, _PACKAGE, _COURIER = 1, 2, 3
+
+
+def _splitmix64(h):
+    h = h + np.uint64(0x9E3779B97F4A7C15)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def _zobrist(domain, *keys):
+    """Returns the XOR of the 64-bit Zobrist keys of the entries described by the
+    broadcast *keys* arrays. Keys are derived by hashing instead of a random table,
+    so they need no memory and are stable across runs and processes.
+    """
+    keys = np.broadcast_arrays(*(np.atleast_1d(key) for key in keys))
+    h = np.full(keys[0].shape, domain, dtype=np.uint64)
+    for key in keys:
+        h = _splitmix64(h ^ key.astype(np.uint64))
+    return np.bitwise_xor.reduce(h)
+
+
+def _restore_solution(cls, fingerprint, x_jv, y_k, z_j):
+    """Unpickles a solution, reattaching it to the problem registered in this process."""
+    return cls(Problem.registered(fingerprint), x_jv, y_k, z_j)
+
+
+@dataclass
+class ChangeScope:
+    """Parts of a solution changed by a transaction, the only ones whose constraints
+    can have changed since it began.
+
+    Args
+    ----
+        vehicles (np.ndarray): Vehicles whose route, packages or courier were changed.
+        packages (np.ndarray): Packages assigned to another vehicle.
+        couriers (np.ndarray): Couriers assigned to or removed from a vehicle.
+    """
+
+    vehicles: np.ndarray
+    packages: np.ndarray
+    couriers: np.ndarray
+
+
 class Solution:
     """Solution class representing a solution to the vehicle routing problem.
 
     Args
     ----
         problem (Problem): Problem instance.
-        x_jv (np.ndarray): *x*<sub>j,v</sub> - vertices visited by vehicle *j*. </br>x_jv[j] = permutation of the nodes visited by vehicle *j*.
+        x_jv (np.ndarray | Routes): *x*<sub>j,v</sub> - vertices visited by vehicle *j*. </br>x_jv[j] = permutation of the nodes visited by vehicle *j*. Either the dense (*m*, *n* + 1) matrix padded with the warehouse or its variable-length Routes encoding.
         y_k (np.ndarray): *y*<sub>k</sub> - vehicle assigned to package *k*. </br>y_k[k] = j if package *k* is assigned to vehicle *j*.
         z_j (np.ndarray): *z*<sub>j</sub> - courier assigned to vehicle *j*. </br>z_j[j] = i if vehicle *j* is assigned to courier *i*.
     Attributes
@@ -27,12 +77,31 @@ class Solution:
         _t_i (np.ndarray): *t*<sub>i</sub> - total working time of courier *i*.
         _v_k (np.ndarray): *v*<sub>k</sub> - time taken to deliver/pick-up package *k*.
         _d_j (np.ndarray): *d*<sub>j</sub> - total distance covered by vehicle *j*.
-        _l_vj (np.ndarray): *l*<sup>j</sup><sub>v</sub> - time taken by vehicle *j* to travel to node *v*.
-        _m_jv (np.ndarray): *m*<sub>j,v</sub> - total weight of packages in vehicle *j* at node *v*.
+        _l_vj (np.ndarray): *l*<sup>j</sup><sub>v</sub> - time taken by vehicle *j* to travel to node *v*, one column per stored vehicle and a trailing zero column.
+        _m_jv (np.ndarray): *m*<sub>j,v</sub> - total weight of packages in vehicle *j* at node *v*, one row per stored vehicle and a trailing zero row.
+        _dirty (set[int]): Vehicles whose cached columns are outdated.
+        _t_src (np.ndarray): Vehicle whose route time makes up the working time of courier *i*, -1 if none.
+        _stored (np.ndarray): Vehicles with a column in _l_vj and a row in _m_jv.
+        _col (np.ndarray): Column of vehicle *j* in _l_vj (row in _m_jv), vehicles that are not stored map to the zero column.
+        _fingerprint (np.uint64): 64-bit Zobrist fingerprint of the solution, None until first needed.
+        fingerprint (np.uint64): Zobrist fingerprint of the routes, package and courier assignments, kept up to date by the setters.
+        route_cache (RouteCache): Cache of route evaluations shared with other solutions, e.g. the population of a GA run, keyed by the stops of every route and holding values per stop. None disables it.
+        _undo_log (list[tuple[str, int | np.ndarray, np.ndarray]]): Setter, index and previous value of every write since begin(), None outside of a transaction.
+        nbytes (int): Measured memory footprint of the solution in bytes, without the problem.
     Methods
     -------
-        recalculate(): Resets the attributes of the solution.
+        recalculate(vehicles=None): Resets the attributes of the solution, or only the parts depending on the given vehicles.
+        copy(): Returns a copy of the solution with its own assignment arrays.
         get_route(j, leading_warehouse=False, trailing_warehouse=False): Returns the route of vehicle *j*.
+        set_route(j, route): Replaces the route of vehicle *j*, whatever the encoding of *x*<sub>j,v</sub>.
+        get_x_jv(): Returns the dense *x*<sub>j,v</sub> matrix.
+        __reduce__(): Pickles the solution as its assignment arrays and the fingerprint of its problem.
+        set_y_k(k, j): Assigns package(s) *k* to vehicle(s) *j*.
+        set_z_j(j, i): Assigns vehicle(s) *j* to courier(s) *i*.
+        begin(): Starts recording the writes made through the setters.
+        commit(): Keeps the writes made since begin().
+        rollback(): Undoes the writes made since begin().
+        changes() -> ChangeScope: Returns the vehicles, packages and couriers changed since begin().
         get_t_i(): Returns the *t*<sub>i</sub> matrix for the problem.
         get_l_vj(): Returns the *l*<sup>j</sup><sub>v</sub> matrix for the problem.
         get_v_k(): Returns the *v*<sub>k</sub> matrix for the problem.
@@ -40,6 +109,25 @@ class Solution:
         get_m_jv(): Returns the *m*<sub>j,v</sub> matrix for the problem.
     """
 
+    __slots__ = (
+        "problem",
+        "x_jv",
+        "y_k",
+        "z_j",
+        "_t_i",
+        "_v_k",
+        "_d_j",
+        "_l_vj",
+        "_m_jv",
+        "_dirty",
+        "_t_src",
+        "_stored",
+        "_col",
+        "_fingerprint",
+        "_undo_log",
+        "route_cache",
+    )
+
     def __init__(
         self,
         problem: Problem,
@@ -58,32 +146,92 @@ class Solution:
         self._l_vj: np.ndarray | None = None
         self._m_jv: np.ndarray | None = None
 
-    def recalculate(self):
+        self._dirty: set[int] = set()
+        self._t_src: np.ndarray | None = None
+        self._stored: np.ndarray | None = None
+        self._col: np.ndarray | None = None
+
+        self._fingerprint: np.uint64 | None = None
+        self._undo_log: list | None = None
+
+        self.route_cache: RouteCache | None = None
+
+    def recalculate(self, vehicles=None):
+        """Invalidates the cached attributes of the solution.
+
+        Args
+        ----
+            vehicles (Iterable[int] | None): Vehicles whose route, packages or courier
+                have changed. Only the parts of the cache depending on them are
+                recomputed on the next access. If None, the whole cache is dropped.
+        """
+        if vehicles is not None:
+            self._dirty.update(int(j) for j in vehicles)
+            return
+
         self._t_i = None
         self._v_k = None
         self._d_j = None
         self._l_vj = None
         self._m_jv = None
 
-    def __hash__(self):
-        x_hashable = tuple(self.x_jv.flatten().tolist())
-        y_hashable = tuple(self.y_k.tolist())
-        z_hashable = tuple(self.z_j.tolist())
+        self._dirty.clear()
+        self._t_src = None
+        self._stored = None
+        self._col = None
 
-        return hash((x_hashable, y_hashable, z_hashable))
+        self._fingerprint = None
+
+    def copy(self):
+        solution = type(self)(
+            self.problem, self.x_jv.copy(), self.y_k.copy(), self.z_j.copy()
+        )
+        solution._fingerprint = self._fingerprint
+        solution.route_cache = self.route_cache
+        return solution
+
+    @property
+    def nbytes(self):
+        arrays = (
+            self.x_jv,
+            self.y_k,
+            self.z_j,
+            self._t_i,
+            self._v_k,
+            self._d_j,
+            self._l_vj,
+            self._m_jv,
+            self._t_src,
+            self._stored,
+            self._col,
+        )
+        return (
+            sys.getsizeof(self)
+            + sys.getsizeof(self._dirty)
+            + sum(a.nbytes for a in arrays if a is not None)
+        )
+
+    def __hash__(self):
+        return int(self.fingerprint)
 
     def __eq__(self, value):
         if not isinstance(value, Solution):
             return False
 
+        # the arrays are only compared when the fingerprints collide
+        if self.fingerprint != value.fingerprint:
+            return False
+
         return (
-            np.all(self.x_jv == value.x_jv)
+            np.all(self.get_x_jv() == value.get_x_jv())
             and np.all(self.y_k == value.y_k)
             and np.all(self.z_j == value.z_j)
         )
 
     def __repr__(self):
         rows = []
+        l_vj = self.get_l_vj()
+        m_jv = self.get_m_jv()
 
         for j, i in enumerate(self.z_j):
             if i == -1:
@@ -100,15 +248,15 @@ class Solution:
 
             rows.append("  ->  ".join([f"{v:5}" for v in route]))
 
-            time = [0] + [self.get_l_vj()[v, j] for v in route[1:]]
-            capacity = [self.get_m_jv()[j, v] for v in route[:-1]] + [0]
+            time = [0] + [l_vj[v, j] for v in route[1:]]
+            capacity = [m_jv[j, v] for v in route[:-1]] + [0]
 
             time = [f"{t:5.2f}" for t in time]
             capacity = [f"{c:5.2f}" for c in capacity]
 
             route_pairs = [p for p in zip(route, route[1:])]
 
-            dist = [0] + [self.problem.graph.dist[u, v] for u, v in route_pairs]
+            dist = [0] + [self.problem.g_uv[u, v] for u, v in route_pairs]
             dist = list(accumulate(dist))
             dist = [f"{d:5.2f}" for d in dist]
 
@@ -120,6 +268,13 @@ class Solution:
 
         return "\n".join(rows)
 
+    def __reduce__(self):
+        # the problem is not embedded, it is looked up again when unpickling
+        return (
+            _restore_solution,
+            (type(self), self.problem.fingerprint, self.x_jv, self.y_k, self.z_j),
+        )
+
     def get_route(self, j, leading_warehouse=False, trailing_warehouse=False):
         """Returns the route of vehicle *j*.
 
@@ -133,7 +288,10 @@ class Solution:
             np.ndarray: Route of vehicle *j*.
         """
         warehouse = self.problem.graph.warehouse
-        route = self.x_jv[j][self.x_jv[j] != warehouse]
+        if isinstance(self.x_jv, Routes):
+            route = self.x_jv.route(j).copy()
+        else:
+            route = self.x_jv[j][self.x_jv[j] != warehouse]
 
         if leading_warehouse:
             route = np.insert(route, 0, warehouse)
@@ -143,118 +301,549 @@ class Solution:
 
         return route
 
+    def set_route(self, j, route):
+        """Replaces the route of vehicle *j*.
+
+        Args
+        ----
+            j (int): Vehicle index.
+            route (np.ndarray): Nodes visited by vehicle *j*, without the warehouse.
+        """
+        if self._fingerprint is not None or self._undo_log is not None:
+            old = self.get_route(j)
+            if self._undo_log is not None:
+                self._undo_log.append(("set_route", j, old))
+
+        if self._fingerprint is not None:
+            self._fingerprint ^= _zobrist(_ROUTE, j, np.arange(old.size), old)
+            self._fingerprint ^= _zobrist(_ROUTE, j, np.arange(len(route)), route)
+
+        if isinstance(self.x_jv, Routes):
+            self.x_jv.set_route(j, route)
+            return
+
+        self.x_jv[j] = self.problem.graph.warehouse
+        self.x_jv[j, 1 : len(route) + 1] = route
+
+    def set_y_k(self, k, j):
+        """Assigns package(s) *k* to vehicle(s) *j*.
+
+        Args
+        ----
+            k (int | np.ndarray): Package index or distinct package indices.
+            j (int | np.ndarray): Vehicle index, or one per package.
+        """
+        if self._undo_log is not None:
+            self._undo_log.append(("set_y_k", k, self.y_k[k]))
+
+        if self._fingerprint is not None:
+            self._fingerprint ^= _zobrist(_PACKAGE, k, self.y_k[k] + 1)
+            self._fingerprint ^= _zobrist(_PACKAGE, k, np.asarray(j) + 1)
+
+        self.y_k[k] = j
+
+    def set_z_j(self, j, i):
+        """Assigns vehicle(s) *j* to courier(s) *i*, -1 for no courier.
+
+        Args
+        ----
+            j (int | np.ndarray): Vehicle index or distinct vehicle indices.
+            i (int | np.ndarray): Courier index, or one per vehicle.
+        """
+        if self._undo_log is not None:
+            self._undo_log.append(("set_z_j", j, self.z_j[j]))
+
+        if self._fingerprint is not None:
+            self._fingerprint ^= _zobrist(_COURIER, j, self.z_j[j] + 1)
+            self._fingerprint ^= _zobrist(_COURIER, j, np.asarray(i) + 1)
+
+        self.z_j[j] = i
+
+    def begin(self):
+        """Starts a transaction: the writes made through set_route, set_y_k and set_z_j
+        are recorded, cell by cell, until commit() or rollback().
+        """
+        self._undo_log = []
+
+    def commit(self):
+        """Ends the transaction and keeps its writes."""
+        self._undo_log = None
+
+    def rollback(self):
+        """Ends the transaction and undoes its writes in reverse order, in O(writes).
+        The vehicles depending on the restored cells are re-evaluated on the next access.
+        """
+        log, self._undo_log = self._undo_log, None
+        vehicles = set()
+
+        for setter, index, old in reversed(log or []):
+            if setter == "set_y_k":
+                vehicles.update(np.atleast_1d(self.y_k[index]).tolist())
+                vehicles.update(np.atleast_1d(old).tolist())
+            else:
+                vehicles.update(np.atleast_1d(index).tolist())
+
+            getattr(self, setter)(index, old)
+
+        vehicles.discard(-1)
+        self.recalculate(vehicles)
+
+    def changes(self):
+        """Returns the vehicles, packages and couriers changed by the writes made since
+        begin(), i.e. those whose constraints have to be checked again.
+        """
+        vehicles, packages, couriers = set(), set(), set()
+
+        for setter, index, old in self._undo_log or []:
+            if setter == "set_route":
+                vehicles.add(int(index))
+            elif setter == "set_y_k":
+                packages.update(np.atleast_1d(index).tolist())
+                vehicles.update(np.atleast_1d(old).tolist())
+                vehicles.update(np.atleast_1d(self.y_k[index]).tolist())
+            else:
+                vehicles.update(np.atleast_1d(index).tolist())
+                couriers.update(np.atleast_1d(old).tolist())
+                couriers.update(np.atleast_1d(self.z_j[index]).tolist())
+
+        vehicles.discard(-1)
+        couriers.discard(-1)
+        return ChangeScope(
+            *(
+                np.array(sorted(ids), dtype=int)
+                for ids in (vehicles, packages, couriers)
+            )
+        )
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = self._calc_fingerprint()
+        return self._fingerprint
+
+    def _calc_fingerprint(self):
+        x_jv = self.x_jv
+        if isinstance(x_jv, Routes):
+            lengths = x_jv.lengths
+            stops = x_jv.stops
+            js = np.repeat(np.arange(x_jv.n_vehicles), lengths)
+            positions = np.arange(stops.size) - np.repeat(x_jv.offsets[:-1], lengths)
+        else:
+            visited = x_jv != self.problem.graph.warehouse
+            stops = x_jv[visited]
+            js = np.nonzero(visited)[0]
+            positions = (np.cumsum(visited, axis=1) - 1)[visited]
+
+        return (
+            _zobrist(_ROUTE, js, positions, stops)
+            ^ _zobrist(_PACKAGE, np.arange(self.y_k.size), self.y_k + 1)
+            ^ _zobrist(_COURIER, np.arange(self.z_j.size), self.z_j + 1)
+        )
+
+    def get_x_jv(self):
+        """Returns the dense *x*<sub>j,v</sub> matrix, decoding the Routes encoding
+        if needed. Changes to the decoded matrix are not reflected in the solution.
+        """
+        if isinstance(self.x_jv, Routes):
+            return self.x_jv.to_dense(self.problem.n_nodes + 1)
+        return self.x_jv
+
+    def _padded_routes(self, js):
+        """Returns the routes of vehicles *js* as rows starting at the warehouse and
+        padded with it.
+        """
+        if isinstance(self.x_jv, Routes):
+            return self.x_jv.padded(js)
+        return self.x_jv[js]
+
+    def _route_edges(self, js):
+        """Returns the edges travelled by vehicles *js* as two (len(*js*), *n*) matrices
+        of start and end nodes, along with a mask of the edges driven before the vehicle
+        first returns to the warehouse.
+        """
+        return route_edges(self._padded_routes(js), self.problem.graph.warehouse)
+
+    def _route_keys(self, js):
+        """Returns the route cache keys of vehicles *js*: the vehicle, the nodes it drives
+        through up to its return to the warehouse and the set of packages assigned to it.
+        """
+        warehouse = self.problem.graph.warehouse
+        y_k = self.y_k
+        assigned = (y_k >= 0) & (y_k < self.problem.n_vehicles)
+
+        # packages grouped by vehicle, in increasing order within each vehicle
+        packages = np.argsort(np.where(assigned, y_k, -1), kind="stable")
+        packages = packages[packages.size - np.count_nonzero(assigned) :]
+        packages = packages.astype(np.int32)
+        ptr = np.zeros(self.problem.n_vehicles + 1, dtype=int)
+        np.cumsum(np.bincount(y_k[assigned], minlength=ptr.size - 1), out=ptr[1:])
+
+        keys = []
+        for j in js:
+            # trimmed the same way for both encodings, so that they give the same keys
+            if isinstance(self.x_jv, Routes):
+                route = self.x_jv.route(j)
+                returned = np.flatnonzero(route == warehouse)
+                route = route[: returned[0]] if returned.size else route
+                stops = np.concatenate(([warehouse], route, [warehouse]))
+            else:
+                row = self.x_jv[j]
+                returned = np.flatnonzero(row[1:] == warehouse)
+                stops = row[: returned[0] + 2] if returned.size else row
+
+            keys.append(
+                (
+                    int(j),
+                    stops.astype(np.int32).tobytes(),
+                    packages[ptr[j] : ptr[j + 1]].tobytes(),
+                )
+            )
+        return keys
+
+    def _load_cached(self, js, field):
+        """Fills a field of the cached attributes from the route cache for vehicles *js*,
+        expanding the values kept per stop to the nodes they were reached at.
+
+        Returns
+        -------
+            tuple[np.ndarray, list | None]: Vehicles missing from the route cache and
+                their keys, None if there is no route cache.
+        """
+        if self.route_cache is None or not js.size:
+            return js, None
+
+        warehouse = self.problem.graph.warehouse
+        keys = self._route_keys(js)
+        missed = []
+        for n, key in enumerate(keys):
+            value = self.route_cache.get(key, field)
+            if value is None:
+                missed.append(n)
+                continue
+
+            # nodes reached by the driven edges, the return to the warehouse included
+            v = np.frombuffer(key[1], dtype=np.int32)[1:]
+            if field == "l_v":
+                col = self._col[js[n]]
+                self._l_vj[:, col] = 0
+                self._l_vj[v, col] = value
+            elif field == "d":
+                self._d_j[js[n]] = value
+            else:
+                col = self._col[js[n]]
+                self._m_jv[col] = 0
+                self._m_jv[col, warehouse] = value[0]
+                self._m_jv[col, v[v != warehouse]] = value[1:]
+
+        return js[missed], [keys[n] for n in missed]
+
+    def _store_cached(self, keys, field, values):
+        """Adds a field of freshly computed vehicles to the route cache, one value per key."""
+        if keys is None:
+            return
+
+        for key, value in zip(keys, values):
+            self.route_cache.put(key, field, value)
+
+    def _stored_vehicles(self):
+        """Returns the vehicles that get a column in the cached *l*<sup>j</sup><sub>v</sub>
+        and *m*<sub>j,v</sub> matrices. The other vehicles read as zeros.
+        """
+        return np.arange(self.problem.n_vehicles)
+
+    def _layout(self):
+        """Keeps the columns of the cached matrices in line with the stored vehicles.
+
+        Returns
+        -------
+            np.ndarray: Vehicles that got a new column and have to be computed.
+        """
+        stored = self._stored_vehicles()
+        if self._stored is not None and np.array_equal(stored, self._stored):
+            return stored[:0]
+
+        col = np.full(self.problem.n_vehicles, stored.size)
+        col[stored] = np.arange(stored.size)
+
+        kept = stored[:0]
+        if self._stored is not None:
+            kept = np.intersect1d(stored, self._stored)
+
+            if self._l_vj is not None:
+                l_vj = np.zeros_like(
+                    self._l_vj, shape=(self._l_vj.shape[0], stored.size + 1)
+                )
+                l_vj[:, col[kept]] = self._l_vj[:, self._col[kept]]
+                self._l_vj = l_vj
+
+            if self._m_jv is not None:
+                m_jv = np.zeros_like(
+                    self._m_jv, shape=(stored.size + 1, self._m_jv.shape[1])
+                )
+                m_jv[col[kept]] = self._m_jv[self._col[kept]]
+                self._m_jv = m_jv
+
+        self._stored, self._col = stored, col
+        return np.setdiff1d(stored, kept)
+
+    def _expand(self, matrix, axis):
+        """Returns a cached matrix with one column (or row) for every vehicle."""
+        if self._stored.size == self.problem.n_vehicles:
+            return matrix[:, :-1] if axis else matrix[:-1]
+        return matrix[:, self._col] if axis else matrix[self._col]
+
+    def _refresh(self):
+        """Recomputes the parts of the cached attributes depending on dirty vehicles."""
+        if not self._dirty:
+            return
+
+        js = np.fromiter(self._dirty, dtype=int, count=len(self._dirty))
+        self._dirty.clear()
+
+        if self._stored is not None:
+            js = np.union1d(js, self._layout())
+            stored = js[self._col[js] < self._stored.size]
+
+            if self._l_vj is not None:
+                self._calc_l_vj(stored)
+            if self._m_jv is not None:
+                self._calc_m_jv(stored)
+
+        if self._d_j is not None:
+            self._calc_d_j(js)
+
+        if self._t_i is not None:
+            # couriers now driving or previously timed by one of the dirty vehicles
+            affected = np.concatenate(
+                (self.z_j[js], np.where(np.isin(self._t_src, js))[0])
+            )
+            self._calc_t_i(np.unique(affected[affected != -1]))
+
+        if self._v_k is not None:
+            self._calc_v_k(np.where(np.isin(self.y_k, js))[0])
+
     def get_t_i(self):
         """Calculates the *t*<sub>i</sub> matrix for the problem.
         *t*<sub>i</sub> maps the total working time of courier *i*.
         """
-        if self._t_i is not None:
-            return self._t_i
+        self._refresh()
+        if self._t_i is None:
+            self._t_i = np.zeros(self.problem.n_couriers)
+            self._t_src = np.full(self.problem.n_couriers, -1, self.z_j.dtype)
+            self._calc_t_i(np.arange(self.problem.n_couriers))
+
+        return self._t_i
 
+    def _calc_t_i(self, couriers):
         warehouse = self.problem.graph.warehouse
+        couriers = couriers[(couriers >= 0) & (couriers < self.problem.n_couriers)]
 
-        self._t_i = np.zeros(self.problem.n_couriers)
-        for i in range(self.problem.n_couriers):
-            # look for the vehicle assigned to the courier
-            j = np.where(self.z_j == i)[0]
-            if j.size:
-                j = j[0]
-                # get the total time covered by the vehicle assigned to the courier
-                self._t_i[i] = self.get_l_vj()[warehouse, j]
+        # the first vehicle assigned to each courier determines its working time
+        assigned = self.z_j == couriers[:, None]
+        found = assigned.any(axis=1)
+        j = np.where(found, assigned.argmax(axis=1), -1)
 
-        return self._t_i
+        l_vj = self._get_l_vj()
+        self._t_src[couriers] = j
+        self._t_i[couriers] = np.where(found, l_vj[warehouse, self._col[j]], 0)
 
     def get_l_vj(self):
         """Calculates the *l*<sup>j</sup><sub>v</sub> matrix for the problem.
         *l*<sup>j</sup><sub>v</sub> maps the time taken by vehicle *j* to travel to node *v*.
         """
-        if self._l_vj is not None:
-            return self._l_vj
-
-        n_nodes = self.problem.graph.n_nodes
+        return self._expand(self._get_l_vj(), axis=1)
 
-        self._l_vj = np.zeros((n_nodes, self.problem.n_vehicles))
-        for j in range(self.problem.n_vehicles):
-            # iterate over the route of vehicle j
-            for u, v in zip(self.x_jv[j], self.x_jv[j, 1:]):
-                # add the time taken to travel from u to v
-                self._l_vj[v, j] = self._l_vj[u, j] + self.problem.s_uv[u, v]
-                if v == self.problem.graph.warehouse:
-                    break
+    def _get_l_vj(self):
+        self._refresh()
+        if self._l_vj is None:
+            if self._stored is None:
+                self._layout()
+            n_nodes = self.problem.graph.n_nodes
+            self._l_vj = np.zeros((n_nodes, self._stored.size + 1))
+            self._calc_l_vj(self._stored)
 
         return self._l_vj
 
+    def _calc_l_vj(self, js):
+        js, keys = self._load_cached(js, "l_v")
+        if not js.size:
+            return
+
+        u, v, mask = self._route_edges(js)
+
+        # arrival times are the running sums of the travel times along each route
+        l_v = np.cumsum(np.where(mask, self.problem.s_uv[u, v], 0), axis=1)
+        col = np.broadcast_to(self._col[js][:, None], v.shape)
+
+        self._l_vj[:, col[:, 0]] = 0
+        self._l_vj[v[mask], col[mask]] = l_v[mask]
+
+        if keys is not None:
+            self._store_cached(keys, "l_v", (t[m] for t, m in zip(l_v, mask)))
+
     def get_v_k(self):
         """Calculates the *v*<sub>k</sub> matrix for the problem.
         *v*<sub>k</sub> maps the time taken to deliver/pick-up package *k*.
         """
-        if self._v_k is not None:
-            return self._v_k
-
-        self._v_k = np.zeros(self.problem.n_packages)
-        for k, p in enumerate(self.problem.packages):
-            # look for the vehicle assigned to the package
-            for j in range(self.problem.n_vehicles):
-                if self.y_k[k] == j:
-                    self._v_k[k] += self.get_l_vj()[p.address, j]
+        self._refresh()
+        if self._v_k is None:
+            self._v_k = np.zeros(self.problem.n_packages)
+            self._calc_v_k(np.arange(self.problem.n_packages))
 
         return self._v_k
 
+    def _calc_v_k(self, ks):
+        y_k = self.y_k[ks]
+        assigned = (y_k >= 0) & (y_k < self.problem.n_vehicles)
+
+        l_vj = self._get_l_vj()
+        self._v_k[ks] = 0
+        self._v_k[ks[assigned]] = l_vj[
+            self.problem.h_k[ks[assigned]], self._col[y_k[assigned]]
+        ]
+
     def get_d_j(self):
         """Calculates the *d*<sub>j</sub> matrix for the problem.
         *d*<sub>j</sub> maps the total distance covered by vehicle *j*.
         """
-        if self._d_j is not None:
-            return self._d_j
-
-        self._d_j = np.zeros(self.problem.n_vehicles)
-        for j in range(self.problem.n_vehicles):
-            # iterate over the route of vehicle j
-            for u, v in zip(self.x_jv[j], self.x_jv[j, 1:]):
-                # add the distance of the route to the total distance of vehicle j
-                self._d_j[j] += self.problem.g_uv[u, v]
-                if v == self.problem.graph.warehouse:
-                    break
+        self._refresh()
+        if self._d_j is None:
+            self._d_j = np.zeros(self.problem.n_vehicles)
+            self._calc_d_j(np.arange(self.problem.n_vehicles))
 
         return self._d_j
 
+    def _calc_d_j(self, js):
+        js, keys = self._load_cached(js, "d")
+        if not js.size:
+            return
+
+        u, v, mask = self._route_edges(js)
+
+        # accumulate (rather than sum) to add the distances up in route order
+        g = np.where(mask, self.problem.g_uv[u, v], 0)
+        self._d_j[js] = np.cumsum(g, axis=1)[:, -1]
+
+        self._store_cached(keys, "d", self._d_j[js])
+
     def get_m_jv(self):
         """Calculates the *m*<sub>j,v</sub> matrix for the problem.
         *m*<sub>j,v</sub> maps the total weight of packages assigned to vehicle *j* at node *v*.
         """
-        if self._m_jv is not None:
-            return self._m_jv
-
-        self._m_jv = np.zeros((self.problem.n_vehicles, self.problem.graph.n_nodes))
-        for j in range(self.problem.n_vehicles):
-            s = 0
-            # Load the vehicle with the weight of the packages assigned to it
-            for k, p in enumerate(self.problem.packages):
-                if p.type == "delivery" and self.y_k[k] == j:
-                    s += p.weight
-
-            self._m_jv[j, self.problem.graph.warehouse] = s
-
-            for v, next_v in zip(self.x_jv[j], self.x_jv[j, 1:]):
-                if next_v == self.problem.graph.warehouse:
-                    break
-
-                # Remove the weight of the packages that are delivered at the next node
-                delivery = 0
-                for k, p in enumerate(self.problem.packages):
-                    if (
-                        p.type == "delivery"
-                        and p.address == next_v
-                        and self.y_k[k] == j
-                    ):
-                        delivery += p.weight
-
-                # Add the weight of the packages that are picked up at the next node
-                pickup = 0
-                for k, p in enumerate(self.problem.packages):
-                    if p.type == "pickup" and p.address == next_v and self.y_k[k] == j:
-                        pickup += p.weight
-
-                # Update the weight of the packages in the vehicle at the next node
-                self._m_jv[j, next_v] = self._m_jv[j, v] - delivery + pickup
+        return self._expand(self._get_m_jv(), axis=0)
+
+    def _get_m_jv(self):
+        self._refresh()
+        if self._m_jv is None:
+            if self._stored is None:
+                self._layout()
+            n_nodes = self.problem.graph.n_nodes
+            self._m_jv = np.zeros((self._stored.size + 1, n_nodes))
+            self._calc_m_jv(self._stored)
 
         return self._m_jv
+
+    def _calc_m_jv(self, js):
+        js, keys = self._load_cached(js, "m_v")
+        if not js.size:
+            return
+
+        problem = self.problem
+        warehouse = problem.graph.warehouse
+
+        _, v, mask = self._route_edges(js)
+
+        # Visits of every vehicle to the package nodes of its route
+        row, o = np.nonzero(mask & (v != warehouse))
+        nodes = v[row, o]
+        j = js[row]
+
+        # Expand each visit into the packages addressed to the visited node
+        start = problem.node_ptr[nodes]
+        counts = problem.node_ptr[nodes + 1] - start
+        visit = np.repeat(np.arange(nodes.size), counts)
+        entry = np.repeat(start - (np.cumsum(counts) - counts), counts) + np.arange(
+            counts.sum()
+        )
+
+        # Keep only the packages carried by the visiting vehicle
+        carried = self.y_k[problem.node_packages[entry]] == j[visit]
+        visit, entry = visit[carried], entry[carried]
+
+        delivery = np.bincount(
+            visit, weights=problem.node_delivery[entry], minlength=nodes.size
+        )
+        pickup = np.bincount(
+            visit, weights=problem.node_pickup[entry], minlength=nodes.size
+        )
+
+        # Load the vehicle with the weight of the packages assigned to it
+        assigned = (self.y_k >= 0) & (self.y_k < problem.n_vehicles)
+        load = np.bincount(
+            self.y_k[assigned],
+            weights=np.where(problem.is_pickup, 0.0, problem.w_k)[assigned],
+            minlength=problem.n_vehicles,
+        )[js]
+
+        # Interleave the deliveries and pickups of every visit so that the running sum
+        # removes and adds the weights in the same order as the vehicle does
+        change = np.zeros((js.size, 2 * v.shape[1] + 1))
+        change[:, 0] = load
+        change[row, 2 * o + 1] = -delivery
+        change[row, 2 * o + 2] = pickup
+        change = np.cumsum(change, axis=1)
+
+        col = self._col[js]
+        self._m_jv[col] = 0
+        self._m_jv[col, warehouse] = load
+        self._m_jv[col[row], nodes] = change[row, 2 * o + 2]
+
+        if keys is not None:
+            # load leaving the warehouse, then leaving every stop in route order
+            m_o = np.split(
+                change[row, 2 * o + 2],
+                np.cumsum(np.bincount(row, minlength=js.size))[:-1],
+            )
+            self._store_cached(
+                keys,
+                "m_v",
+                (np.concatenate(([m], m_v)) for m, m_v in zip(load, m_o)),
+            )
+
+
+class CompactSolution(Solution):
+    """Solution variant with a small memory footprint, meant for large populations.
+    The assignment arrays use the narrowest index dtype of the problem and the cached
+    *l*<sup>j</sup><sub>v</sub> and *m*<sub>j,v</sub> matrices only keep the columns of
+    the used vehicles, so get_l_vj() and get_m_jv() build the full matrices on demand.
+    """
+
+    __slots__ = ()
+
+    def __init__(
+        self,
+        problem: Problem,
+        x_jv: np.ndarray,
+        y_k: np.ndarray,
+        z_j: np.ndarray,
+    ):
+        dtype = problem.index_dtype
+        super().__init__(
+            problem,
+            x_jv.astype(dtype, copy=False),
+            y_k.astype(dtype, copy=False),
+            z_j.astype(dtype, copy=False),
+        )
+
+    def _stored_vehicles(self):
+        """Returns the vehicles that leave the warehouse or carry packages."""
+        n_vehicles = self.problem.n_vehicles
+
+        if isinstance(self.x_jv, Routes):
+            used = self.x_jv.lengths > 0
+        else:
+            used = self.x_jv[:, 1] != self.problem.graph.warehouse
+        y_k = self.y_k[(self.y_k >= 0) & (self.y_k < n_vehicles)]
+        used[y_k] = True
+
+        return np.where(used)[0]
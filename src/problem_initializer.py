@@ -2,7 +2,7 @@ import json
 
 import numpy as np
 
-from model import Graph
+from model import EuclideanGraph, Graph
 from model.input import Courier, Package, Vehicle
 from model.problem import Problem
 
@@ -25,6 +25,7 @@ class ProblemInitializer:
         n_couriers (int): Number of couriers.
         n_vehicles (int): Number of vehicles.
         n_packages (int): Number of packages.
+        implicit_graph (bool): Whether to generate an EuclideanGraph, with one time factor per node, rather than storing every route. Defaults to False.
 
     Methods
     -------
@@ -58,6 +59,7 @@ class ProblemInitializer:
         time_dist_coeff=0.5,
         permission_proba=1,
         pickup_delivery_proba=0.5,
+        implicit_graph=False,
     ):
         self.n_couriers = n_couriers
         self.n_vehicles = n_vehicles
@@ -73,6 +75,7 @@ class ProblemInitializer:
         self.time_dist_coeff = time_dist_coeff
         self.permission_proba = permission_proba
         self.pickup_delivery_proba = pickup_delivery_proba
+        self.implicit_graph = implicit_graph
 
         self.couriers = []
         self.vehicles = []
@@ -187,13 +190,15 @@ class ProblemInitializer:
         """
         points = np.random.uniform(0, self.graph_max_coord, (n_nodes, 2))
 
-        routes = []
+        if self.implicit_graph:
+            time_factor = 1 - self.time_dist_coeff + np.random.rand(n_nodes)
+            return EuclideanGraph(points, time_factor)
 
-        for i, (x, y) in enumerate(points):
-            for j, (a, b) in enumerate(points[i + 1 :], start=i + 1):
-                dist = np.round(np.sqrt((a - x) ** 2 + (b - y) ** 2), 2)
-                time = np.round(dist * (1 - self.time_dist_coeff + np.random.rand()), 2)
+        # pairs in row-major order, drawing the time factors in the same order as
+        # one call per pair would
+        i, j = np.triu_indices(n_nodes, k=1)
+        (x, y), (a, b) = points[i].T, points[j].T
+        dist = np.round(np.sqrt((a - x) ** 2 + (b - y) ** 2), 2)
+        time = np.round(dist * (1 - self.time_dist_coeff + np.random.rand(i.size)), 2)
 
-                routes.append((i, j, dist, time))
-
-        return Graph(routes, points)
+        return Graph(np.column_stack((i, j, dist, time)), points)
@@ -1,26 +1,102 @@
+import time
+
 import numpy as np
 
+from model.population import PopulationBatch
 from model.problem import Problem
-from model.solution import Solution
+from model.routes import Routes
+from model.solution import ChangeScope, Solution
 
 
 class SolutionChecker:
     """Class to check the feasibility of a solution for the problem.
+    The checks are collected once, when the checker is created, and run in the order
+    of the constraints. In adaptive mode they are reordered every reorder_every calls
+    by the time they take per rejected solution, so that infeasible solutions are
+    rejected as cheaply as possible. Full, scoped and batch runs are timed and ordered
+    separately, and the counters behind the order are halved at every reordering so
+    that it follows what the checks reject lately. Every check also has a batch
+    version, which evaluates its constraint for a whole stack of candidates at once,
+    and a scoped version, which only re-validates the vehicles, packages and couriers
+    changed since the solution was last known to be feasible.
+
+    Besides the yes/no verdict, the checker measures by how much a solution violates
+    every soft constraint, for penalty-based searches that move through slightly
+    infeasible solutions. The structural constraints, one vehicle per courier and
+    well-formed routes, are never relaxed.
 
     Args
     ----
         problem (Problem): The problem to check solutions for.
+        adaptive (bool): Whether to reorder the checks by their measured cost per rejection. Defaults to False.
+        reorder_every (int): Number of solutions checked between two reorderings in adaptive mode. Defaults to 100.
+
+    Attributes
+    ----------
+        checks (list[tuple[str, callable]]): Name and bound method of every check, in the order they run.
+        batch_checks (dict[str, callable]): Bound batch version of every check, by name.
+        scoped_checks (dict[str, callable]): Bound scoped version of every check, by name.
+        structural_checks (tuple[str]): Checks kept in relaxed mode, without which the costs of a solution are meaningless.
+        violation_names (tuple[str]): Soft constraints measured by violations(), in order.
 
     Methods
     -------
-        is_feasible(solution: Solution, debug: bool = False) -> bool: Check if the given solution is feasible for the problem.
+        is_feasible(solution: Solution, debug: bool = False, scope: ChangeScope | None = None, relaxed: bool = False) -> bool: Check if the given solution is feasible for the problem.
+        is_feasible_batch(x_pjv, y_pk, z_pj, relaxed=False) -> np.ndarray: Check which of a stack of candidate solutions are feasible.
+        violations(solution: Solution) -> dict[str, float]: Measure by how much a solution violates every soft constraint.
+        violations_batch(x_pjv, y_pk, z_pj) -> dict[str, np.ndarray]: Measure the violations of a stack of candidate solutions.
+        stats(mode: str = "full") -> dict[str, dict]: Returns the number of calls and rejections of every check and the time spent in it, in full, scoped or batch runs.
+        reset_stats(): Resets the statistics of the checks.
     """
 
-    def __init__(self, problem: Problem):
+    structural_checks = ("check_1", "check_9")
+    modes = ("full", "scoped", "batch")
+    violation_names = (
+        "work_limit",
+        "time_windows",
+        "capacity",
+        "missing_packages",
+        "permissions",
+    )
+
+    def __init__(self, problem: Problem, adaptive=False, reorder_every=100):
         self.problem = problem
         self.solution: Solution | None = None
+        self.adaptive = adaptive
+        self.reorder_every = reorder_every
+
+        prefix = f"_{SolutionChecker.__name__}__check_"
+        names = sorted(
+            (key for key in dir(SolutionChecker) if key.startswith(prefix)),
+            key=lambda key: int(key.removeprefix(prefix)),
+        )
+        self.checks = [
+            (name.removeprefix(f"_{SolutionChecker.__name__}__"), getattr(self, name))
+            for name in names
+        ]
+        self.batch_checks = {
+            name: getattr(self, f"_{SolutionChecker.__name__}__batch_{name}")
+            for name, _ in self.checks
+        }
+        self.scoped_checks = {
+            name: getattr(self, f"_{SolutionChecker.__name__}__scoped_{name}")
+            for name, _ in self.checks
+        }
+        # name and method of every check in the order they run in each mode
+        self._orders = {
+            "full": self.checks,
+            "scoped": list(self.scoped_checks.items()),
+            "batch": list(self.batch_checks.items()),
+        }
+        self.reset_stats()
 
-    def is_feasible(self, solution: Solution, debug=False):
+    def is_feasible(
+        self,
+        solution: Solution,
+        debug=False,
+        scope: ChangeScope | None = None,
+        relaxed=False,
+    ):
         """Check if the given solution is feasible for the problem. It uses subsequent checks
         to verify the solution's validity. The checks are based on the problem's constraints.
 
@@ -28,6 +104,12 @@ class SolutionChecker:
         ----
             solution (Solution): The solution to check.
             debug (bool): If True, print debug information.
+            scope (ChangeScope | None): Parts of the solution changed since it was last
+                feasible, e.g. by a mutation. Only the constraints depending on them are
+                checked, which gives the same result as checking the whole solution as
+                long as it was feasible before the change. None checks everything.
+            relaxed (bool): If True, only the structural constraints are checked, the
+                others being left to violations().
 
         Returns
         -------
@@ -35,13 +117,18 @@ class SolutionChecker:
         """
         self.solution = solution
 
-        func_names = sorted(
-            [key for key in dir(self) if "_SolutionChecker__check" in key]
-        )
-        funcs = [getattr(self, key) for key in func_names]
+        mode = "full" if scope is None else "scoped"
+        self._count_runs(mode, 1)
+
+        for name, check in self._orders[mode]:
+            if relaxed and name not in self.structural_checks:
+                continue
+
+            start = time.perf_counter()
+            feasible = check() if scope is None else check(scope)
+            self._record(mode, name, 1, int(not feasible), time.perf_counter() - start)
 
-        for func, name in zip(funcs, func_names):
-            if not func():
+            if not feasible:
                 if debug:
                     print(f"\nerror in {name}")
                 return False
@@ -49,72 +136,380 @@ class SolutionChecker:
         self.solution = None
         return True
 
+    def is_feasible_batch(
+        self, x_pjv: np.ndarray, y_pk: np.ndarray, z_pj: np.ndarray, relaxed=False
+    ):
+        """Check which of a stack of candidate solutions are feasible for the problem. The
+        checks run in the same order as in is_feasible(), each one over the candidates
+        that passed the previous ones, and give the same verdicts.
+
+        Args
+        ----
+            x_pjv (np.ndarray): (*P*, *m*, *L*) routes of the candidates, rows starting at the warehouse and padded with it.
+            y_pk (np.ndarray): (*P*, *K*) vehicle assigned to package *k* in every candidate.
+            z_pj (np.ndarray): (*P*, *m*) courier assigned to vehicle *j* in every candidate.
+            relaxed (bool): If True, only the structural constraints are checked.
+
+        Returns
+        -------
+            np.ndarray: (*P*,) mask of the feasible candidates.
+        """
+        batch = PopulationBatch(self.problem, x_pjv, y_pk, z_pj)
+        alive = np.arange(len(batch))
+
+        self._count_runs("batch", len(batch))
+
+        for name, check in self._orders["batch"]:
+            if not alive.size:
+                break
+            if relaxed and name not in self.structural_checks:
+                continue
+
+            start = time.perf_counter()
+            feasible = check(batch)
+            self._record(
+                "batch",
+                name,
+                alive.size,
+                alive.size - np.count_nonzero(feasible),
+                time.perf_counter() - start,
+            )
+
+            if not feasible.all():
+                alive = alive[feasible]
+                batch = batch.take(feasible)
+
+        mask = np.zeros(x_pjv.shape[0], dtype=bool)
+        mask[alive] = True
+        return mask
+
+    def violations(self, solution: Solution):
+        """Measure by how much a solution violates every soft constraint.
+
+        Args
+        ----
+            solution (Solution): The solution to measure.
+
+        Returns
+        -------
+            dict[str, float]: Violation of every constraint of violation_names, 0 if it is satisfied.
+        """
+        batch = PopulationBatch.from_solutions(self.problem, [solution])
+        violations = self.violations_batch(batch.x_pjv, batch.y_pk, batch.z_pj)
+        return {name: float(amounts[0]) for name, amounts in violations.items()}
+
+    def violations_batch(self, x_pjv: np.ndarray, y_pk: np.ndarray, z_pj: np.ndarray):
+        """Measure by how much every candidate of a stack violates the soft constraints:
+        - work_limit: time worked past their limit, summed over the couriers,
+        - time_windows: time by which the delivered packages miss their window,
+        - capacity: peak weight over capacity, summed over the vehicles,
+        - missing_packages: number of packages not delivered to their address,
+        - permissions: number of vehicles driven by a courier without permission.
+        The structural constraints are assumed to hold.
+
+        Args
+        ----
+            x_pjv (np.ndarray): (*P*, *m*, *L*) routes of the candidates, rows starting at the warehouse and padded with it.
+            y_pk (np.ndarray): (*P*, *K*) vehicle assigned to package *k* in every candidate.
+            z_pj (np.ndarray): (*P*, *m*) courier assigned to vehicle *j* in every candidate.
+
+        Returns
+        -------
+            dict[str, np.ndarray]: (*P*,) violations of every constraint of violation_names.
+        """
+        problem = self.problem
+        batch = PopulationBatch(problem, x_pjv, y_pk, z_pj)
+
+        delivered = self._delivered_pk(batch)
+
+        v_pk = batch.get_v_pk()
+        outside = np.maximum(problem.a_k - v_pk, 0) + np.maximum(v_pk - problem.b_k, 0)
+
+        m_pjo = batch.get_m_pjo()
+        overload = np.maximum(m_pjo - problem.q_j[:, None], 0).max(axis=2, initial=0)
+
+        j = np.arange(z_pj.shape[1])
+        forbidden = (z_pj != -1) & ~problem.r_ij[z_pj, j]
+
+        return {
+            "work_limit": np.maximum(batch.get_t_pi() - problem.b_i, 0).sum(axis=1),
+            "time_windows": np.where(delivered, outside, 0).sum(axis=1),
+            "capacity": overload.sum(axis=1),
+            "missing_packages": (~delivered).sum(axis=1),
+            "permissions": forbidden.sum(axis=1),
+        }
+
+    def _count_runs(self, mode, runs):
+        """Counts the solutions checked in a mode, reordering its checks in adaptive
+        mode whenever another reorder_every of them have been checked.
+        """
+        before, self._runs[mode] = self._runs[mode], self._runs[mode] + runs
+        if (
+            self.adaptive
+            and self._runs[mode] // self.reorder_every > before // self.reorder_every
+        ):
+            self._reorder(mode)
+
+    def _record(self, mode, name, calls, rejections, seconds):
+        for counters in (self._stats[mode][name], self._recent[mode][name]):
+            counters[0] += calls
+            counters[1] += rejections
+            counters[2] += seconds
+
+    def _reorder(self, mode):
+        """Sorts the checks of a mode by the time they took lately per solution they
+        rejected, those that did not reject any last, then halves the counters so that
+        a check rejecting fewer solutions once moved later can still move forward.
+        """
+        recent = self._recent[mode]
+
+        def cost_per_rejection(check):
+            _, rejections, seconds = recent[check[0]]
+            return seconds / rejections if rejections else np.inf
+
+        self._orders[mode].sort(key=cost_per_rejection)
+
+        for counters in recent.values():
+            counters[:] = [counter / 2 for counter in counters]
+
+    def stats(self, mode="full"):
+        return {
+            name: {
+                "calls": calls,
+                "rejections": rejections,
+                "seconds": seconds,
+                "rejection_rate": rejections / calls if calls else 0.0,
+                "cost_per_rejection": seconds / rejections if rejections else np.inf,
+            }
+            for name, (calls, rejections, seconds) in self._stats[mode].items()
+        }
+
+    def reset_stats(self):
+        self._runs = dict.fromkeys(self.modes, 0)
+        # calls, rejections and seconds spent of every check in every mode, in total
+        # and decayed at every reordering
+        self._stats = {
+            mode: {name: [0, 0, 0.0] for name, _ in self.checks} for mode in self.modes
+        }
+        self._recent = {
+            mode: {name: [0.0, 0.0, 0.0] for name, _ in self.checks}
+            for mode in self.modes
+        }
+
+    def _scope_packages(self, scope: ChangeScope):
+        """Packages reassigned or carried by one of the changed vehicles, possibly with
+        repetitions.
+        """
+        y_k = self.solution.y_k
+
+        # a mutation changes a handful of vehicles, one pass over y_k per vehicle beats
+        # a broadcast comparison
+        carried = np.zeros(y_k.size, dtype=bool)
+        for j in scope.vehicles:
+            carried |= y_k == j
+        return np.concatenate((scope.packages, np.flatnonzero(carried)))
+
+    def _scope_couriers(self, scope: ChangeScope):
+        """Couriers reassigned or driving one of the changed vehicles, possibly with
+        repetitions.
+        """
+        couriers = np.concatenate((scope.couriers, self.solution.z_j[scope.vehicles]))
+        return couriers[couriers != -1]
+
     def __check_1(self):
-        """ """
-        non_empty = self.solution.z_j != -1
-        return np.unique(self.solution.z_j[non_empty]).size == non_empty.sum()
+        """
+        Check if each courier is assigned to at most one vehicle.
+        """
+        z_j = self.solution.z_j
+        return np.all(np.bincount(z_j[z_j != -1]) <= 1)
+
+    def __batch_check_1(self, batch: PopulationBatch):
+        p, j = np.nonzero(batch.z_pj != -1)
+        z = batch.z_pj[p, j]
+        n = max(self.problem.n_couriers, z.max() + 1 if z.size else 0)
+
+        counts = np.bincount(p * n + z, minlength=len(batch) * n)
+        return np.all(counts.reshape(len(batch), n) <= 1, axis=1)
+
+    def __scoped_check_1(self, scope: ChangeScope):
+        if not scope.couriers.size:
+            return True
+
+        z_j = self.solution.z_j
+        return np.all((z_j[:, None] == scope.couriers).sum(axis=0) <= 1)
 
     def __check_4(self):
         """
         Check if each courier's work limit is respected.
         """
-        b_i = np.array([c.work_limit for c in self.problem.couriers])
-        return np.all(self.solution.get_t_i() <= b_i)
+        return np.all(self.solution.get_t_i() <= self.problem.b_i)
+
+    def __batch_check_4(self, batch: PopulationBatch):
+        return np.all(batch.get_t_pi() <= self.problem.b_i, axis=1)
+
+    def __scoped_check_4(self, scope: ChangeScope):
+        i = self._scope_couriers(scope)
+        return np.all(self.solution.get_t_i()[i] <= self.problem.b_i[i])
 
     def __check_5(self):
         """
         Check if each courier has a permission for the vehicle they are assigned to.
         """
-        r_j = np.zeros_like(self.solution.z_j)
+        z_j = self.solution.z_j
+        (j,) = np.nonzero(z_j != -1)
 
-        for courier, vehicle in self.problem.permissions:
-            r_j[vehicle] = courier
+        # vehicles without a courier need no permission
+        return np.all(self.problem.r_ij[z_j[j], j])
 
-        # may ride or not ride the vehicle the courier is assigned to
-        return np.all(self.solution.z_j <= r_j)
+    def __batch_check_5(self, batch: PopulationBatch):
+        z_pj = batch.z_pj
+        j = np.arange(z_pj.shape[1])
+        return np.all((z_pj == -1) | self.problem.r_ij[z_pj, j], axis=1)
+
+    def __scoped_check_5(self, scope: ChangeScope):
+        if not scope.couriers.size:
+            return True
+
+        j = scope.vehicles
+        i = self.solution.z_j[j]
+        return np.all(self.problem.r_ij[i[i != -1], j[i != -1]])
 
     def __check_6(self):
         """
-        Check if each package is delivered to its destination
+        Check if each package is delivered to its destination, i.e. if its address is
+        visited by the route of the vehicle it is assigned to. Every route starts at the
+        warehouse, so the packages addressed to it are delivered by any vehicle.
         """
-        for k, p in enumerate(self.problem.packages):
-            j = self.solution.y_k[k]
-            if p.address not in self.solution.x_jv[j]:
-                return False
+        problem = self.problem
+        x_jv, y_k = self.solution.x_jv, self.solution.y_k
 
-        return True
+        # (vehicle, node) of every stop, encoded as vehicle * n + node
+        if isinstance(x_jv, Routes):
+            j = np.repeat(np.arange(x_jv.n_vehicles), x_jv.lengths)
+            v = x_jv.stops
+        else:
+            j, o = np.nonzero(x_jv != problem.graph.warehouse)
+            v = x_jv[j, o]
+        stops = j * problem.n_nodes + v
+
+        return np.all(y_k >= 0) and np.all(
+            np.isin(y_k * problem.n_nodes + problem.h_k, stops)
+            | (problem.h_k == problem.graph.warehouse)
+        )
+
+    def __batch_check_6(self, batch: PopulationBatch):
+        return np.all(self._delivered_pk(batch), axis=1)
+
+    def _delivered_pk(self, batch: PopulationBatch):
+        """Returns which packages are delivered to their address in every individual."""
+        problem = self.problem
+        x_pjv, y_pk = batch.x_pjv, batch.y_pk
+        n_vehicles, n_nodes = x_pjv.shape[1], problem.n_nodes
+
+        # (individual, vehicle, node) of every stop, encoded as (p * m + j) * n + v
+        p, j, o = np.nonzero(x_pjv != problem.graph.warehouse)
+        stops = (p * n_vehicles + j) * n_nodes + x_pjv[p, j, o]
+
+        p = np.arange(len(batch))[:, None]
+        keys = (p * n_vehicles + y_pk) * n_nodes + problem.h_k
+        return (y_pk >= 0) & (
+            np.isin(keys, stops) | (problem.h_k == problem.graph.warehouse)
+        )
+
+    def __scoped_check_6(self, scope: ChangeScope):
+        k = self._scope_packages(scope)
+        y_k = self.solution.y_k[k]
+        if np.any(y_k < 0):
+            return False
+
+        # route of the vehicle carrying every package, padded with the warehouse
+        x_jv = self.solution.x_jv
+        rows = x_jv.padded(y_k) if isinstance(x_jv, Routes) else x_jv[y_k]
+        h_k = self.problem.h_k[k]
+
+        return np.all(np.any(rows == h_k[:, None], axis=1))
 
     def __check_7(self):
         """
         Check if the pickup/delivery time is in the allowed time window.
         """
-        a = np.array([p.start_time for p in self.problem.packages])
-        b = np.array([p.end_time for p in self.problem.packages])
+        a_k, b_k = self.problem.a_k, self.problem.b_k
+        v_k = self.solution.get_v_k()
+
+        return np.all((a_k <= v_k) & (v_k <= b_k))
 
-        return np.all((a <= self.solution.get_v_k()) & (self.solution.get_v_k() <= b))
+    def __batch_check_7(self, batch: PopulationBatch):
+        a_k, b_k = self.problem.a_k, self.problem.b_k
+        v_pk = batch.get_v_pk()
+
+        return np.all((a_k <= v_pk) & (v_pk <= b_k), axis=1)
+
+    def __scoped_check_7(self, scope: ChangeScope):
+        k = self._scope_packages(scope)
+        v_k = self.solution.get_v_k()[k]
+        return np.all((self.problem.a_k[k] <= v_k) & (v_k <= self.problem.b_k[k]))
 
     def __check_9(self):
         """
         Check if the vehicle routes are continuous and start/end at the warehouse.
         """
-        for j in range(self.problem.n_vehicles):
-            route = self.solution.x_jv[j]
-            last = self.problem.n_nodes
+        x_jv = self.solution.x_jv
+        if isinstance(x_jv, Routes):
+            # routes are continuous by construction, they only have to fit in a row
+            return not np.any(x_jv.stops == self.problem.graph.warehouse) and (
+                x_jv.n_vehicles == 0 or x_jv.lengths.max() < self.problem.n_nodes
+            )
 
-            non_zero = np.where(route != 0)[0]
-            if len(non_zero) >= 1:
-                diffs = np.diff(non_zero)
-                if not np.all(diffs == 1) or non_zero[0] != 1 or non_zero[-1] == last:
-                    return False
+        # every route is a run of stops starting right after the warehouse, and is
+        # back at the warehouse in the last column
+        stops = x_jv != self.problem.graph.warehouse
+        n_stops = stops.sum(axis=1)
+        o = np.arange(x_jv.shape[1])
+        expected = (o >= 1) & (o <= n_stops[:, None])
 
-        return True
+        return np.array_equal(stops, expected) and np.all(
+            n_stops < self.problem.n_nodes
+        )
+
+    def __batch_check_9(self, batch: PopulationBatch):
+        x_pjv = batch.x_pjv
+
+        stops = x_pjv != self.problem.graph.warehouse
+        n_stops = stops.sum(axis=2)
+        o = np.arange(x_pjv.shape[2])
+        expected = (o >= 1) & (o <= n_stops[..., None])
+
+        return np.all(stops == expected, axis=(1, 2)) & np.all(
+            n_stops < self.problem.n_nodes, axis=1
+        )
+
+    def __scoped_check_9(self, scope: ChangeScope):
+        x_jv, js = self.solution.x_jv, scope.vehicles
+        if isinstance(x_jv, Routes):
+            routes = [x_jv.route(j) for j in js]
+            return not any(
+                np.any(r == self.problem.graph.warehouse) for r in routes
+            ) and (np.all(x_jv.lengths[js] < self.problem.n_nodes))
+
+        stops = x_jv[js] != self.problem.graph.warehouse
+        n_stops = stops.sum(axis=1)
+        o = np.arange(x_jv.shape[1])
+        expected = (o >= 1) & (o <= n_stops[:, None])
+
+        return np.array_equal(stops, expected) and np.all(
+            n_stops < self.problem.n_nodes
+        )
 
     def __check_11(self):
         """
         Check if the vehicle capacity is respected.
         """
-        for j, veh in enumerate(self.problem.vehicles):
-            for v in range(self.problem.n_nodes):
-                if self.solution.get_m_jv()[j, v] > veh.capacity:
-                    return False
-        return True
+        return not np.any(self.solution.get_m_jv() > self.problem.q_j[:, None])
+
+    def __batch_check_11(self, batch: PopulationBatch):
+        m_pjo = batch.get_m_pjo()
+        return ~np.any(m_pjo > self.problem.q_j[:, None], axis=(1, 2))
+
+    def __scoped_check_11(self, scope: ChangeScope):
+        js = scope.vehicles
+        return not np.any(self.solution.get_m_jv()[js] > self.problem.q_j[js, None])
@@ -65,17 +65,24 @@ def draw_solution_to_axis(solution, axis):
     w = solution.problem.graph.warehouse
     axis.scatter(points[0][w], points[1][w], s=65, c="red")
 
+    graph = solution.problem.graph
     for j in range(solution.problem.n_vehicles):
-        for u, v in zip(solution.x_jv[j], solution.x_jv[j, 1:]):
+        route = solution.get_route(j, True, True)
+        if route.size == 2:
+            continue
+
+        for u, v in zip(route, route[1:]):
+            # follow the streets, with the arrow on the last segment of the path
+            path = graph.path(u, v)
+            if len(path) > 2:
+                axis.plot(*path[:-1].T, color=f"C{j}")
             axis.arrow(
-                *points[:, u],
-                *(points[:, v] - points[:, u]),
+                *path[-2],
+                *(path[-1] - path[-2]),
                 color=f"C{j}",
                 head_width=0.6,
                 length_includes_head=True,
             )
-            if v == solution.problem.graph.warehouse:
-                break
 
     for i in range(points.shape[1]):
         axis.annotate(f"{i}", (points[0][i], points[1][i]))
@@ -1,13 +1,50 @@
 import json
 import inspect
+import os
+import struct
 import sys
+import zipfile
 
 import numpy as np
 
-from model import *
+from model import ArtifactCache, Courier, Graph, Package, Problem, Vehicle
 
 
-def calculate_vehicle_route(problem: Problem, y_k, j):
+def calculate_vehicle_stops(problem: Problem, y_k, j, neighbours=None):
+    """
+    Calculate the stops of a vehicle, in a random order, based on the assignments
+    of packages to vehicles. With neighbour lists, the vehicle rather goes from each
+    stop to a random one of its nearest neighbours still to visit.
+
+    Args:
+        problem (Problem): The problem instance containing the graph and warehouse information.
+        y_k (np.ndarray): Array indicating the vehicle assignment for each package.
+        j (int): The index of the vehicle for which to calculate the stops.
+        neighbours (np.ndarray, optional): Nearest neighbours of every node, see Problem.get_neighbours.
+
+    Returns:
+        np.ndarray: The addresses visited by the vehicle, without the warehouse.
+    """
+    vehicle_packages = np.where(y_k == j)[0]
+
+    vehicle_route = np.unique(problem.h_k[vehicle_packages])
+
+    if neighbours is None:
+        return np.random.permutation(vehicle_route)
+
+    stops = np.empty_like(vehicle_route)
+    remaining = vehicle_route
+    current = problem.graph.warehouse
+    for o in range(stops.size):
+        near = remaining[np.isin(remaining, neighbours[current])]
+        current = np.random.choice(near if near.size else remaining)
+        stops[o] = current
+        remaining = remaining[remaining != current]
+
+    return stops
+
+
+def calculate_vehicle_route(problem: Problem, y_k, j, neighbours=None):
     """
     Calculate the route for a vehicle based on the assignments of packages to vehicles.
 
@@ -15,16 +52,13 @@ def calculate_vehicle_route(problem: Problem, y_k, j):
         problem (Problem): The problem instance containing the graph and warehouse information.
         y_k (np.ndarray): Array indicating the vehicle assignment for each package.
         j (int): The index of the vehicle for which to calculate the route.
+        neighbours (np.ndarray, optional): Nearest neighbours of every node, see Problem.get_neighbours.
 
     Returns:
         np.ndarray: The route for the vehicle.
     """
     route = np.full(problem.n_nodes + 1, problem.graph.warehouse, dtype=int)
-    vehicle_packages = np.where(y_k == j)[0]
-
-    vehicle_route = np.unique([problem.packages[k].address for k in vehicle_packages])
-
-    vehicle_route = np.random.permutation(vehicle_route)
+    vehicle_route = calculate_vehicle_stops(problem, y_k, j, neighbours)
 
     for v_i, v in enumerate(vehicle_route, start=1):
         route[v_i] = v
@@ -79,7 +113,29 @@ def save_to_json(self: Problem, path):
         json.dump(problem_data, f, indent=2)
 
 
-def load_from_json(json_file):
+def load_from_json(json_file, cache: ArtifactCache | None = None):
+    """
+    Load a problem from a JSON instance. With a cache, the first load also stores the
+    problem in the binary format, keyed by the digest of the file, and later loads of
+    the same file map that copy instead of parsing the JSON again.
+
+    Args:
+        json_file (str): Path of the JSON file.
+        cache (ArtifactCache, optional): On-disk cache of the binary copies of the instances.
+
+    Returns:
+        Problem: The loaded problem.
+    """
+    if cache:
+        key = cache.file_digest(json_file)
+        path = cache.get(key, "problem.npz")
+        if path is not None:
+            return load_from_npz(path)
+
+        problem = load_from_json(json_file)
+        cache.put(key, "problem.npz", lambda f: save_to_npz(problem, f))
+        return problem
+
     couriers = []
     vehicles = []
     permissions = []
@@ -111,3 +167,139 @@ def load_from_json(json_file):
         permissions,
         graph,
     )
+
+
+def save_to_npz(problem: Problem, path):
+    """
+    Save a problem to a binary instance file: an uncompressed .npz archive holding the
+    columns of the couriers, vehicles and packages, the permissions and the arrays of
+    the graph (points and travel matrices), which load_from_npz() maps in place.
+
+    Args:
+        problem (Problem): The problem to save.
+        path (str | file): Path of the .npz file, or a binary file to write it to.
+    """
+    arrays = {
+        "c_i": problem.c_i,
+        "b_i": problem.b_i,
+        "q_j": problem.q_j,
+        "p_j": problem.p_j,
+        "h_k": problem.h_k,
+        "w_k": problem.w_k,
+        "a_k": problem.a_k,
+        "b_k": problem.b_k,
+        "is_pickup": problem.is_pickup,
+        "permissions": np.array(problem.permissions, dtype=int).reshape(-1, 2),
+    }
+    for name, array in problem.graph.to_arrays().items():
+        arrays[f"graph_{name}"] = array
+
+    np.savez(path, **arrays)
+
+
+def _map_npz(npz_file, mmap=True):
+    """
+    Read the arrays of an uncompressed .npz archive. The arrays are memory-mapped
+    straight from the archive, each member being a plain .npy file stored in it,
+    unless mmap is False or the member is compressed, empty or a scalar.
+    """
+    arrays = {}
+    with zipfile.ZipFile(npz_file) as archive, open(npz_file, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename.removesuffix(".npy")
+            with archive.open(info) as member:
+                version = np.lib.format.read_magic(member)
+                shape, fortran_order, dtype = (
+                    np.lib.format.read_array_header_1_0(member)
+                    if version == (1, 0)
+                    else np.lib.format.read_array_header_2_0(member)
+                )
+                header_size = member.tell()
+
+            if (
+                not mmap
+                or info.compress_type != zipfile.ZIP_STORED
+                or dtype.hasobject
+                or not shape
+                or not np.prod(shape)
+            ):
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # skip the local file header, whose extra field may differ from the
+            # central directory one
+            f.seek(info.header_offset + 26)
+            name_size, extra_size = struct.unpack("<HH", f.read(4))
+            offset = info.header_offset + 30 + name_size + extra_size + header_size
+
+            arrays[name] = np.memmap(
+                npz_file,
+                dtype=dtype,
+                mode="r",
+                offset=offset,
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def load_from_npz(npz_file, mmap=True):
+    """
+    Load a problem saved by save_to_npz(). The columns and travel matrices are mapped
+    from the file rather than parsed, so large instances load in constant time.
+
+    Args:
+        npz_file (str): Path of the .npz file.
+        mmap (bool): Whether to memory-map the arrays rather than read them. Defaults to True.
+
+    Returns:
+        Problem: The loaded problem.
+    """
+    arrays = _map_npz(npz_file, mmap)
+
+    couriers = [
+        Courier(*c) for c in zip(arrays["c_i"].tolist(), arrays["b_i"].tolist())
+    ]
+    vehicles = [
+        Vehicle(*v) for v in zip(arrays["q_j"].tolist(), arrays["p_j"].tolist())
+    ]
+    packages = [
+        Package(h, w, a, b, "pickup" if pickup else "delivery")
+        for h, w, a, b, pickup in zip(
+            arrays["h_k"].tolist(),
+            arrays["w_k"].tolist(),
+            arrays["a_k"].tolist(),
+            arrays["b_k"].tolist(),
+            arrays["is_pickup"].tolist(),
+        )
+    ]
+    permissions = [(i, j) for i, j in arrays["permissions"].tolist()]
+
+    graph = Graph.from_arrays(
+        {
+            name.removeprefix("graph_"): array
+            for name, array in arrays.items()
+            if name.startswith("graph_")
+        }
+    )
+
+    return Problem(couriers, vehicles, packages, permissions, graph)
+
+
+def convert_json_to_npz(json_file, npz_file=None):
+    """
+    Convert a JSON instance to the binary format.
+
+    Args:
+        json_file (str): Path of the JSON file.
+        npz_file (str, optional): Path of the .npz file, next to the JSON file by default.
+
+    Returns:
+        str: Path of the written .npz file.
+    """
+    if npz_file is None:
+        npz_file = os.path.splitext(json_file)[0] + ".npz"
+
+    save_to_npz(load_from_json(json_file), npz_file)
+    return npz_file
@@ -0,0 +1,420 @@
+"""Benchmarks of the solution evaluation kernels and feasibility checks against the
+original loops.
+
+Run from the repository root (or the ``tests`` directory):
+
+    python tests/benchmarks.py [problems/03-big.json ...]
+"""
+
+import glob
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TESTS_DIR, "..", "src"))
+
+from ga import GA  # noqa: E402
+from generator import Generator  # noqa: E402
+from model import ArtifactCache, PopulationBatch, Problem, Solution  # noqa: E402
+from solution_checker import SolutionChecker  # noqa: E402
+from utils import load_from_json, load_from_npz, save_to_npz  # noqa: E402
+from utils.utils import _map_npz  # noqa: E402
+
+
+def loop_l_vj(solution: Solution):
+    problem = solution.problem
+    l_vj = np.zeros((problem.graph.n_nodes, problem.n_vehicles))
+    for j in range(problem.n_vehicles):
+        for u, v in zip(solution.x_jv[j], solution.x_jv[j, 1:]):
+            l_vj[v, j] = l_vj[u, j] + problem.s_uv[u, v]
+            if v == problem.graph.warehouse:
+                break
+    return l_vj
+
+
+def loop_d_j(solution: Solution):
+    problem = solution.problem
+    d_j = np.zeros(problem.n_vehicles)
+    for j in range(problem.n_vehicles):
+        for u, v in zip(solution.x_jv[j], solution.x_jv[j, 1:]):
+            d_j[j] += problem.g_uv[u, v]
+            if v == problem.graph.warehouse:
+                break
+    return d_j
+
+
+def loop_t_i(solution: Solution):
+    problem = solution.problem
+    l_vj = loop_l_vj(solution)
+    t_i = np.zeros(problem.n_couriers)
+    for i in range(problem.n_couriers):
+        j = np.where(solution.z_j == i)[0]
+        if j.size:
+            t_i[i] = l_vj[problem.graph.warehouse, j[0]]
+    return t_i
+
+
+def loop_v_k(solution: Solution):
+    problem = solution.problem
+    l_vj = loop_l_vj(solution)
+    v_k = np.zeros(problem.n_packages)
+    for k, p in enumerate(problem.packages):
+        for j in range(problem.n_vehicles):
+            if solution.y_k[k] == j:
+                v_k[k] += l_vj[p.address, j]
+    return v_k
+
+
+def loop_m_jv(solution: Solution):
+    problem = solution.problem
+    warehouse = problem.graph.warehouse
+    m_jv = np.zeros((problem.n_vehicles, problem.graph.n_nodes))
+    for j in range(problem.n_vehicles):
+        s = 0
+        for k, p in enumerate(problem.packages):
+            if p.type == "delivery" and solution.y_k[k] == j:
+                s += p.weight
+        m_jv[j, warehouse] = s
+
+        for v, next_v in zip(solution.x_jv[j], solution.x_jv[j, 1:]):
+            if next_v == warehouse:
+                break
+            delivery = 0
+            for k, p in enumerate(problem.packages):
+                if (
+                    p.type == "delivery"
+                    and p.address == next_v
+                    and solution.y_k[k] == j
+                ):
+                    delivery += p.weight
+            pickup = 0
+            for k, p in enumerate(problem.packages):
+                if p.type == "pickup" and p.address == next_v and solution.y_k[k] == j:
+                    pickup += p.weight
+            m_jv[j, next_v] = m_jv[j, v] - delivery + pickup
+    return m_jv
+
+
+KERNELS = {
+    "l_vj": (loop_l_vj, Solution.get_l_vj),
+    "d_j": (loop_d_j, Solution.get_d_j),
+    "t_i": (loop_t_i, Solution.get_t_i),
+    "v_k": (loop_v_k, Solution.get_v_k),
+    "m_jv": (loop_m_jv, Solution.get_m_jv),
+}
+
+
+def loop_check_1(solution: Solution):
+    non_empty = solution.z_j != -1
+    return np.unique(solution.z_j[non_empty]).size == non_empty.sum()
+
+
+def loop_check_4(solution: Solution):
+    b_i = np.array([c.work_limit for c in solution.problem.couriers])
+    return np.all(solution.get_t_i() <= b_i)
+
+
+def loop_check_5(solution: Solution):
+    permissions = set(solution.problem.permissions)
+    for j, i in enumerate(solution.z_j):
+        if i != -1 and (i, j) not in permissions:
+            return False
+    return True
+
+
+def loop_check_6(solution: Solution):
+    x_jv = solution.get_x_jv()
+    for k, p in enumerate(solution.problem.packages):
+        j = solution.y_k[k]
+        if p.address not in x_jv[j]:
+            return False
+    return True
+
+
+def loop_check_7(solution: Solution):
+    packages = solution.problem.packages
+    a = np.array([p.start_time for p in packages])
+    b = np.array([p.end_time for p in packages])
+    return np.all((a <= solution.get_v_k()) & (solution.get_v_k() <= b))
+
+
+def loop_check_9(solution: Solution):
+    problem = solution.problem
+    for j in range(problem.n_vehicles):
+        route = solution.x_jv[j]
+        last = problem.n_nodes
+
+        non_zero = np.where(route != 0)[0]
+        if len(non_zero) >= 1:
+            diffs = np.diff(non_zero)
+            if not np.all(diffs == 1) or non_zero[0] != 1 or non_zero[-1] == last:
+                return False
+    return True
+
+
+def loop_check_11(solution: Solution):
+    for j, veh in enumerate(solution.problem.vehicles):
+        for v in range(solution.problem.n_nodes):
+            if solution.get_m_jv()[j, v] > veh.capacity:
+                return False
+    return True
+
+
+CHECKS = {
+    "check_1": loop_check_1,
+    "check_4": loop_check_4,
+    "check_5": loop_check_5,
+    "check_6": loop_check_6,
+    "check_7": loop_check_7,
+    "check_9": loop_check_9,
+    "check_11": loop_check_11,
+}
+
+
+def fresh(solution: Solution):
+    return Solution(solution.problem, solution.x_jv, solution.y_k, solution.z_j)
+
+
+def benchmark_kernels(problem: Problem, solutions: list[Solution], repeat=5):
+    """Checks that every kernel is bit-identical to its loop and times both."""
+    results = {}
+    for name, (loop, kernel) in KERNELS.items():
+        for s in solutions:
+            expected, actual = loop(s), kernel(fresh(s))
+            assert np.array_equal(expected, actual), f"{name} differs from the loop"
+
+        loop_time = min(
+            timeit.repeat(lambda: [loop(s) for s in solutions], number=1, repeat=repeat)
+        )
+        kernel_time = min(
+            timeit.repeat(
+                lambda: [kernel(fresh(s)) for s in solutions], number=1, repeat=repeat
+            )
+        )
+        results[name] = (loop_time, kernel_time)
+    return results
+
+
+def benchmark_checks(problem: Problem, solutions: list[Solution], repeat=5):
+    """Checks that every vectorized check agrees with its loop and times both."""
+    checker = SolutionChecker(problem)
+    checks = dict(checker.checks)
+
+    def vectorized(check, solution):
+        checker.solution = solution
+        return check()
+
+    results = {}
+    for name, loop in CHECKS.items():
+        check = checks[name]
+        for s in solutions:
+            expected, actual = loop(fresh(s)), vectorized(check, fresh(s))
+            assert bool(expected) == bool(actual), f"{name} differs from the loop"
+
+        loop_time = min(
+            timeit.repeat(
+                lambda: [loop(fresh(s)) for s in solutions], number=1, repeat=repeat
+            )
+        )
+        check_time = min(
+            timeit.repeat(
+                lambda: [vectorized(check, fresh(s)) for s in solutions],
+                number=1,
+                repeat=repeat,
+            )
+        )
+        results[name] = (loop_time, check_time)
+    return results
+
+
+def benchmark_batch(problem: Problem, solutions: list[Solution], repeat=5):
+    """Checks that the batched feasibility check agrees with is_feasible() and times
+    both over the whole list of solutions.
+    """
+    checker = SolutionChecker(problem)
+    batch = PopulationBatch.from_solutions(problem, solutions)
+
+    expected = [checker.is_feasible(fresh(s)) for s in solutions]
+    actual = checker.is_feasible_batch(batch.x_pjv, batch.y_pk, batch.z_pj)
+    assert np.array_equal(expected, actual), "is_feasible_batch differs"
+
+    loop_time = min(
+        timeit.repeat(
+            lambda: [checker.is_feasible(fresh(s)) for s in solutions],
+            number=1,
+            repeat=repeat,
+        )
+    )
+    batch_time = min(
+        timeit.repeat(
+            lambda: checker.is_feasible_batch(batch.x_pjv, batch.y_pk, batch.z_pj),
+            number=1,
+            repeat=repeat,
+        )
+    )
+    return loop_time, batch_time
+
+
+def check_memmap(problem: Problem, solutions: list[Solution]):
+    """Checks that, with the travel matrices memory-mapped in float32, the solutions
+    and the batched population give the same matrices, verdicts and costs.
+    """
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        mapped = problem.to_memmap(directory)
+        solutions = [Solution(mapped, s.x_jv, s.y_k, s.z_j) for s in solutions]
+        batch = PopulationBatch.from_solutions(mapped, solutions)
+
+        for name, kernel, batched in (
+            ("t_i", Solution.get_t_i, batch.get_t_pi),
+            ("v_k", Solution.get_v_k, batch.get_v_pk),
+            ("d_j", Solution.get_d_j, batch.get_d_pj),
+        ):
+            expected = np.array([kernel(fresh(s)) for s in solutions])
+            assert np.array_equal(expected, batched()), f"float32 {name} differs"
+
+        checker = SolutionChecker(mapped)
+        expected = [checker.is_feasible(fresh(s)) for s in solutions]
+        actual = checker.is_feasible_batch(batch.x_pjv, batch.y_pk, batch.z_pj)
+        assert np.array_equal(expected, actual), "float32 is_feasible_batch differs"
+
+        ga = GA(mapped, solutions, C=1.0, alpha=1.0)
+        expected = [ga.get_cost(fresh(s)) for s in solutions]
+        assert np.array_equal(expected, ga.get_costs(batch)), "float32 costs differ"
+
+
+COLUMNS = ("c_i", "b_i", "q_j", "p_j", "h_k", "w_k", "a_k", "b_k", "is_pickup")
+
+
+def check_npz(problem: Problem):
+    """Checks that saving a problem to .npz and loading it back, with and without
+    memory-mapping the arrays, gives the same columns, graph and fingerprint.
+    """
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        path = os.path.join(directory, "problem.npz")
+        save_to_npz(problem, path)
+
+        # the members memory-mapped from the hand-parsed offsets must hold the
+        # same data as the ones numpy reads
+        with np.load(path) as archive:
+            mapped = _map_npz(path)
+            assert mapped.keys() == set(archive.files), "npz members differ"
+            for name, array in mapped.items():
+                expected = archive[name]
+                assert np.array_equal(expected, array), f"npz {name} differs"
+                assert expected.dtype == array.dtype, f"npz {name} dtype differs"
+                if expected.size and expected.ndim:
+                    assert isinstance(array, np.memmap), f"npz {name} not mapped"
+
+        for mmap in (True, False):
+            loaded = load_from_npz(path, mmap)
+            for name in COLUMNS:
+                expected, actual = getattr(problem, name), getattr(loaded, name)
+                assert np.array_equal(expected, actual), f"npz {name} differs"
+                assert expected.dtype == actual.dtype, f"npz {name} dtype differs"
+
+            assert loaded.permissions == problem.permissions, "npz permissions differ"
+            expected, actual = problem.graph.to_arrays(), loaded.graph.to_arrays()
+            assert expected.keys() == actual.keys(), "npz graph differs"
+            for name in expected:
+                assert np.array_equal(expected[name], actual[name]), (
+                    f"npz {name} differs"
+                )
+            assert loaded.fingerprint == problem.fingerprint, "npz fingerprint differs"
+
+
+def directory_size(directory: str):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory)
+        for name in names
+    )
+
+
+def check_cache(problem: Problem, num_to_find=8, max_attempts=64):
+    """Checks that generate_many_feasible() caches seeded populations: a hit returns
+    the population found by the search, other seeds or settings miss, and eviction
+    keeps the cache directory under its byte limit.
+    """
+
+    def generate(cache, seed, **settings):
+        settings = {"num_to_find": num_to_find, "max_attempts": max_attempts} | settings
+        return Generator(problem, cache=cache).generate_many_feasible(
+            verbose=False, relaxed=True, seed=seed, **settings
+        )
+
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        cache = ArtifactCache(directory)
+
+        population = generate(cache, 0)
+        assert population and (cache.hits, cache.misses) == (0, 1), "cache not missed"
+        assert population == generate(None, 0), "seeded search not repeatable"
+
+        hit = generate(cache, 0)
+        assert (cache.hits, cache.misses) == (1, 1), "cache not hit"
+        assert hit == population, "cached population differs"
+
+        generate(cache, 1)
+        assert (cache.hits, cache.misses) == (1, 2), "other seed hit the cache"
+        generate(cache, 0, num_to_find=num_to_find // 2)
+        assert (cache.hits, cache.misses) == (1, 3), "other size hit the cache"
+        Generator(problem, csr_routes=True, cache=cache).generate_many_feasible(
+            num_to_find, max_attempts, verbose=False, relaxed=True, seed=0
+        )
+        assert (cache.hits, cache.misses) == (1, 4), "other routes hit the cache"
+
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        cache = ArtifactCache(directory)
+        generate(cache, 0)
+        cache.max_bytes = 5 * cache.size() // 2
+
+        for seed in range(1, 6):
+            generate(cache, seed)
+            assert cache.size() <= cache.max_bytes, "cache over its byte limit"
+            assert directory_size(directory) <= cache.max_bytes, "stale cache files"
+        assert cache.misses == 6 and len(cache._files()) == 2, "cache not evicted"
+
+
+def main(paths):
+    np.random.seed(0)
+    for path in paths:
+        problem = load_from_json(path)
+        solutions = [
+            Generator(problem).generate_solution(relaxed=True) for _ in range(50)
+        ]
+
+        print(f"{os.path.basename(path)}: {problem.info()}")
+        for name, (loop_time, kernel_time) in benchmark_kernels(
+            problem, solutions
+        ).items():
+            print(
+                f"  {name:5} loop {loop_time * 1e3:8.2f} ms"
+                f"  kernel {kernel_time * 1e3:8.2f} ms"
+                f"  x{loop_time / kernel_time:6.1f}"
+            )
+        for name, (loop_time, check_time) in benchmark_checks(
+            problem, solutions
+        ).items():
+            print(
+                f"  {name:8} loop {loop_time * 1e3:8.2f} ms"
+                f"  check {check_time * 1e3:8.2f} ms"
+                f"  x{loop_time / check_time:6.1f}"
+            )
+        loop_time, batch_time = benchmark_batch(problem, solutions)
+        print(
+            f"  {'batch':8} loop {loop_time * 1e3:8.2f} ms"
+            f"  batch {batch_time * 1e3:8.2f} ms"
+            f"  x{loop_time / batch_time:6.1f}"
+        )
+        check_memmap(problem, solutions)
+        check_npz(problem)
+        check_cache(problem)
+
+
+if __name__ == "__main__":
+    main(
+        sys.argv[1:] or sorted(glob.glob(os.path.join(TESTS_DIR, "problems", "*.json")))
+    )
@@ -0,0 +1,26 @@
+"""Converts JSON problem instances to the binary .npz format, next to the JSON files.
+
+Run from the repository root (or the ``tests`` directory):
+
+    python tests/convert_problems.py [problems/03-big.json ...]
+"""
+
+import glob
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TESTS_DIR, "..", "src"))
+
+from utils import convert_json_to_npz  # noqa: E402
+
+
+def main(paths):
+    for path in paths:
+        print(f"{path} -> {convert_json_to_npz(path)}")
+
+
+if __name__ == "__main__":
+    main(
+        sys.argv[1:] or sorted(glob.glob(os.path.join(TESTS_DIR, "problems", "*.json")))
+    )